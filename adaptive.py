@@ -0,0 +1,100 @@
+import math
+import random
+from collections import defaultdict
+from statistics import NormalDist
+
+
+def wilson_interval(successes: int, n: int, confidence: float = 0.95):
+    """
+    Wilson score interval of a binomial proportion.
+
+    Returns:
+        ``(low, high)``, or ``(0.0, 1.0)`` without observations
+    """
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def stratified_order(index_values, indices: list, seed: int = 0) -> list:
+    """
+    Random order of ``indices`` that keeps the injection types balanced.
+
+    Rows are grouped by their dataset ``index`` (the same ``raw`` text with
+    each injection type), the groups are shuffled and their rows emitted
+    together, so at any point every injection type has seen about the same
+    number of texts and the clean and injected versions of a text stay
+    adjacent for the prefix cache.
+
+    Args:
+        index_values: Dataset ``index`` of every row position, e.g. ``LazyDataset.column("index")``
+        indices: Row positions to order
+        seed: Seed of the shuffle
+    """
+    groups = defaultdict(list)
+    for position in indices:
+        groups[index_values[position]].append(position)
+    keys = list(groups)
+    random.Random(seed).shuffle(keys)
+    return [position for key in keys for position in groups[key]]
+
+
+class SequentialSampler:
+    """
+    Early stopping per (variant, injection_type) cell.
+
+    Each cell tracks how often the prediction differs from the label (the
+    attack success rate for injected rows, one minus accuracy for clean
+    ones). A cell stops being scheduled once it has ``min_samples``
+    observations and its Wilson interval is narrower than ``target_width``.
+    """
+
+    def __init__(self, target_width: float = 0.05, confidence: float = 0.95, min_samples: int = 30):
+        self.target_width = target_width
+        self.confidence = confidence
+        self.min_samples = min_samples
+        self.errors = defaultdict(int)
+        self.observed = defaultdict(int)
+        self.scheduled = defaultdict(int)
+        self.skipped = defaultdict(int)
+
+    def interval(self, cell):
+        return wilson_interval(self.errors[cell], self.observed[cell], self.confidence)
+
+    def converged(self, cell) -> bool:
+        if self.observed[cell] < self.min_samples:
+            return False
+        low, high = self.interval(cell)
+        return high - low <= self.target_width
+
+    def admit(self, cell) -> bool:
+        """Whether one more unit of ``cell`` should be scheduled; counts the decision."""
+        if self.converged(cell):
+            self.skipped[cell] += 1
+            return False
+        self.scheduled[cell] += 1
+        return True
+
+    def update(self, cell, error: bool):
+        """Record a finished unit; ``error`` is whether its prediction differs from the label."""
+        self.observed[cell] += 1
+        self.errors[cell] += int(error)
+
+    def report(self) -> dict:
+        cells = {}
+        for cell in sorted(set(self.scheduled) | set(self.observed)):
+            low, high = self.interval(cell)
+            n = self.observed[cell]
+            cells["/".join(name or "plain" for name in cell)] = {
+                "n": n,
+                "error_rate": round(self.errors[cell] / n, 4) if n else None,
+                "interval": [round(low, 4), round(high, 4)],
+                "converged": self.converged(cell),
+                "skipped": self.skipped[cell],
+            }
+        return cells
@@ -0,0 +1,72 @@
+import json
+
+from utils import build_messages
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+def make_custom_id(task_name: str, index: int, variant: str, stage: str) -> str:
+    """
+    Build the stable ``custom_id`` of one (item, variant, stage) request.
+
+    Args:
+        task_name: Task the request belongs to, e.g. "toxic_comment"
+        index: Position of the item in the dataset
+        variant: Prompt variant name ("" for the plain template)
+        stage: "analysis", "judge" or "structured"
+    Returns:
+        Identifier such as ``toxic_comment:12:sandwich:analysis``
+    """
+    return f"{task_name}:{index}:{variant}:{stage}"
+
+
+def parse_custom_id(custom_id: str):
+    """Inverse of :func:`make_custom_id`, returning ``(task_name, index, variant, stage)``."""
+    task_name, index, variant, stage = custom_id.split(":")
+    return task_name, int(index), variant, stage
+
+
+def batch_request(custom_id: str, model_name: str, question: str, params: dict = None) -> dict:
+    """
+    Build one line of an OpenAI Batch API input file.
+
+    Args:
+        custom_id: Identifier from :func:`make_custom_id`
+        model_name: Name of the language model to use
+        question: Question to ask
+        params: Extra request parameters, e.g. from ``utils.guided_decoding_params``
+    Returns:
+        Batch request dict
+    """
+    body = {"model": model_name, "messages": build_messages(question)}
+    for key, value in (params or {}).items():
+        # extra_body的内容在HTTP请求中是平铺在请求体里的
+        if key == "extra_body":
+            body.update(value)
+        else:
+            body[key] = value
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+
+def read_batch_output(paths: list) -> dict:
+    """
+    Read OpenAI Batch API output files (also produced by ``vllm run-batch``).
+
+    Args:
+        paths: Output JSONL files; later files override earlier ones for the same ``custom_id``
+    Returns:
+        Mapping from ``custom_id`` to ``(content, error)``, exactly one of which is None
+    """
+    outputs = {}
+    for path in paths:
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if record.get("error") is None and response.get("status_code", 200) == 200:
+                    outputs[record["custom_id"]] = (response["body"]["choices"][0]["message"]["content"], None)
+                else:
+                    outputs[record["custom_id"]] = (None, str(record.get("error") or response.get("body")))
+    return outputs
@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from rich import print
+from rich.table import Table
+
+from metrics import distribution
+from task_registry import TASKS, get_task
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 越小越差的指标和越大越差的指标，用于和基线比较
+HIGHER_IS_BETTER = ("requests_per_s",)
+LOWER_IS_BETTER = ("cpu_ms_per_request", "max_rss_mb", "latency_p99_s")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(port: int, options: list, timeout: float = 30.0) -> subprocess.Popen:
+    """Start ``mock_server.py`` in its own process and wait until it answers."""
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "mock_server.py"), "--port", str(port)] + options,
+                               stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Mock server exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Mock server did not start within {timeout}s")
+
+
+def prepare_workdir(task_names: list) -> tuple:
+    """
+    Create a scratch directory mirroring the dataset layout of ``tasks/``.
+
+    The runner is started inside it, so result files of the benchmark runs
+    never touch the real ``tasks/*/results`` directories.
+
+    Returns:
+        Tuple of (directory, tasks whose dataset exists)
+    """
+    workdir = tempfile.mkdtemp(prefix="criteria_bench_")
+    available = []
+    for name in task_names:
+        spec = get_task(name)
+        source = os.path.join(ROOT, spec.dataset_path)
+        if not os.path.exists(source):
+            print(f"[yellow]{name}: Dataset {spec.dataset_path} not found, skipped[/yellow]")
+            continue
+        target = os.path.join(workdir, spec.dataset_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.symlink(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+        available.append(name)
+    return workdir, available
+
+
+def run_measured(command: list, cwd: str, log_path: str) -> dict:
+    """
+    Run a command and measure its wall time, CPU time and peak memory.
+
+    CPU time and peak RSS come from ``wait4`` and are None where it is not available.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    with open(log_path, "w") as log:
+        start = time.monotonic()
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(process.pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+            # 防止Popen析构时再次回收子进程
+            process.returncode = returncode
+            # Linux上ru_maxrss的单位为KB
+            cpu_s, max_rss_mb = usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024
+        else:
+            returncode = process.wait()
+            cpu_s = max_rss_mb = None
+        wall_s = time.monotonic() - start
+    if returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} exited with code {returncode}, see {log_path}")
+    return {"wall_s": wall_s, "cpu_s": cpu_s, "max_rss_mb": max_rss_mb}
+
+
+def level_result(mode: str, concurrency: int, measured: dict, startup_cpu_s: float, requests: int, errors: int,
+                 latency: dict, ttft: dict) -> dict:
+    cpu_s = measured["cpu_s"]
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "wall_s": round(measured["wall_s"], 3),
+        "requests_per_s": round(requests / measured["wall_s"], 2),
+        "cpu_s": round(cpu_s, 3) if cpu_s is not None else None,
+        # 减去解释器启动和导入模块的CPU时间，只保留每个请求的开销
+        "cpu_ms_per_request": round(1000 * max(0.0, cpu_s - startup_cpu_s) / requests, 4) if cpu_s is not None and requests else None,
+        "max_rss_mb": round(measured["max_rss_mb"], 1) if measured["max_rss_mb"] is not None else None,
+        "latency_p50_s": (latency or {}).get("p50"),
+        "latency_p99_s": (latency or {}).get("p99"),
+        "ttft_p99_s": (ttft or {}).get("p99"),
+    }
+
+
+def bench_runner(task_names: list, concurrency: int, url: str, workdir: str, sample_shards: int,
+                 runner_options: list, startup_cpu_s: float) -> dict:
+    """Run the task runner on a deterministic sample of the datasets at a fixed concurrency."""
+    model_name = f"benchmark-c{concurrency}"
+    metrics_path = os.path.join(workdir, f"{model_name}_metrics.json")
+    command = [sys.executable, os.path.join(ROOT, "run_tasks.py"), "--tasks", *task_names, "--model_name", model_name,
+               "--endpoints", url, "--cache_mode", "off", "--initial_concurrency", str(concurrency),
+               "--max_concurrency", str(concurrency), "--metrics_path", metrics_path]
+    if sample_shards > 1:
+        command += ["--shard", f"1/{sample_shards}"]
+    measured = run_measured(command + runner_options, workdir, os.path.join(workdir, f"{model_name}.log"))
+    with open(metrics_path, "r") as f:
+        overall = json.load(f)["overall"]
+    return level_result("runner", concurrency, measured, startup_cpu_s, overall["requests"], overall["errors"],
+                        overall["latency_s"], overall["ttft_s"])
+
+
+def bench_ask_question(concurrency: int, url: str, workdir: str, requests: int, startup_cpu_s: float) -> dict:
+    """Call ``utils.ask_question`` from a thread pool in a child process."""
+    output = os.path.join(workdir, f"ask_question-c{concurrency}.json")
+    command = [sys.executable, os.path.join(ROOT, "benchmark.py"), "--worker", "ask_question", "--worker_url", url,
+               "--worker_requests", str(requests), "--worker_concurrency", str(concurrency), "--worker_output", output]
+    measured = run_measured(command, workdir, os.path.join(workdir, f"ask_question-c{concurrency}.log"))
+    with open(output, "r") as f:
+        worker = json.load(f)
+    return level_result("ask_question", concurrency, measured, startup_cpu_s, worker["requests"], worker["errors"],
+                        worker["latency_s"], None)
+
+
+def ask_question_worker(url: str, requests: int, concurrency: int, output: str):
+    """子进程：用线程池并发调用utils.ask_question，记录每个请求的延迟"""
+    import utils
+
+    utils.configure_endpoints([url])
+    spec = get_task("toxic_comment")
+    prompts = [spec.render(spec.variants[0][1], {"text": f"benchmark comment {number}"}) for number in range(requests)]
+
+    def call(prompt):
+        start = time.monotonic()
+        try:
+            utils.ask_question(prompt, model_name="benchmark")
+        except Exception:
+            return None
+        return time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(call, prompts))
+    with open(output, "w") as f:
+        json.dump({"requests": len(latencies), "errors": latencies.count(None), "latency_s": distribution(latencies)}, f)
+
+
+def startup_cpu(workdir: str, module: str) -> float:
+    """CPU seconds of starting the interpreter and importing ``module``, subtracted from every level."""
+    measured = run_measured([sys.executable, "-c", f"import {module}"], workdir, os.path.join(workdir, f"startup_{module}.log"))
+    return measured["cpu_s"] or 0.0
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """
+    Compare benchmark levels with a baseline run.
+
+    Returns:
+        Messages for every metric worse than the baseline by more than ``tolerance`` (relative)
+    """
+    previous = {(level["mode"], level["concurrency"]): level for level in baseline}
+    regressions = []
+    for level in results:
+        reference = previous.get((level["mode"], level["concurrency"]))
+        if reference is None:
+            continue
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            value, expected = level.get(metric), reference.get(metric)
+            if value is None or not expected:
+                continue
+            change = (value - expected) / expected
+            if (metric in HIGHER_IS_BETTER and change < -tolerance) or (metric in LOWER_IS_BETTER and change > tolerance):
+                regressions.append(f"{level['mode']} c={level['concurrency']}: {metric} {expected} -> {value} ({change:+.1%})")
+    return regressions
+
+
+def print_results(results: list):
+    table = Table(title="Harness benchmark")
+    columns = [("mode", "mode"), ("concurrency", "conc"), ("requests", "req"), ("errors", "err"), ("requests_per_s", "req/s"),
+               ("cpu_ms_per_request", "cpu ms/req"), ("max_rss_mb", "rss MB"), ("latency_p50_s", "p50 s"),
+               ("latency_p99_s", "p99 s"), ("ttft_p99_s", "ttft p99 s")]
+    for column, header in columns:
+        table.add_column(header, justify="left" if column == "mode" else "right")
+    for level in results:
+        table.add_row(*("-" if level[column] is None else f"{level[column]:.4g}" if isinstance(level[column], float) else str(level[column])
+                        for column, _ in columns))
+    print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=str, nargs="+", default=list(TASKS), choices=list(TASKS), help="Classifiers to run against the mock server")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[16, 64, 256], help="Concurrency levels to measure")
+    parser.add_argument("--sample_shards", type=int, default=10, help="Run shard 1/N of every dataset to keep each level short (1 runs everything)")
+    parser.add_argument("--modes", type=str, nargs="+", default=["runner", "ask_question"], choices=["runner", "ask_question"], help="runner: run_tasks.py end to end; ask_question: utils.ask_question from a thread pool")
+    parser.add_argument("--ask_requests", type=int, default=500, help="Requests per level in ask_question mode")
+    parser.add_argument("--runner_options", type=str, default="", help='Extra run_tasks.py options, e.g. "--pipeline structured --no_stream"')
+    parser.add_argument("--mock_options", type=str, default="", help='Extra mock_server.py options, e.g. "--ttft fixed:0.2 --errors 429=0.01"')
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, default=None, help="JSON file of an earlier run; exit with code 1 if a metric regressed")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Relative change of a metric counted as a regression")
+    parser.add_argument("--keep_workdir", action="store_true", help="Keep the scratch directory with the logs, results and metrics of every level")
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--worker_url", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--worker_requests", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--worker_concurrency", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--worker_output", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker == "ask_question":
+        ask_question_worker(args.worker_url, args.worker_requests, args.worker_concurrency, args.worker_output)
+        return
+
+    workdir, task_names = prepare_workdir(args.tasks)
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/v1"
+    mock = start_mock_server(port, args.mock_options.split())
+    results = []
+    try:
+        if "runner" in args.modes and task_names:
+            startup = startup_cpu(workdir, "runner")
+            for concurrency in args.concurrency:
+                results.append(bench_runner(task_names, concurrency, url, workdir, args.sample_shards, args.runner_options.split(), startup))
+                print(f"runner c={concurrency}: {results[-1]['requests_per_s']} requests/s")
+        if "ask_question" in args.modes:
+            startup = startup_cpu(workdir, "utils")
+            for concurrency in args.concurrency:
+                results.append(bench_ask_question(concurrency, url, workdir, args.ask_requests, startup))
+                print(f"ask_question c={concurrency}: {results[-1]['requests_per_s']} requests/s")
+    finally:
+        mock.terminate()
+        mock.wait()
+        if args.keep_workdir:
+            print(f"Benchmark files kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"tasks": task_names, "sample_shards": args.sample_shards, "runner_options": args.runner_options,
+                       "mock_options": args.mock_options, "levels": results}, f, indent=2)
+        print(f"Wrote benchmark results to {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f)["levels"], args.tolerance)
+        if regressions:
+            print("[red]Regressions against the baseline:[/red]")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print(f"No regression beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+# 用本地模拟服务压测任务运行器和utils.ask_question本身的开销，可与之前的结果比较作为性能回归检查
+# 使用方法: python benchmark.py [--concurrency 16 64 256] [--output bench.json] [--baseline bench.json]
+if __name__ == "__main__":
+    main()
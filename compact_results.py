@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+import zlib
+
+JUDGMENT_PREFIX = "ai_judgment"
+
+JSONL_SUFFIX = "_results.jsonl"
+
+COMPACT_SUFFIX = "_results.compact"
+
+FORMAT = "criteria_attack.compact"
+
+VERSION = 1
+
+# 每个分析文本块包含的行数，按块压缩以便只解压需要的行
+ANALYSIS_BLOCK_ROWS = 256
+
+# 编码后表示字段不存在的编号
+MISSING = -1
+
+# 解码时表示字段不存在，与任何JSON值都不相同
+_ABSENT = object()
+
+
+def compact_path(result_path: str) -> str:
+    """``{model}_results.compact`` next to ``{model}_results.jsonl``."""
+    if not result_path.endswith(JSONL_SUFFIX):
+        raise ValueError(f"Not a result file: {result_path}")
+    return result_path[:-len(JSONL_SUFFIX)] + COMPACT_SUFFIX
+
+
+def jsonl_path(path: str) -> str:
+    if not path.endswith(COMPACT_SUFFIX):
+        raise ValueError(f"Not a compact result file: {path}")
+    return path[:-len(COMPACT_SUFFIX)] + JSONL_SUFFIX
+
+
+def encode_column(values: list, present: list = None) -> dict:
+    """
+    Dictionary-encode one column.
+
+    Args:
+        values: Column values (any JSON values)
+        present: Optional flags; rows whose flag is false get the code ``MISSING``
+    Returns:
+        ``{"values": distinct values in first-seen order, "codes": one index per row}``
+    """
+    positions = {}
+    distinct = []
+    codes = []
+    for row, value in enumerate(values):
+        if present is not None and not present[row]:
+            codes.append(MISSING)
+            continue
+        # 字典、列表等不可哈希的值按序列化结果去重
+        key = json.dumps(value, sort_keys=True)
+        code = positions.get(key)
+        if code is None:
+            code = positions[key] = len(distinct)
+            distinct.append(value)
+        codes.append(code)
+    return {"values": distinct, "codes": codes}
+
+
+def decode_column(column: dict, missing=None) -> list:
+    values = column["values"]
+    return [values[code] if code != MISSING else missing for code in column["codes"]]
+
+
+def _merge_order(order: list, keys):
+    """Add the keys missing from ``order`` right after the key preceding them, so every row's key order is kept."""
+    position = 0
+    for key in keys:
+        if key in order:
+            position = order.index(key) + 1
+        else:
+            order.insert(position, key)
+            position += 1
+
+
+def _write_container(path: str, header: dict, blobs: dict):
+    """
+    Write a header line followed by zlib-compressed JSON blobs.
+
+    The header maps every blob name to its ``(offset, length)`` after the
+    header line, so readers decompress only the blobs they need.
+    """
+    chunks = []
+    offsets = {}
+    offset = 0
+    for name, value in blobs.items():
+        chunk = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        offsets[name] = (offset, len(chunk))
+        chunks.append(chunk)
+        offset += len(chunk)
+    header = dict(header, format=FORMAT, version=VERSION, blobs=offsets)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write((json.dumps(header) + "\n").encode("utf-8"))
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+
+class _Container:
+    """Read side of :func:`_write_container`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        line = self._file.readline()
+        self.header = json.loads(line)
+        if self.header.get("format") != FORMAT or self.header.get("version") != VERSION:
+            self._file.close()
+            raise ValueError(f"Unsupported compact result file: {path}")
+        self._data_start = len(line)
+
+    def read(self, name: str):
+        offset, length = self.header["blobs"][name]
+        self._file.seek(self._data_start + offset)
+        return json.loads(zlib.decompress(self._file.read(length)))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _write_items(results_dir: str, item_fields: list, items: list, original_indices: list) -> str:
+    """
+    Store the dataset fields of the result rows in a content-addressed item table.
+
+    Models run on the same dataset rows produce the same table, so it is
+    stored once per task under ``results/items/`` and shared by all of them.
+
+    Returns:
+        Path of the table relative to ``results_dir``
+    """
+    blobs = {"_original_index": original_indices}
+    for field in item_fields:
+        blobs[f"field/{field}"] = encode_column([item.get(field) for item in items], [field in item for item in items])
+    digest = hashlib.sha1(json.dumps([item_fields, blobs], sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    relative = f"items/{digest}.compact"
+    path = os.path.join(results_dir, relative)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_container(path, {"rows": len(items), "fields": item_fields}, blobs)
+    return relative
+
+
+def convert_to_compact(result_path: str, remove: bool = False) -> dict:
+    """
+    Convert a JSONL result file into the compact format.
+
+    Dataset fields (``text``, ``raw``, ``injection``, ``label``, ...) go to a
+    shared item table, dictionary-encoded so a ``raw`` text repeated for every
+    injection type is stored once. Judgment fields are dictionary-encoded per
+    prompt variant, and analyses are compressed separately in blocks of
+    ``ANALYSIS_BLOCK_ROWS`` rows that are only read when asked for.
+
+    Args:
+        result_path: ``{model}_results.jsonl`` file
+        remove: Delete the JSONL file after a successful conversion
+    Returns:
+        Dict with the number of rows and the sizes in bytes before and after
+    """
+    items = []
+    original_indices = []
+    judgments = {}
+    item_fields = []
+    judgment_fields = {}
+    with open(result_path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            item = {}
+            for key, value in row.items():
+                if key.startswith(JUDGMENT_PREFIX):
+                    judgments.setdefault(key, {})[len(items)] = value
+                    _merge_order(judgment_fields.setdefault(key, []), value)
+                elif key != "_original_index":
+                    item[key] = value
+            _merge_order(item_fields, item)
+            items.append(item)
+            original_indices.append(row.get("_original_index"))
+    rows = len(items)
+
+    results_dir = os.path.dirname(os.path.abspath(result_path))
+    item_table = _write_items(results_dir, item_fields, items, original_indices)
+    blobs = {}
+    for key, by_row in judgments.items():
+        present = [row in by_row for row in range(rows)]
+        blobs[f"present/{key}"] = present
+        for field in judgment_fields[key]:
+            values = [by_row[row].get(field) if present[row] else None for row in range(rows)]
+            has_field = [present[row] and field in by_row[row] for row in range(rows)]
+            if field == "analysis":
+                for start in range(0, rows, ANALYSIS_BLOCK_ROWS):
+                    blobs[f"analysis/{key}/{start // ANALYSIS_BLOCK_ROWS}"] = [
+                        values[row] if has_field[row] else None for row in range(start, min(start + ANALYSIS_BLOCK_ROWS, rows))
+                    ]
+            else:
+                blobs[f"judgment/{key}/{field}"] = encode_column(values, has_field)
+    path = compact_path(result_path)
+    _write_container(path, {"rows": rows, "items": item_table, "judgment_keys": list(judgments),
+                            "judgment_fields": judgment_fields, "analysis_block_rows": ANALYSIS_BLOCK_ROWS}, blobs)
+    summary = {"rows": rows, "jsonl_bytes": os.path.getsize(result_path), "compact_bytes": os.path.getsize(path),
+               "item_table_bytes": os.path.getsize(os.path.join(results_dir, item_table))}
+    if remove:
+        os.remove(result_path)
+    return summary
+
+
+class CompactResults:
+    """
+    Lazy reader of a compact result file.
+
+    Only the header is read on open; item fields, judgment fields and
+    analyses are decompressed column by column when requested.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._container = _Container(path)
+        self.header = self._container.header
+        self.rows = self.header["rows"]
+        self.judgment_keys = self.header["judgment_keys"]
+        self._items = _Container(os.path.join(os.path.dirname(os.path.abspath(path)), self.header["items"]))
+        self.item_fields = self._items.header["fields"]
+
+    def original_indices(self) -> list:
+        return self._items.read("_original_index")
+
+    def item_column(self, field: str) -> dict:
+        """Encoded column (``values`` and ``codes``) of a dataset field."""
+        return self._items.read(f"field/{field}")
+
+    def present(self, key: str) -> list:
+        """Whether each row has a judgment for the prompt variant ``key``."""
+        return self._container.read(f"present/{key}")
+
+    def judgment_fields(self, key: str, analysis: bool = False) -> list:
+        fields = self.header["judgment_fields"][key]
+        return fields if analysis else [field for field in fields if field != "analysis"]
+
+    def judgment_column(self, key: str, field: str) -> dict:
+        """Encoded column of one judgment field (not ``analysis``) of a prompt variant."""
+        return self._container.read(f"judgment/{key}/{field}")
+
+    def analyses(self, key: str, rows: list = None) -> list:
+        """
+        Analyses of a prompt variant, only decompressing the blocks holding ``rows``.
+
+        Args:
+            key: Judgment field name of the prompt variant
+            rows: Row positions to return, defaults to all rows
+        Returns:
+            One analysis per requested row, None where it is missing
+        """
+        block_rows = self.header["analysis_block_rows"]
+        if "analysis" not in self.header["judgment_fields"][key]:
+            return [None] * (self.rows if rows is None else len(rows))
+        if rows is None:
+            rows = range(self.rows)
+        blocks = {}
+        analyses = []
+        for row in rows:
+            block = row // block_rows
+            if block not in blocks:
+                blocks[block] = self._container.read(f"analysis/{key}/{block}")
+            analyses.append(blocks[block][row % block_rows])
+        return analyses
+
+    def iter_rows(self, analysis: bool = True):
+        """Rebuild the original result rows, in file order."""
+        items = {field: decode_column(self.item_column(field), _ABSENT) for field in self.item_fields}
+        original_indices = self.original_indices()
+        judgments = {}
+        for key in self.judgment_keys:
+            columns = {field: decode_column(self.judgment_column(key, field), _ABSENT) for field in self.judgment_fields(key)}
+            if analysis and "analysis" in self.header["judgment_fields"][key]:
+                columns["analysis"] = [_ABSENT if text is None else text for text in self.analyses(key)]
+            judgments[key] = (self.present(key), [field for field in self.judgment_fields(key, analysis=True) if field in columns], columns)
+        for row in range(self.rows):
+            result = {field: items[field][row] for field in self.item_fields if items[field][row] is not _ABSENT}
+            result["_original_index"] = original_indices[row]
+            for key, (present, fields, columns) in judgments.items():
+                if present[row]:
+                    result[key] = {field: columns[field][row] for field in fields if columns[field][row] is not _ABSENT}
+            yield result
+
+    def close(self):
+        self._container.close()
+        self._items.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convert_to_jsonl(path: str, remove: bool = False) -> int:
+    """
+    Expand a compact result file back into ``{model}_results.jsonl``.
+
+    Returns:
+        Number of rows written
+    """
+    target = jsonl_path(path)
+    rows = 0
+    with CompactResults(path) as results, open(target + ".tmp", "w") as f:
+        for row in results.iter_rows():
+            f.write(json.dumps(row) + "\n")
+            rows += 1
+    os.replace(target + ".tmp", target)
+    if remove:
+        os.remove(path)
+    return rows
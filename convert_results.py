@@ -0,0 +1,35 @@
+import argparse
+import glob
+import os
+
+from compact_results import COMPACT_SUFFIX, JSONL_SUFFIX, convert_to_compact, convert_to_jsonl
+from task_registry import TASKS
+
+# 在JSONL结果文件和紧凑格式之间转换，紧凑格式共享数据字段、按列压缩，评分时读取更快
+# 使用方法: python convert_results.py [--tasks toxic_comment] [--models gemma3-27b] [--remove] [--to_jsonl]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", type=str, nargs="*", help="Files to convert, defaults to all merged result files of the selected tasks and models")
+    parser.add_argument("--tasks", type=str, nargs="+", default=list(TASKS), choices=list(TASKS), help="Only convert these tasks")
+    parser.add_argument("--models", type=str, nargs="+", default=None, help="Only convert these models")
+    parser.add_argument("--to_jsonl", action="store_true", help="Expand compact files back into JSONL result files")
+    parser.add_argument("--remove", action="store_true", help="Delete the source file after converting it")
+    args = parser.parse_args()
+
+    suffix = COMPACT_SUFFIX if args.to_jsonl else JSONL_SUFFIX
+    paths = args.paths
+    if not paths:
+        for name in args.tasks:
+            for path in sorted(glob.glob(f"./tasks/{name}/results/*{suffix}")):
+                model = os.path.basename(path)[:-len(suffix)]
+                # 分片结果先用merge_shards.py合并
+                if ".shard" not in model and (not args.models or model in args.models):
+                    paths.append(path)
+    for path in paths:
+        if args.to_jsonl:
+            rows = convert_to_jsonl(path, remove=args.remove)
+            print(f"Expanded {rows} rows from {path}")
+        else:
+            summary = convert_to_compact(path, remove=args.remove)
+            print(f"{path}: {summary['rows']} rows, {summary['jsonl_bytes']} -> {summary['compact_bytes']} bytes "
+                  f"(+ {summary['item_table_bytes']} bytes shared item table)")
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import mmap
+import os
+from array import array
+
+from task_registry import injection_type
+
+INDEX_SUFFIX = ".index"
+
+INDEX_VERSION = 2
+
+# 偏移索引中的定长列：(名称, array类型码)
+COLUMNS = (("offset", "q"), ("length", "q"), ("index", "q"), ("label", "i"), ("injection_type", "i"), ("raw_hash", "Q"))
+
+WHITESPACE = b" \t\r\n"
+
+
+def raw_hash(raw) -> int:
+    """64-bit hash of an item's ``raw`` text, stable across processes."""
+    digest = hashlib.blake2b(str(raw).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def parse_indices(values: list) -> set:
+    """
+    Parse dataset ``index`` selections such as ``["3", "10-20"]`` (ranges are inclusive).
+
+    Returns:
+        Set of selected ``index`` values
+    """
+    selected = set()
+    for value in values:
+        for part in str(value).split(","):
+            start, _, end = part.partition("-")
+            try:
+                selected.update(range(int(start), int(end or start) + 1))
+            except ValueError:
+                raise ValueError(f"Invalid index selection {part!r}, expected N or N-M")
+    return selected
+
+
+class LazyDataset:
+    """
+    Memory-mapped JSONL dataset that decodes rows only when they are used.
+
+    On first use a byte-offset index is built by scanning the file for
+    newlines, without decoding any row, so a run can start streaming rows at
+    once. The per-row metadata filters need (``index``, ``label``,
+    ``injection_type`` and a hash of ``raw``) is decoded the first time a
+    filter or :meth:`column` asks for it. Both are cached next to the file
+    as ``{path}.index``, which is rebuilt whenever the dataset's size or
+    modification time changes. Filters run on this metadata, so only the
+    selected rows are ever parsed by a run, and memory stays bounded by the
+    index (40 bytes per row) rather than the data.
+    """
+
+    def __init__(self, path: str, cache: bool = True):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.cache = cache
+        stat = os.stat(path)
+        self._version = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "version": INDEX_VERSION}
+        self._file = open(path, "rb")
+        # 空文件无法映射
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+        if not (cache and self._load_index()):
+            self._build_index()
+            if cache:
+                self._save_index()
+
+    def _build_index(self):
+        """只按换行符记录每行的偏移和长度，不解析JSON"""
+        self.columns = {"offset": array("q"), "length": array("q")}
+        self.values = {}
+        offsets, lengths = self.columns["offset"], self.columns["length"]
+        data, find, size = self._data, self._data.find, len(self._data)
+        start = 0
+        while start < size:
+            end = find(b"\n", start)
+            end = size if end < 0 else end + 1
+            # JSON行以"{"开头，只有以空白开头的行才需要检查是否为空行
+            if data[start] not in WHITESPACE or data[start:end].strip():
+                offsets.append(start)
+                lengths.append(end - start)
+            start = end
+
+    def _build_metadata(self):
+        """解析每一行，得到过滤所需的元数据列"""
+        for name, typecode in COLUMNS[2:]:
+            self.columns[name] = array(typecode)
+        self.values = {"label": [], "injection_type": []}
+        codes = {"label": {}, "injection_type": {}}
+
+        def encode(name: str, value) -> int:
+            # 标签和注入类型取值很少，字典编码；带上类型以区分1和True
+            key = (type(value), value) if isinstance(value, (str, int, float, bool, type(None))) else json.dumps(value, sort_keys=True)
+            code = codes[name].get(key)
+            if code is None:
+                code = codes[name][key] = len(self.values[name])
+                self.values[name].append(value)
+            return code
+
+        decode = json.JSONDecoder().decode
+        index_column, labels, kinds, hashes = (self.columns[name] for name in ("index", "label", "injection_type", "raw_hash"))
+        for offset, length in zip(self.columns["offset"], self.columns["length"]):
+            row = decode(self._data[offset:offset + length].decode("utf-8"))
+            index_column.append(int(row.get("index", -1)))
+            labels.append(encode("label", row.get("label")))
+            kinds.append(encode("injection_type", injection_type(row)))
+            hashes.append(raw_hash(row.get("raw", row.get("text"))))
+        if self.cache:
+            self._save_index()
+
+    def _require_metadata(self):
+        if "index" not in self.columns:
+            self._build_metadata()
+
+    def _load_index(self) -> bool:
+        """读取缓存的偏移索引，缓存不存在或已过期时返回False"""
+        try:
+            with open(self.index_path, "rb") as f:
+                header = json.loads(f.readline())
+                if header["source"] != self._version:
+                    return False
+                self.values = header["values"]
+                self.columns = {}
+                for name, typecode in COLUMNS:
+                    if name not in header["columns"]:
+                        continue
+                    column = array(typecode)
+                    column.fromfile(f, header["rows"])
+                    self.columns[name] = column
+            return True
+        except (OSError, ValueError, KeyError, EOFError):
+            return False
+
+    def _save_index(self):
+        names = [name for name, _ in COLUMNS if name in self.columns]
+        header = {"source": self._version, "rows": len(self.columns["offset"]), "columns": names, "values": self.values}
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write((json.dumps(header) + "\n").encode("utf-8"))
+                for name in names:
+                    self.columns[name].tofile(f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            # 数据目录只读时不缓存索引
+            pass
+
+    def __len__(self) -> int:
+        return len(self.columns["offset"])
+
+    def __getitem__(self, position: int) -> dict:
+        offset = self.columns["offset"][position]
+        return json.loads(self._data[offset:offset + self.columns["length"][position]])
+
+    def __iter__(self):
+        return (self[position] for position in range(len(self)))
+
+    def column(self, name: str) -> list:
+        """
+        Metadata of every row from the offset index.
+
+        Args:
+            name: "offset", "length", "index", "label", "injection_type" or "raw_hash"; the
+                last four are decoded from every row the first time one of them is needed
+        Returns:
+            One value per row, in file order
+        """
+        if name not in ("offset", "length"):
+            self._require_metadata()
+        if name in self.values:
+            values = self.values[name]
+            return [values[code] for code in self.columns[name]]
+        return self.columns[name]
+
+    def select(self, injection_types: list = None, indices: set = None, where=None, limit: int = None) -> list:
+        """
+        Positions of the rows passing all filters, evaluated on the metadata only.
+
+        Args:
+            injection_types: Keep these injection types ("none" for rows without injection)
+            indices: Keep rows whose dataset ``index`` is in this set
+            where: Optional predicate called with the position of every remaining row
+            limit: Keep at most this many rows, the first ones in file order
+        Returns:
+            Row positions in file order
+        """
+        if injection_types is not None or indices is not None:
+            self._require_metadata()
+        allowed = None
+        if injection_types is not None:
+            allowed = {code for code, value in enumerate(self.values["injection_type"]) if value in injection_types}
+        kinds = self.columns.get("injection_type")
+        index_column = self.columns.get("index")
+        positions = []
+        for position in range(len(self)):
+            if limit is not None and len(positions) >= limit:
+                break
+            if allowed is not None and kinds[position] not in allowed:
+                continue
+            if indices is not None and index_column[position] not in indices:
+                continue
+            if where is not None and not where(position):
+                continue
+            positions.append(position)
+        return positions
+
+    def items(self, positions=None):
+        """Generator of ``(position, row)``, decoding each row only when it is reached."""
+        for position in positions if positions is not None else range(len(self)):
+            yield position, self[position]
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+def load_dataset(dataset_path: str, cache: bool = True) -> LazyDataset:
+    """
+    Open a JSONL dataset lazily.
+
+    Args:
+        dataset_path: Path of the JSONL file
+        cache: Keep the offset index in ``{dataset_path}.index`` for the next run
+    Returns:
+        LazyDataset that can be indexed by position, iterated and filtered
+    """
+    return LazyDataset(dataset_path, cache=cache)
@@ -0,0 +1,160 @@
+import hashlib
+import threading
+import time
+
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError
+
+
+def is_replica_error(e: Exception) -> bool:
+    """Whether an exception means the replica itself is unreachable or broken."""
+    if isinstance(e, APIConnectionError):
+        # 超时算作过载而不是副本故障
+        return not isinstance(e, APITimeoutError)
+    return isinstance(e, APIStatusError) and e.status_code >= 500 and e.status_code != 503
+
+
+class Endpoint:
+    """One OpenAI-compatible server with its own clients and counters."""
+
+    def __init__(self, base_url: str, api_key: str = "NONONO"):
+        self.base_url = base_url
+        self.api_key = api_key
+        # 关闭SDK自带的重试，由引擎决定重试和切换副本
+        self.async_client = AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+        self._sync_client = None
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        # 连续被摘除的次数，决定下一次摘除时长
+        self.ejection_streak = 0
+        self.ejected_until = None
+
+    @property
+    def sync_client(self) -> OpenAI:
+        if self._sync_client is None:
+            self._sync_client = OpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0)
+        return self._sync_client
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "ejected": self.ejected_until is not None,
+        }
+
+
+class EndpointPool:
+    """
+    Routes requests over several replicas serving the same model.
+
+    Requests go to the healthy endpoint with the fewest outstanding requests.
+    With ``sticky_prefix_chars`` set, prompts sharing that many leading
+    characters prefer the same replica (rendezvous hashing) so its prefix
+    cache stays warm, unless that replica has ``max_imbalance`` more requests
+    in flight than the least loaded one. After ``eject_after`` consecutive
+    failures an endpoint is ejected for ``eject_seconds`` (doubling on each
+    ejection); once that expires it gets a trial request, and
+    :meth:`check_health` can bring it back earlier.
+
+    Counters are guarded by a lock so one pool can serve threads and the
+    asyncio engine alike.
+    """
+
+    def __init__(self, endpoints: list, sticky_prefix_chars: int = 0, max_imbalance: int = 8,
+                 eject_after: int = 3, eject_seconds: float = 10.0, max_eject_seconds: float = 300.0):
+        if not endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.endpoints = endpoints
+        self.sticky_prefix_chars = sticky_prefix_chars
+        self.max_imbalance = max_imbalance
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_urls(cls, base_urls: list, api_key: str = "NONONO", **kwargs):
+        return cls([Endpoint(base_url, api_key) for base_url in base_urls], **kwargs)
+
+    @property
+    def cache_endpoint(self) -> str:
+        """Endpoint identity used in cache keys; replicas share the entries of the first endpoint."""
+        return self.endpoints[0].base_url
+
+    def _available(self, now: float) -> list:
+        available = [endpoint for endpoint in self.endpoints if endpoint.ejected_until is None or endpoint.ejected_until <= now]
+        # 所有副本都被摘除时仍然尝试，由重试逻辑兜底
+        return available or list(self.endpoints)
+
+    def acquire(self, prompt: str = None, exclude: Endpoint = None) -> Endpoint:
+        """
+        Pick an endpoint for one request and count it as in flight.
+
+        Args:
+            prompt: Prompt text, used for sticky routing
+            exclude: Endpoint to avoid if any other one is available (e.g. after it just failed)
+        Returns:
+            Chosen endpoint; pass it to :meth:`release` when the request ends
+        """
+        with self._lock:
+            candidates = self._available(time.monotonic())
+            if exclude is not None and len(candidates) > 1:
+                candidates = [endpoint for endpoint in candidates if endpoint is not exclude] or candidates
+            endpoint = min(candidates, key=lambda e: e.in_flight)
+            if self.sticky_prefix_chars and prompt is not None and len(candidates) > 1:
+                prefix = prompt[:self.sticky_prefix_chars]
+                preferred = max(candidates, key=lambda e: hashlib.md5((e.base_url + prefix).encode("utf-8")).digest())
+                if preferred.in_flight <= endpoint.in_flight + self.max_imbalance:
+                    endpoint = preferred
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, failed: bool = False):
+        """Finish a request, ejecting the endpoint after repeated failures."""
+        with self._lock:
+            endpoint.in_flight -= 1
+            if not failed:
+                endpoint.consecutive_failures = 0
+                endpoint.ejection_streak = 0
+                endpoint.ejected_until = None
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            now = time.monotonic()
+            # 摘除前已经发出的请求陆续失败时不重复摘除
+            if endpoint.ejected_until is not None and endpoint.ejected_until > now:
+                return
+            if endpoint.consecutive_failures >= self.eject_after:
+                endpoint.ejections += 1
+                endpoint.ejection_streak += 1
+                backoff = min(self.max_eject_seconds, self.eject_seconds * 2 ** (endpoint.ejection_streak - 1))
+                endpoint.ejected_until = now + backoff
+
+    def has_alternative(self, endpoint: Endpoint) -> bool:
+        with self._lock:
+            return any(other is not endpoint for other in self._available(time.monotonic()))
+
+    async def check_health(self):
+        """Probe ejected endpoints with ``GET /models`` and reinstate the ones that answer."""
+        for endpoint in self.endpoints:
+            if endpoint.ejected_until is None:
+                continue
+            try:
+                await endpoint.async_client.models.list()
+            except Exception:
+                continue
+            with self._lock:
+                endpoint.consecutive_failures = 0
+                endpoint.ejection_streak = 0
+                endpoint.ejected_until = None
+
+    async def close(self):
+        for endpoint in self.endpoints:
+            await endpoint.async_client.close()
+
+    def stats(self) -> dict:
+        return {endpoint.base_url: endpoint.stats() for endpoint in self.endpoints}
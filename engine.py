@@ -0,0 +1,531 @@
+import asyncio
+import contextvars
+import random
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+from endpoint_pool import EndpointPool, is_replica_error
+from metrics import percentile
+from response_cache import CacheMissError, ResponseCache
+from utils import vllm_port, build_messages, generation_params, guided_decoding_params, postprocess_response
+
+
+# 当前工作单元的请求占用服务端的秒数，由调用方为每个单元设置一个[0.0]列表，用于估算不同调度顺序的完工时间
+service_time = contextvars.ContextVar("service_time", default=None)
+
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease limit on in-flight requests.
+
+    The limit grows by roughly ``increase`` per round trip while requests
+    succeed, and is cut by ``decrease`` when the server signals saturation
+    (429/503, timeouts, or latency above ``latency_threshold``).
+    """
+
+    def __init__(self, initial: int = 32, min_limit: int = 4, max_limit: int = 512,
+                 increase: float = 1.0, decrease: float = 0.7, latency_threshold: float = None):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_threshold = latency_threshold
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._condition = asyncio.Condition()
+        self._last_decrease = 0.0
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now, e.g. for a hedged request."""
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return True
+
+    async def cancel(self):
+        """Give back the slot of an abandoned request without changing the limit."""
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def release(self, latency: float = None, overloaded: bool = False):
+        async with self._condition:
+            self.in_flight -= 1
+            if latency is not None and self.latency_threshold is not None and latency > self.latency_threshold:
+                overloaded = True
+            now = time.monotonic()
+            if overloaded:
+                # 同一轮往返内只收缩一次，避免一批拒绝把并发压到最低
+                if latency is None or now - self._last_decrease > latency:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self._condition.notify_all()
+
+
+def is_overload_error(e: Exception) -> bool:
+    """Whether an exception means the server is saturated rather than broken."""
+    if isinstance(e, APITimeoutError):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code in (429, 503)
+
+
+def classify_error(e: Exception) -> str:
+    """
+    Error class of a failed request.
+
+    Returns:
+        "rate_limit" (429), "server" (5xx), "transport" (connection errors and timeouts),
+        "parse" (unparsable model output), "client" (other 4xx) or "other"
+    """
+    if isinstance(e, RequestFailed):
+        return e.error_class
+    if isinstance(e, APIStatusError):
+        if e.status_code == 429:
+            return "rate_limit"
+        return "server" if e.status_code >= 500 else "client"
+    if isinstance(e, APIConnectionError):
+        return "transport"
+    if isinstance(e, ValueError):
+        # json.JSONDecodeError是ValueError的子类
+        return "parse"
+    return "other"
+
+
+class RequestFailed(Exception):
+    """A request that still failed after its retries, with the class and stage of the last error."""
+
+    def __init__(self, error_class: str, attempts: int, stage: str = None, cause: Exception = None):
+        super().__init__(f"{error_class} error after {attempts} attempt(s): {cause}")
+        self.error_class = error_class
+        self.attempts = attempts
+        self.stage = stage
+        self.cause = cause
+
+
+class LeaderCancelled(Exception):
+    """The coalesced request a caller was waiting for was cancelled, not the caller itself."""
+
+
+class RetryPolicy:
+    """
+    Per-class retry budgets with jittered exponential backoff.
+
+    The n-th retry sleeps a random time in ``[0, min(max_delay, base_delay * 2**n)]``
+    ("full jitter"), so requests rejected together do not come back together.
+    A 429 waits at least as long as its ``Retry-After`` header asks for.
+    """
+
+    def __init__(self, max_retries: dict = None, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.max_retries = {"transport": 6, "server": 6, "rate_limit": 8, "parse": 2}
+        self.max_retries.update(max_retries or {})
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error_class: str, retries: int) -> bool:
+        """Whether a request that already had ``retries`` retries of this class may be tried again."""
+        return retries < self.max_retries.get(error_class, 0)
+
+    def delay(self, retries: int, e: Exception = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retries))
+        if isinstance(e, APIStatusError) and e.status_code == 429:
+            try:
+                delay = max(delay, float(e.response.headers.get("retry-after", 0)))
+            except ValueError:
+                pass
+        return delay
+
+
+class AsyncEngine:
+    """
+    Asyncio counterpart of ``utils.ask_question`` backed by an :class:`EndpointPool`.
+
+    Every call goes through an :class:`AIMDController`, so hundreds of
+    requests can be in flight without one OS thread per request. Without a
+    ``pool`` the engine talks to ``base_url`` alone. Failed requests are
+    retried according to ``retry``, on another replica if the endpoint
+    itself failed, and an optional ``rate_limiter`` caps requests and tokens
+    per second. With ``stream`` the response is streamed so a ``metrics``
+    collector also gets the time to first token. With ``coalesce``, a call
+    identical (model, messages and parameters) to one already in flight
+    waits for that request instead of sending its own; if that request is
+    cancelled, the waiting calls send it again (one of them leads) rather
+    than being cancelled with it. Lookups and writes of the synchronous
+    SQLite ``cache`` run on a dedicated thread, so a slow disk or another
+    process holding the write lock never stalls the event loop.
+
+    Once ``hedging`` is switched on (at the end of a run, when only
+    stragglers are left), a request still running after the
+    ``hedge_percentile`` latency of its stage is duplicated to another
+    replica or a free slot; the first response wins and the other request
+    is cancelled.
+    """
+
+    def __init__(self, model_name: str = "gemma3-27b", base_url: str = f"http://127.0.0.1:{vllm_port}/v1",
+                 api_key: str = "NONONO", controller: AIMDController = None, retry: RetryPolicy = None,
+                 cache=None, guided: str = "response_format", pool: EndpointPool = None,
+                 metrics=None, stream: bool = True, rate_limiter=None, coalesce: bool = True,
+                 hedge_percentile: float = None, hedge_min_samples: int = 20):
+        self.model_name = model_name
+        self.metrics = metrics
+        self.stream = stream
+        self.guided = guided
+        self.pool = pool or EndpointPool.from_urls([base_url], api_key)
+        # 同一模型的多个副本共用缓存条目
+        self.base_url = self.pool.cache_endpoint
+        self.cache = cache
+        # sqlite调用会阻塞（另一个进程持有写锁时最长60秒），放在单独的线程中执行
+        self._cache_executor = ThreadPoolExecutor(1, thread_name_prefix="response-cache") if cache is not None else None
+        self.controller = controller or AIMDController()
+        self.retry = retry or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.coalesce = coalesce
+        # 正在进行的请求：请求键 -> 完成时得到回复原文的Future
+        self._in_flight = {}
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedging = False
+        # 开始对冲时完成，让此前已经发出的请求也能被对冲
+        self._hedging_started = None
+        self.hedges = Counter()
+        # 各阶段最近的请求延迟，用于计算对冲请求的等待时间
+        self._latencies = defaultdict(lambda: deque(maxlen=512))
+
+    async def _create(self, endpoint, model_name: str, messages: list, params: dict, start: float):
+        """发送一次请求，返回(回复文本, 首token时间, usage, 结束原因)"""
+        if not self.stream:
+            chat_response = await endpoint.async_client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                **params,
+            )
+            choice = chat_response.choices[0]
+            return choice.message.content, None, chat_response.usage, choice.finish_reason
+        chunks = await endpoint.async_client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params,
+        )
+        parts = []
+        ttft = None
+        usage = None
+        finish_reason = None
+        async for chunk in chunks:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices:
+                if chunk.choices[0].delta.content:
+                    if ttft is None:
+                        ttft = time.monotonic() - start
+                    parts.append(chunk.choices[0].delta.content)
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+        return "".join(parts), ttft, usage, finish_reason
+
+    def start_hedging(self):
+        """Switch hedging on, also for the requests already in flight (call when only stragglers are left)."""
+        self.hedging = True
+        if self._hedging_started is not None and not self._hedging_started.done():
+            self._hedging_started.set_result(None)
+
+    def hedge_delay(self, stage: str):
+        """Seconds after which a request of ``stage`` is hedged, None while hedging is off or too few latencies are known."""
+        if not self.hedging or not self.hedge_percentile:
+            return None
+        latencies = self._latencies[stage]
+        if len(latencies) < self.hedge_min_samples:
+            return None
+        return percentile(sorted(latencies), self.hedge_percentile)
+
+    async def _create_hedged(self, question: str, endpoint, model_name: str, messages: list, params: dict, start: float, stage: str):
+        """发送请求；超过延迟分位数仍未完成时向另一个副本或空闲名额发送相同的请求，先成功者胜出，另一个被取消"""
+        if not self.hedge_percentile:
+            return await self._create(endpoint, model_name, messages, params, start)
+        primary = asyncio.ensure_future(self._create(endpoint, model_name, messages, params, start))
+        try:
+            if not self.hedging:
+                if self._hedging_started is None:
+                    self._hedging_started = asyncio.get_running_loop().create_future()
+                await asyncio.wait({primary, self._hedging_started}, return_when=asyncio.FIRST_COMPLETED)
+            delay = self.hedge_delay(stage)
+            if primary.done() or delay is None:
+                return await primary
+            done, _ = await asyncio.wait({primary}, timeout=max(0.0, delay - (time.monotonic() - start)))
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        # 没有空闲名额时不对冲，避免挤占其他请求
+        if done or not self.controller.try_acquire():
+            return await primary
+        hedge_endpoint = self.pool.acquire(question, exclude=endpoint)
+        hedge_start = time.monotonic()
+        hedge = asyncio.ensure_future(self._create(hedge_endpoint, model_name, messages, params, hedge_start))
+        self.hedges["sent"] += 1
+        try:
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        continue
+                    if task is primary:
+                        return task.result()
+                    self.hedges["won"] += 1
+                    text, ttft, usage, finish_reason = task.result()
+                    # 首token时间按原请求的发送时间计
+                    return text, ttft + hedge_start - start if ttft is not None else None, usage, finish_reason
+            raise primary.exception()
+        finally:
+            for task in (primary, hedge):
+                task.cancel()
+            failed = hedge.done() and not hedge.cancelled() and hedge.exception() is not None and is_replica_error(hedge.exception())
+            self.pool.release(hedge_endpoint, failed=failed)
+            await self.controller.cancel()
+
+    async def ask_question(self, question: str, json_format: bool = False, model_name: str = None,
+                           json_schema: dict = None, tags: dict = None, refresh: bool = False,
+                           generation: dict = None) -> str:
+        """
+        Ask a general question using a language model.
+
+        Args:
+            question: Question to ask
+            json_format: Whether to request JSON formatted response
+            model_name: Name of the language model to use, defaults to the engine's model
+            json_schema: If given, constrain the response to this JSON schema with guided decoding
+                and return the raw JSON text without any post-processing
+            tags: Labels (task, variant, stage, injection_type) the call is recorded under in ``metrics``
+            refresh: Skip the cache lookup and in-flight coalescing (the new response still
+                replaces the cached one), e.g. to resample an unparsable response; in replay
+                mode, where no request may reach the server, this fails like a cache miss
+            generation: Sampling parameters of the stage, e.g. ``max_tokens``, ``stop`` and ``temperature``
+        Returns:
+            Model response as string
+        Raises:
+            RequestFailed: If the request failed and its retry budget is used up
+            CacheMissError: In replay mode, on a cache miss or a refresh
+        """
+        model_name = model_name or self.model_name
+        messages = build_messages(question)
+        params = guided_decoding_params(json_schema, self.guided) if json_schema is not None else {}
+        params = generation_params(generation, params)
+        key = ResponseCache.make_key(model_name, self.base_url, messages, params)
+        if self.cache is not None:
+            if refresh and self.cache.mode == "replay":
+                # 回放模式下不能重新采样，否则会向服务端发送请求
+                raise CacheMissError(f"Cannot resample request {key} in replay mode")
+            # 缓存命中时不占用并发名额
+            cached = None if refresh else await self._in_cache_thread(self.cache.get, key)
+            if cached is not None:
+                if self.metrics is not None:
+                    self.metrics.record(tags, cached=True)
+                return cached if json_schema is not None else postprocess_response(cached, json_format)
+        # 相同的请求正在进行时等待它的回复，不再重复发送；重新采样的请求总是单独发送
+        if not self.coalesce or refresh:
+            chat_response_text = await self._request(question, model_name, messages, params, tags, key)
+        else:
+            while True:
+                waiting = self._in_flight.get(key)
+                if waiting is None:
+                    chat_response_text = await self._lead(question, model_name, messages, params, tags, key)
+                    break
+                try:
+                    chat_response_text = await asyncio.shield(waiting)
+                except LeaderCancelled:
+                    # 被取消的只是领头请求，本请求重新发送或跟随新的领头请求
+                    continue
+                if self.metrics is not None:
+                    self.metrics.record(tags, coalesced=True)
+                break
+        if json_schema is not None:
+            return chat_response_text
+        return postprocess_response(chat_response_text, json_format)
+
+    async def _lead(self, question: str, model_name: str, messages: list, params: dict, tags: dict, key: str) -> str:
+        """发送请求，并让同时到达的相同请求等待它的结果"""
+        future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            chat_response_text = await self._request(question, model_name, messages, params, tags, key)
+            future.set_result(chat_response_text)
+            return chat_response_text
+        except asyncio.CancelledError:
+            # 领头请求被取消（对冲失败方、关闭或同一条目的其他变体失败）时，等待者没有被取消，应当重新发送
+            future.set_exception(LeaderCancelled(key))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有等待者时也不报告未取出的异常
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def _request(self, question: str, model_name: str, messages: list, params: dict, tags: dict, key: str) -> str:
+        """发送请求并按重试策略重试，返回回复原文并写入缓存"""
+        attempt = 0
+        retries = {}
+        endpoint = None
+        queue_wait = 0.0
+        while True:
+            queued = time.monotonic()
+            estimate = await self.rate_limiter.acquire(question) if self.rate_limiter is not None else 0
+            await self.controller.acquire()
+            endpoint = self.pool.acquire(question, exclude=endpoint)
+            start = time.monotonic()
+            queue_wait += start - queued
+            try:
+                chat_response_text, ttft, usage, finish_reason = await self._create_hedged(
+                    question, endpoint, model_name, messages, params, start, (tags or {}).get("stage"))
+            except Exception as e:
+                spent = service_time.get()
+                if spent is not None:
+                    spent[0] += time.monotonic() - start
+                failed = is_replica_error(e)
+                self.pool.release(endpoint, failed=failed)
+                if self.rate_limiter is not None:
+                    # 失败的尝试同样计入预算，重试不能绕过限速
+                    self.rate_limiter.settle(estimate)
+                await self.controller.release(time.monotonic() - start, overloaded=is_overload_error(e))
+                error_class = classify_error(e)
+                if not self.retry.should_retry(error_class, retries.get(error_class, 0)):
+                    if self.metrics is not None:
+                        self.metrics.record(tags, queue_wait=queue_wait, retries=attempt, endpoint=endpoint.base_url, error=True)
+                    raise RequestFailed(error_class, attempt + 1, (tags or {}).get("stage"), e) from e
+                # 副本故障时立即换一个副本重试，其余错误按类别退避
+                if not (failed and self.pool.has_alternative(endpoint)):
+                    await asyncio.sleep(self.retry.delay(retries.get(error_class, 0), e))
+                retries[error_class] = retries.get(error_class, 0) + 1
+                attempt += 1
+                continue
+            latency = time.monotonic() - start
+            self._latencies[(tags or {}).get("stage")].append(latency)
+            spent = service_time.get()
+            if spent is not None:
+                spent[0] += latency
+            self.pool.release(endpoint)
+            await self.controller.release(latency)
+            if self.rate_limiter is not None:
+                self.rate_limiter.settle(estimate, usage)
+            if self.metrics is not None:
+                self.metrics.record(tags, queue_wait=queue_wait, ttft=ttft, latency=latency,
+                                    prompt_tokens=usage.prompt_tokens if usage else None,
+                                    completion_tokens=usage.completion_tokens if usage else None,
+                                    retries=attempt, endpoint=endpoint.base_url, truncated=finish_reason == "length")
+            if self.cache is not None:
+                await self._in_cache_thread(self.cache.put, key, chat_response_text, model_name)
+            return chat_response_text
+
+    async def _in_cache_thread(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._cache_executor, function, *args)
+
+    async def close(self):
+        await self.pool.close()
+        if self._cache_executor is not None:
+            self._cache_executor.shutdown(wait=True)
+
+
+async def run_items(process_item, indexed_dataset, on_done=None, max_pending: int = 1024, on_exhausted=None):
+    """
+    Run ``process_item`` for every unit of work concurrently.
+
+    Units are pulled lazily from ``indexed_dataset`` and at most
+    ``max_pending`` of them are alive at once, so memory stays flat
+    regardless of dataset size.
+
+    Args:
+        process_item: Coroutine function taking one unit, e.g. ``(index, item)``
+        indexed_dataset: Iterable of units
+        on_done: Optional callback invoked with each result as soon as it finishes
+        max_pending: Maximum number of units processed at the same time
+        on_exhausted: Optional callback invoked once when all units have been started
+    Returns:
+        Number of processed units
+    """
+    iterator = iter(indexed_dataset)
+    pending = set()
+    count = 0
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < max_pending:
+            item_with_index = next(iterator, None)
+            if item_with_index is None:
+                exhausted = True
+                if on_exhausted is not None:
+                    on_exhausted()
+                break
+            pending.add(asyncio.ensure_future(process_item(item_with_index)))
+        if not pending:
+            return count
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            count += 1
+            if on_done is not None:
+                on_done(future.result())
+
+
+async def run_queue(process_item, queue: asyncio.Queue, on_done=None, max_pending: int = 1024, on_exhausted=None):
+    """
+    Like :func:`run_items`, but units arrive on an ``asyncio.Queue`` filled by a concurrent producer.
+
+    A ``None`` put on the queue marks the end of the units.
+
+    Args:
+        process_item: Coroutine function taking one unit
+        queue: Queue of units, terminated by ``None``
+        on_done: Optional callback invoked with each result as soon as it finishes
+        max_pending: Maximum number of units processed at the same time
+        on_exhausted: Optional callback invoked once when the end marker has been read
+    Returns:
+        Number of processed units
+    """
+    pending = set()
+    getter = None
+    count = 0
+    exhausted = False
+
+    def start(unit):
+        nonlocal exhausted
+        if unit is None:
+            exhausted = True
+            if on_exhausted is not None:
+                on_exhausted()
+        else:
+            pending.add(asyncio.ensure_future(process_item(unit)))
+
+    try:
+        while True:
+            # 队列中已有的单元直接取出，队列为空时才等待生产者
+            while not exhausted and getter is None and len(pending) < max_pending:
+                if queue.empty():
+                    getter = asyncio.ensure_future(queue.get())
+                else:
+                    start(queue.get_nowait())
+            if not pending and getter is None:
+                return count
+            done, _ = await asyncio.wait(pending | {getter} if getter is not None else pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future is getter:
+                    getter = None
+                    start(future.result())
+                    continue
+                pending.discard(future)
+                count += 1
+                if on_done is not None:
+                    on_done(future.result())
+    finally:
+        if getter is not None:
+            getter.cancel()
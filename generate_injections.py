@@ -0,0 +1,40 @@
+import argparse
+import time
+
+from injection_generator import InjectionRenderer, criteria_pool, generate, iter_source
+from task_registry import TASKS, get_task
+
+# 从原始语料和判定标准池离线生成大规模注入数据集，字段和格式与已有的 *_injection_dataset.jsonl 相同
+# 使用方法: python generate_injections.py --task toxic_comment --source corpus.jsonl --variants_per_row 50 [--output big.jsonl.gz]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--task", type=str, required=True, choices=list(TASKS), help="Task whose attack templates and class names are used")
+    parser.add_argument("--source", type=str, default=None, help="JSONL corpus with label and raw (or text) per row, defaults to the task's dataset (its clean rows, keeping their original criteria)")
+    parser.add_argument("--criteria", type=str, default=None, help="JSON object of criteria per label, or an injection dataset to collect them from; defaults to the task's dataset")
+    parser.add_argument("--output", type=str, default=None, help="Output file, gzip-compressed if it ends with .gz; defaults to ./tasks/{task}/generated_injection_dataset.jsonl.gz")
+    parser.add_argument("--variants_per_row", type=int, default=1, help="Injections drawn for every source text")
+    parser.add_argument("--criteria_per_row", type=int, default=2, help="Criteria in each injection")
+    parser.add_argument("--injection_types", type=str, nargs="+", default=None, help="Only render these attack templates")
+    parser.add_argument("--no_clean", action="store_true", help="Do not write the clean row of every source text")
+    parser.add_argument("--source_name", type=str, default=None, help="source field of rows that do not have one, defaults to the task's dataset source")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the criteria draws")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N source rows")
+    parser.add_argument("--workers", type=int, default=None, help="Rendering processes, defaults to the number of CPUs")
+    parser.add_argument("--chunk_rows", type=int, default=4096, help="Dataset rows rendered and compressed per task of the process pool")
+    args = parser.parse_args()
+
+    spec = get_task(args.task)
+    if spec.injection is None:
+        parser.error(f"{args.task} has no injection templates in its task.json")
+    try:
+        renderer = InjectionRenderer(spec.injection, criteria_pool(args.criteria or spec.dataset_path), criteria_per_row=args.criteria_per_row,
+                                     variants_per_row=args.variants_per_row, injection_types=args.injection_types, clean=not args.no_clean,
+                                     source=args.source_name, seed=args.seed)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    output = args.output or f"./tasks/{args.task}/generated_injection_dataset.jsonl.gz"
+    started = time.monotonic()
+    summary = generate(renderer, iter_source(args.source or spec.dataset_path, limit=args.limit), output, workers=args.workers, chunk_rows=args.chunk_rows)
+    elapsed = time.monotonic() - started
+    print(f"{args.task}: Wrote {summary['rows']} rows from {summary['source_rows']} source texts to {output} in {elapsed:.1f} s "
+          f"({summary['rows'] / elapsed if elapsed else 0:.0f} rows/s, {summary['jsonl_bytes']} bytes of JSONL, {summary['file_bytes']} bytes on disk)")
@@ -0,0 +1,265 @@
+import gzip
+import json
+import os
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# 每个工作进程中的渲染器，由进程池初始化时传入一次
+_renderer = None
+
+
+def open_text(path: str):
+    """Open a JSONL file for reading, gzip-compressed if it ends with ``.gz``."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def split_criteria(injection: str) -> list:
+    """Criteria of an ``injection`` bullet list (``- criterion`` per line)."""
+    return [line[2:] if line.startswith("- ") else line for line in injection.split("\n") if line.strip()]
+
+
+def format_criteria(criteria: list) -> str:
+    return "\n".join(f"- {criterion}" for criterion in criteria)
+
+
+def criteria_pool(path: str) -> dict:
+    """
+    Criteria the injections are drawn from, per label.
+
+    Args:
+        path: Either a JSON object mapping every label to a list of criteria,
+            or an injection dataset whose ``injection`` bullet lists are collected
+    Returns:
+        Mapping from label (as a string) to distinct criteria, in first-seen order
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return {str(label): list(criteria) for label, criteria in json.load(f).items()}
+    pool = {}
+    with open_text(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if row.get("injection"):
+                # 用字典去重并保持顺序
+                criteria = pool.setdefault(str(row["label"]), {})
+                for criterion in split_criteria(row["injection"]):
+                    criteria[criterion] = None
+    return {label: list(criteria) for label, criteria in pool.items()}
+
+
+def iter_source(path: str, limit: int = None):
+    """
+    Rows of a source corpus, read one line at a time.
+
+    Every row needs ``label`` and ``raw`` (or ``text``); ``index``, ``source``
+    and a preset ``injection`` are optional. Injected rows (with an
+    ``injection_type``) are not yielded, but their ``injection`` is carried
+    over to the clean row with the same ``index`` that follows them, so an
+    existing injection dataset can be used as the corpus of its own clean
+    texts and is re-rendered with its original criteria.
+
+    Args:
+        path: JSONL file, gzip-compressed if it ends with ``.gz``
+        limit: Stop after this many rows
+    """
+    count = 0
+    # 已有数据集中注入副本排在同一index的无注入行之前，只需暂存到遇到该行为止
+    injections = {}
+    with open_text(path) as f:
+        for line in f:
+            if limit is not None and count >= limit:
+                return
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if row.get("injection_type"):
+                if row.get("injection"):
+                    injections.setdefault(row.get("index"), row["injection"])
+                continue
+            injection = injections.pop(row.get("index"), None)
+            if injection is not None and not row.get("injection"):
+                row["injection"] = injection
+            count += 1
+            yield row
+
+
+class InjectionRenderer:
+    """
+    Turns clean source rows into injection dataset rows of one task.
+
+    Every variant of a source row draws ``criteria_per_row`` criteria of the
+    row's own label from the pool (the first variant uses the row's preset
+    ``injection`` instead, if it has one) and is rendered with every attack
+    template of the task; the criteria describe the true class and the
+    injected reasoning argues that the text does not meet them, steering the
+    model to the other class. Rows keep the field order of the shipped
+    datasets (``index``, ``text``, ``source``, ``raw``, ``injection``,
+    ``label``, ``injection_type``) and are serialized the same way, so a
+    shipped dataset read back with :func:`iter_source`, which keeps the
+    original criteria, is reproduced byte for byte. Criteria are drawn with a
+    random generator seeded by ``(seed, source position, variant)``, so the
+    output does not depend on the number of worker processes.
+    """
+
+    def __init__(self, injection: dict, pool: dict, criteria_per_row: int = 2, variants_per_row: int = 1,
+                 injection_types: list = None, clean: bool = True, source: str = None, seed: int = 0):
+        """
+        Args:
+            injection: ``TaskSpec.injection`` of the task (class names and templates)
+            pool: Criteria per label, from :func:`criteria_pool`
+            criteria_per_row: Criteria in each injection
+            variants_per_row: Injections drawn for every source row
+            injection_types: Only render these templates, defaults to all of them
+            clean: Also write the clean row after the injected copies of a text
+            source: ``source`` of rows that do not have one, defaults to the task's
+            seed: Seed of the criteria draws
+        """
+        if len(injection["classes"]) != 2:
+            raise ValueError(f"Injections need exactly two classes, got {', '.join(injection['classes'])}")
+        self.classes = injection["classes"]
+        self.templates = [(kind, template) for kind, template in injection["templates"]
+                          if injection_types is None or kind in injection_types]
+        if not self.templates:
+            raise ValueError(f"No injection templates among {', '.join(injection_types)}")
+        self.pool = pool
+        for label in self.classes:
+            if not pool.get(label):
+                raise ValueError(f"No criteria for label {label!r} in the criteria pool")
+        self.criteria_per_row = criteria_per_row
+        self.variants_per_row = variants_per_row
+        self.clean = clean
+        self.source = source or injection.get("source")
+        self.seed = seed
+
+    def rows_per_source(self) -> int:
+        return self.variants_per_row * len(self.templates) + self.clean
+
+    def rows(self, position: int, row: dict) -> list:
+        """Dataset rows of one source row: its injected copies, then the clean row."""
+        raw = row["raw"] if "raw" in row else row["text"]
+        label = row["label"]
+        if str(label) not in self.classes:
+            raise ValueError(f"Unknown label {label!r} at source row {position + 1}, expected one of {', '.join(self.classes)}")
+        target = self.classes[str(label)]
+        other = next(name for key, name in self.classes.items() if key != str(label))
+        index = row.get("index", position + 1)
+        source = row.get("source", self.source)
+        rows = []
+        for variant in range(self.variants_per_row):
+            if variant == 0 and row.get("injection"):
+                criteria = split_criteria(row["injection"])
+            else:
+                pool = self.pool[str(label)]
+                rng = random.Random(f"{self.seed}:{position}:{variant}")
+                criteria = rng.sample(pool, min(self.criteria_per_row, len(pool)))
+            injection = format_criteria(criteria)
+            for kind, template in self.templates:
+                text = template.format(raw=raw, target=target, other=other, criteria=injection, count=len(criteria), first=criteria[0])
+                rows.append({"index": index, "text": text, "source": source, "raw": raw, "injection": injection,
+                             "label": label, "injection_type": kind})
+        if self.clean:
+            # 无注入的行没有injection_type字段
+            rows.append({"index": index, "text": raw, "source": source, "raw": raw, "injection": None, "label": label})
+        return rows
+
+    def render_chunk(self, chunk: list) -> tuple:
+        """
+        Serialize the rows of a chunk of ``(position, source row)`` pairs.
+
+        Returns:
+            ``(UTF-8 JSONL bytes, number of rows)``
+        """
+        lines = [json.dumps(row) for position, source_row in chunk for row in self.rows(position, source_row)]
+        return "".join(line + "\n" for line in lines).encode("utf-8"), len(lines)
+
+
+def _encode_chunk(renderer: InjectionRenderer, chunk: list, compress: bool) -> tuple:
+    data, rows = renderer.render_chunk(chunk)
+    # 每个分块压缩成独立的gzip成员，拼接后仍是合法的gzip文件，压缩也在工作进程中并行完成
+    return (gzip.compress(data, mtime=0) if compress else data), len(data), rows, len(chunk)
+
+
+def _init_worker(renderer: InjectionRenderer):
+    global _renderer
+    _renderer = renderer
+
+
+def _render_chunk(chunk: list, compress: bool) -> tuple:
+    return _encode_chunk(_renderer, chunk, compress)
+
+
+def _chunks(source_rows, chunk_rows: int):
+    chunk = []
+    for position, row in enumerate(source_rows):
+        chunk.append((position, row))
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def render_chunks(renderer: InjectionRenderer, source_rows, workers: int = None, chunk_rows: int = 4096, compress: bool = False):
+    """
+    Render source rows in a process pool, yielding the chunks in input order.
+
+    At most two chunks per worker are queued, so memory stays bounded
+    whatever the size of the corpus.
+
+    Args:
+        renderer: Renderer sent once to every worker
+        source_rows: Iterable of source rows, e.g. from :func:`iter_source`
+        workers: Worker processes, defaults to the number of CPUs (1 renders in this process)
+        chunk_rows: Dataset rows per chunk (whole source rows, at least one)
+        compress: gzip every chunk in the worker
+    Returns:
+        Generator of ``(bytes, JSONL bytes, dataset rows, source rows)`` per chunk
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = _chunks(source_rows, max(1, chunk_rows // renderer.rows_per_source()))
+    if workers == 1:
+        for chunk in chunks:
+            yield _encode_chunk(renderer, chunk, compress)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(renderer,)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_render_chunk, chunk, compress))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def generate(renderer: InjectionRenderer, source_rows, output_path: str, workers: int = None, chunk_rows: int = 4096) -> dict:
+    """
+    Stream a generated injection dataset into ``output_path``.
+
+    The output is gzip-compressed if the path ends with ``.gz`` (one gzip
+    member per chunk, with a fixed header timestamp, so identical inputs give
+    identical files) and written to a temporary file that replaces
+    ``output_path`` once complete. Decompress it before running the
+    classifiers, which memory-map plain JSONL.
+
+    Returns:
+        Dict with the number of source rows and dataset rows, and the JSONL and file sizes in bytes
+    """
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    summary = {"source_rows": 0, "rows": 0, "jsonl_bytes": 0}
+    with open(tmp_path, "wb") as out:
+        chunks = render_chunks(renderer, source_rows, workers=workers, chunk_rows=chunk_rows, compress=output_path.endswith(".gz"))
+        for data, jsonl_bytes, rows, source_count in chunks:
+            out.write(data)
+            summary["source_rows"] += source_count
+            summary["rows"] += rows
+            summary["jsonl_bytes"] += jsonl_bytes
+    os.replace(tmp_path, output_path)
+    summary["file_bytes"] = os.path.getsize(output_path)
+    return summary
@@ -0,0 +1,25 @@
+import argparse
+
+from dataset import load_dataset
+from sharding import merge_shards
+from task_registry import TASKS, get_task
+
+# 合并各节点 --shard K/N 运行得到的结果文件，输出与单节点运行相同的结果文件
+# 使用方法: python merge_shards.py --model_name your-model-name --num_shards 4 [--tasks toxic_comment]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=str, nargs="+", default=list(TASKS), choices=list(TASKS), help="Tasks to merge")
+    parser.add_argument("--model_name", type=str, default="gemma3-27b", help="Name of the language model")
+    parser.add_argument("--num_shards", type=int, required=True, help="Number of shards N the run was split into")
+    parser.add_argument("--dataset_path", type=str, default=None, help="Dataset the shards were run on with run_tasks.py --dataset_path (single task only)")
+    parser.add_argument("--allow_missing", action="store_true", help="Write the merged file even if some rows are missing")
+    args = parser.parse_args()
+    if args.dataset_path is not None and len(args.tasks) != 1:
+        parser.error("--dataset_path replaces the dataset of a single task, select it with --tasks")
+
+    for name in args.tasks:
+        spec = get_task(name) if args.dataset_path is None else get_task(name).with_dataset(args.dataset_path)
+        dataset_size = len(load_dataset(spec.dataset_path))
+        summary = merge_shards(spec.result_path(args.model_name), dataset_size, args.num_shards, allow_missing=args.allow_missing)
+        print(f"{name}: Merged {summary['merged']}/{dataset_size} rows into {spec.result_path(args.model_name)} "
+              f"(rows per shard: {summary['rows_per_shard']}, missing: {summary['missing']})")
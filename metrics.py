@@ -0,0 +1,295 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 每条请求的统计按这些标签分组
+TAG_NAMES = ("task", "variant", "stage", "injection_type")
+
+PERCENTILES = (50, 95, 99)
+
+# 生成token数直方图的桶上界，用于比较各提示词变体实际用掉的生成预算
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Linearly interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * p / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def token_histogram(counts: list) -> dict:
+    """Number of responses with at most ``le`` completion tokens per bucket (not cumulative); "+Inf" holds the rest."""
+    histogram = dict.fromkeys([str(bound) for bound in TOKEN_BUCKETS] + ["+Inf"], 0)
+    for count in counts:
+        for bound in TOKEN_BUCKETS:
+            if count <= bound:
+                histogram[str(bound)] += 1
+                break
+        else:
+            histogram["+Inf"] += 1
+    return histogram
+
+
+def distribution(values: list) -> dict:
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    summary = {f"p{p}": round(percentile(values, p), 4) for p in PERCENTILES}
+    summary["mean"] = round(sum(values) / len(values), 4)
+    summary["max"] = round(values[-1], 4)
+    return summary
+
+
+class _Group:
+    """Samples of one tag combination."""
+
+    def __init__(self):
+        self.requests = 0
+        self.cached = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.truncated = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.queue_wait = []
+        self.ttft = []
+        self.latency = []
+        self.decode_rate = []
+        self.completion_token_counts = []
+
+
+class MetricsCollector:
+    """
+    Per-request latency and token accounting for one run.
+
+    The engine reports every ``ask_question`` call through :meth:`record`,
+    tagged with task, prompt variant, stage and ``injection_type``. Samples
+    are kept per tag combination so :meth:`summary` can report exact
+    percentiles; :meth:`prometheus_text` renders the same data in the
+    Prometheus text format while the run is going.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.groups = defaultdict(_Group)
+        self.endpoints = defaultdict(lambda: {"requests": 0, "errors": 0})
+        # 运行器附加到报告中的其他部分，如完工时间比较
+        self.sections = {}
+        self._lock = threading.Lock()
+
+    def record(self, tags: dict = None, queue_wait: float = None, ttft: float = None, latency: float = None,
+               prompt_tokens: int = None, completion_tokens: int = None, retries: int = 0,
+               endpoint: str = None, cached: bool = False, coalesced: bool = False, error: bool = False,
+               truncated: bool = False):
+        """
+        Record one finished call.
+
+        Args:
+            tags: Values for ``TAG_NAMES``; missing tags are recorded as ""
+            queue_wait: Seconds spent waiting for a concurrency slot, over all attempts
+            ttft: Seconds from sending the final attempt to its first content token
+            latency: Seconds from sending the final attempt to its last token
+            prompt_tokens: Prompt tokens reported by the server in ``usage``
+            completion_tokens: Completion tokens reported by the server in ``usage``
+            retries: Number of attempts before the final one
+            endpoint: Base URL of the endpoint that served the final attempt
+            cached: Whether the response came from the response cache
+            coalesced: Whether the call waited for an identical request already in flight
+            error: Whether the call raised
+            truncated: Whether the response stopped at its ``max_tokens`` budget
+        """
+        key = tuple(str((tags or {}).get(name, "")) for name in TAG_NAMES)
+        with self._lock:
+            group = self.groups[key]
+            group.requests += 1
+            group.retries += retries
+            if cached:
+                group.cached += 1
+                return
+            if coalesced:
+                group.coalesced += 1
+                return
+            if endpoint is not None:
+                self.endpoints[endpoint]["requests"] += 1
+                self.endpoints[endpoint]["errors"] += int(error)
+            if error:
+                group.errors += 1
+                return
+            group.prompt_tokens += prompt_tokens or 0
+            group.completion_tokens += completion_tokens or 0
+            group.truncated += int(truncated)
+            if completion_tokens is not None:
+                group.completion_token_counts.append(completion_tokens)
+            group.queue_wait.append(queue_wait)
+            group.ttft.append(ttft)
+            group.latency.append(latency)
+            if completion_tokens and ttft is not None and latency > ttft:
+                group.decode_rate.append(completion_tokens / (latency - ttft))
+
+    def _summarize(self, groups: list, elapsed: float) -> dict:
+        merged = _Group()
+        for group in groups:
+            for field in ("requests", "cached", "coalesced", "errors", "truncated", "retries", "prompt_tokens", "completion_tokens"):
+                setattr(merged, field, getattr(merged, field) + getattr(group, field))
+            for field in ("queue_wait", "ttft", "latency", "decode_rate", "completion_token_counts"):
+                getattr(merged, field).extend(getattr(group, field))
+        served = len(merged.latency)
+        # 未命中缓存的调用中，由正在进行的相同请求应答的比例
+        live = merged.requests - merged.cached
+        return {
+            "requests": merged.requests,
+            "cached": merged.cached,
+            "coalesced": merged.coalesced,
+            "dedup_ratio": round(merged.coalesced / live, 4) if live else None,
+            "errors": merged.errors,
+            "truncated": merged.truncated,
+            "retries": merged.retries,
+            "prompt_tokens": merged.prompt_tokens,
+            "completion_tokens": merged.completion_tokens,
+            "mean_completion_tokens": round(merged.completion_tokens / served, 2) if served else None,
+            "completion_tokens_per_response": distribution(merged.completion_token_counts),
+            "completion_tokens_histogram": token_histogram(merged.completion_token_counts),
+            "completion_tokens_per_s": round(merged.completion_tokens / elapsed, 2) if elapsed else None,
+            "queue_wait_s": distribution(merged.queue_wait),
+            "ttft_s": distribution(merged.ttft),
+            "latency_s": distribution(merged.latency),
+            "decode_tokens_per_s": distribution(merged.decode_rate),
+        }
+
+    def summary(self) -> dict:
+        """
+        Machine-readable run report.
+
+        Returns:
+            Dict with the overall statistics, one entry per tag dimension value
+            (``by_task``, ``by_variant``, ...), every tag combination and the
+            per-endpoint counts. Throughput is measured over the wall time of the run.
+        """
+        elapsed = time.monotonic() - self.started
+        with self._lock:
+            groups = dict(self.groups)
+            report = {"elapsed_s": round(elapsed, 3), "overall": self._summarize(list(groups.values()), elapsed)}
+            for position, name in enumerate(TAG_NAMES):
+                by_value = defaultdict(list)
+                for key, group in groups.items():
+                    by_value[key[position]].append(group)
+                report[f"by_{name}"] = {value: self._summarize(members, elapsed) for value, members in sorted(by_value.items())}
+            report["groups"] = [dict(zip(TAG_NAMES, key), **self._summarize([group], elapsed)) for key, group in sorted(groups.items())]
+            report["endpoints"] = {endpoint: dict(counts) for endpoint, counts in self.endpoints.items()}
+        report["token_usage"] = self.token_usage()
+        report.update(self.sections)
+        return report
+
+    def token_usage(self) -> dict:
+        """
+        Completion tokens used per stage and prompt variant, to compare the budgets of defense templates.
+
+        Returns:
+            ``{stage: {variant: {"responses", "truncated", "completion_tokens", "histogram"}}}`` where
+            ``completion_tokens`` holds percentiles and ``histogram`` the counts per ``TOKEN_BUCKETS`` bucket
+        """
+        stage_position, variant_position = TAG_NAMES.index("stage"), TAG_NAMES.index("variant")
+        counts = defaultdict(list)
+        truncated = defaultdict(int)
+        with self._lock:
+            for key, group in self.groups.items():
+                cell = (key[stage_position], key[variant_position])
+                counts[cell].extend(group.completion_token_counts)
+                truncated[cell] += group.truncated
+        usage = defaultdict(dict)
+        for (stage, variant), values in sorted(counts.items()):
+            if values:
+                usage[stage][variant] = {"responses": len(values), "truncated": truncated[(stage, variant)],
+                                         "completion_tokens": distribution(values), "histogram": token_histogram(values)}
+        return dict(usage)
+
+    def write_summary(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def prometheus_text(self) -> str:
+        """Current metrics in the Prometheus text exposition format."""
+        def labels(key, **extra):
+            pairs = list(zip(TAG_NAMES, key)) + list(extra.items())
+            return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            groups = sorted(self.groups.items())
+            lines.append("# TYPE criteria_requests_total counter")
+            for key, group in groups:
+                served = group.requests - group.cached - group.coalesced - group.errors
+                for outcome, count in (("ok", served), ("cached", group.cached), ("coalesced", group.coalesced), ("error", group.errors)):
+                    lines.append(f"criteria_requests_total{labels(key, outcome=outcome)} {count}")
+            lines.append("# TYPE criteria_retries_total counter")
+            for key, group in groups:
+                lines.append(f"criteria_retries_total{labels(key)} {group.retries}")
+            lines.append("# TYPE criteria_tokens_total counter")
+            for key, group in groups:
+                lines.append(f"criteria_tokens_total{labels(key, kind='prompt')} {group.prompt_tokens}")
+                lines.append(f"criteria_tokens_total{labels(key, kind='completion')} {group.completion_tokens}")
+            lines.append("# TYPE criteria_truncated_total counter")
+            for key, group in groups:
+                lines.append(f"criteria_truncated_total{labels(key)} {group.truncated}")
+            lines.append("# TYPE criteria_completion_tokens histogram")
+            for key, group in groups:
+                if not group.completion_token_counts:
+                    continue
+                cumulative = 0
+                for bound, count in token_histogram(group.completion_token_counts).items():
+                    cumulative += count
+                    lines.append(f"criteria_completion_tokens_bucket{labels(key, le=bound)} {cumulative}")
+                lines.append(f"criteria_completion_tokens_sum{labels(key)} {sum(group.completion_token_counts)}")
+                lines.append(f"criteria_completion_tokens_count{labels(key)} {len(group.completion_token_counts)}")
+            for metric, field in (("queue_wait", "queue_wait"), ("ttft", "ttft"), ("latency", "latency")):
+                lines.append(f"# TYPE criteria_{metric}_seconds summary")
+                for key, group in groups:
+                    values = sorted(value for value in getattr(group, field) if value is not None)
+                    if not values:
+                        continue
+                    for p in PERCENTILES:
+                        lines.append(f"criteria_{metric}_seconds{labels(key, quantile=p / 100)} {percentile(values, p):.6f}")
+                    lines.append(f"criteria_{metric}_seconds_sum{labels(key)} {sum(values):.6f}")
+                    lines.append(f"criteria_{metric}_seconds_count{labels(key)} {len(values)}")
+            lines.append("# TYPE criteria_endpoint_requests_total counter")
+            for endpoint, counts in self.endpoints.items():
+                lines.append('criteria_endpoint_requests_total{endpoint="%s"} %d' % (endpoint, counts["requests"]))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Atomically replace ``path`` with the current metrics (for node_exporter's textfile collector)."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def serve_prometheus(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve ``/metrics`` on ``host:port`` from a daemon thread; call ``shutdown()`` on the result to stop."""
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = collector.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -0,0 +1,405 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from collections import Counter
+
+from task_registry import TASKS
+from utils import vllm_port
+from verdict import build_extractor
+
+REASONS = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+# 估算token数时每个token平均对应的字符数，与rate_limit.RateLimiter一致
+CHARS_PER_TOKEN = 4
+
+FILLER = "Let me read the text carefully and weigh every part of it against the criterion. "
+
+
+def parse_distribution(spec: str):
+    """
+    Parse a latency distribution.
+
+    Args:
+        spec: "fixed:S", "uniform:LOW,HIGH", "exp:MEAN" or "lognormal:MEDIAN,SIGMA", in seconds
+    Returns:
+        Function drawing one value from a ``random.Random``
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    try:
+        if kind == "fixed":
+            (seconds,) = values
+            return lambda rng: seconds
+        if kind == "uniform":
+            low, high = values
+            return lambda rng: rng.uniform(low, high)
+        if kind == "exp":
+            (mean,) = values
+            return lambda rng: rng.expovariate(1 / mean) if mean > 0 else 0.0
+        if kind == "lognormal":
+            median, sigma = values
+            return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"Invalid distribution: {spec}, expected fixed:S, uniform:LOW,HIGH, exp:MEAN or lognormal:MEDIAN,SIGMA")
+
+
+def parse_error_rate(spec: str):
+    """Parse "KIND=RATE", KIND being 429, 500, 503, timeout or disconnect."""
+    kind, _, rate = spec.partition("=")
+    if kind not in ("429", "500", "503", "timeout", "disconnect"):
+        raise argparse.ArgumentTypeError(f"Unknown error kind: {kind}, expected 429, 500, 503, timeout or disconnect")
+    try:
+        return kind, float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid error rate: {spec}")
+
+
+def count_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def message_text(messages: list) -> str:
+    """Concatenated text of chat messages, whose content may be a string or a list of parts."""
+    parts = []
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(part.get("text", "") for part in content)
+    return "\n".join(parts)
+
+
+class CannedResponder:
+    """
+    Canned analysis and judge responses for the registered tasks.
+
+    The task and stage of a prompt are recognized by the prompt templates of
+    :mod:`task_registry`. Analyses end with a bold final label the local
+    verdict extractor accepts, except for ``ambiguous_rate`` of them that
+    mention no label and so need a judge call; ``bad_json_rate`` of the judge
+    responses are not JSON, which exercises the parse retries. Labels and
+    texts are chosen by a hash of the prompt, so the same prompt always gets
+    the same response. Guided-decoding requests get a JSON document generated
+    from their schema.
+    """
+
+    def __init__(self, analysis_tokens: int = 128, ambiguous_rate: float = 0.1, bad_json_rate: float = 0.0,
+                 seed: int = 0, responses: dict = None):
+        """
+        Args:
+            analysis_tokens: Approximate length of an analysis, most of it inside ``<think>``
+            ambiguous_rate: Share of analyses without a clear label
+            bad_json_rate: Share of judge responses that are not valid JSON
+            seed: Changes which label every prompt gets
+            responses: Optional ``{task: {"analysis": [...], "judge": [...]}}`` replacing the
+                generated texts of these stages
+        """
+        self.analysis_tokens = analysis_tokens
+        self.ambiguous_rate = ambiguous_rate
+        self.bad_json_rate = bad_json_rate
+        self.seed = seed
+        self.responses = responses or {}
+        self.labels = {name: build_extractor(name).labels for name in TASKS}
+        # (提示词前缀, 任务, 阶段)，长前缀优先匹配
+        self.prefixes = []
+        for spec in TASKS.values():
+            self.prefixes.append((spec.judge_prompt_template.split("{analysis}")[0].replace("{{", "{"), spec.name, "judge"))
+            for _, template in spec.variants:
+                self.prefixes.append((template.split("{" + spec.text_key + "}")[0], spec.name, "analysis"))
+        self.prefixes.sort(key=lambda entry: len(entry[0]), reverse=True)
+
+    def detect(self, prompt: str):
+        """Task and stage ("analysis" or "judge") of a prompt, (None, None) if unknown."""
+        for prefix, task, stage in self.prefixes:
+            if prompt.startswith(prefix):
+                return task, stage
+        return None, None
+
+    def _rng(self, prompt: str) -> random.Random:
+        digest = hashlib.md5(f"{self.seed}:{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "little"))
+
+    def _analysis(self, task: str, rng: random.Random) -> str:
+        filler = FILLER * max(1, self.analysis_tokens * CHARS_PER_TOKEN // len(FILLER))
+        if rng.random() < self.ambiguous_rate:
+            return f"<think>{filler}</think>The text has aspects pointing both ways, so it is hard to reach a clear verdict."
+        label = rng.choice(list(self.labels[task]))
+        return f"<think>{filler}</think>Weighing the evidence above, the final answer is **{label}**."
+
+    def _from_schema(self, schema: dict, rng: random.Random, name: str = None):
+        """按JSON schema生成一个合法的文档，analysis字段填入分析文本"""
+        if "enum" in schema:
+            return rng.choice(schema["enum"])
+        kind = schema.get("type")
+        if kind == "object":
+            return {key: self._from_schema(value, rng, key) for key, value in schema.get("properties", {}).items()}
+        if kind == "array":
+            return [self._from_schema(schema.get("items", {}), rng)]
+        if kind == "boolean":
+            return rng.random() < 0.5
+        if kind in ("integer", "number"):
+            return 0
+        if name == "analysis":
+            return (FILLER * max(1, self.analysis_tokens * CHARS_PER_TOKEN // len(FILLER))).strip()
+        return "mock"
+
+    def respond(self, body: dict) -> str:
+        """Response text for a chat completion request body."""
+        prompt = message_text(body.get("messages", []))
+        rng = self._rng(prompt)
+        schema = body.get("guided_json")
+        if schema is None and (body.get("response_format") or {}).get("type") == "json_schema":
+            schema = body["response_format"]["json_schema"].get("schema")
+        if schema is not None:
+            return json.dumps(self._from_schema(schema, rng))
+        task, stage = self.detect(prompt)
+        if task is None:
+            return f"This is a mock response to a prompt of {count_tokens(prompt)} tokens."
+        canned = self.responses.get(task, {}).get(stage)
+        if canned:
+            return rng.choice(canned)
+        if stage == "analysis":
+            return self._analysis(task, rng)
+        if rng.random() < self.bad_json_rate:
+            return "I am not sure which label applies."
+        label = rng.choice(list(self.labels[task]))
+        return "```json\n" + json.dumps(self.labels[task][label]) + "\n```"
+
+
+class MockServer:
+    """
+    OpenAI-compatible ``/v1/chat/completions`` server for load tests.
+
+    Written directly on asyncio streams so one process can keep thousands of
+    keep-alive connections open without a thread per request. A request
+    waits for a free slot if ``capacity`` is set (like sequences in a vLLM
+    batch), then for its time to first token (``ttft`` plus the prompt at
+    ``prefill_tokens_per_s``), then emits the completion at ``tokens_per_s``,
+    streamed in chunks of ``chunk_tokens`` when the client asks for a stream.
+    ``errors`` maps an error kind to the share of requests failing with it:
+    429/503 are returned at once, 500 after the time to first token,
+    "timeout" hangs for ``hang_seconds`` and "disconnect" closes the
+    connection without a response.
+    """
+
+    def __init__(self, responder: CannedResponder, ttft=None, tokens_per_s: float = 0.0,
+                 prefill_tokens_per_s: float = 0.0, chunk_tokens: int = 4, capacity: int = 0,
+                 errors: dict = None, retry_after: float = None, hang_seconds: float = 30.0, seed: int = 0):
+        self.responder = responder
+        self.ttft = ttft or (lambda rng: 0.0)
+        self.tokens_per_s = tokens_per_s
+        self.prefill_tokens_per_s = prefill_tokens_per_s
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.capacity = asyncio.Semaphore(capacity) if capacity else None
+        self.errors = errors or {}
+        self.retry_after = retry_after
+        self.hang_seconds = hang_seconds
+        self.rng = random.Random(seed)
+        self.counts = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.started = time.monotonic()
+        self._next_id = 0
+
+    def stats(self) -> dict:
+        return {"uptime_s": round(time.monotonic() - self.started, 3), "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight, **self.counts}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                keep_alive = await self.dispatch(method, path.split("?")[0], body, writer)
+                if not keep_alive or headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def send_json(self, writer, status: int, payload: dict, headers: dict = None) -> bool:
+        body = json.dumps(payload).encode("utf-8")
+        head = f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        for name, value in (headers or {}).items():
+            head += f"{name}: {value}\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        await writer.drain()
+        return True
+
+    async def dispatch(self, method: str, path: str, body: bytes, writer) -> bool:
+        """处理一个请求，返回连接是否可以继续复用"""
+        if method == "GET" and path.endswith("/models"):
+            return await self.send_json(writer, 200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        if method == "GET" and path in ("/health", "/stats"):
+            return await self.send_json(writer, 200, self.stats())
+        if method == "POST" and path.endswith("/chat/completions"):
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                return await self.chat_completion(json.loads(body), writer)
+            finally:
+                self.in_flight -= 1
+        return await self.send_json(writer, 404, {"error": {"message": f"Unknown route {method} {path}"}})
+
+    def draw_error(self):
+        draw = self.rng.random()
+        for kind, rate in self.errors.items():
+            if draw < rate:
+                return kind
+            draw -= rate
+        return None
+
+    async def send_error(self, writer, status: int) -> bool:
+        self.counts[f"errors_{status}"] += 1
+        headers = {"Retry-After": self.retry_after} if status == 429 and self.retry_after is not None else None
+        return await self.send_json(writer, status, {"error": {"message": f"mock error {status}", "type": "mock", "code": status}}, headers)
+
+    async def chat_completion(self, body: dict, writer) -> bool:
+        self.counts["requests"] += 1
+        error = self.draw_error()
+        if error in ("429", "503"):
+            return await self.send_error(writer, int(error))
+        if error == "disconnect":
+            self.counts["errors_disconnect"] += 1
+            return False
+        if error == "timeout":
+            self.counts["errors_timeout"] += 1
+            await asyncio.sleep(self.hang_seconds)
+            return False
+
+        text = self.responder.respond(body)
+        prompt_tokens = count_tokens(message_text(body.get("messages", [])))
+        finish_reason = "stop"
+        stop = body.get("stop") or []
+        for sequence in [stop] if isinstance(stop, str) else stop:
+            # 与vLLM一样，停止序列本身不出现在回复中
+            if sequence in text:
+                text = text[:text.index(sequence)]
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        if max_tokens and count_tokens(text) > max_tokens:
+            text = text[:max_tokens * CHARS_PER_TOKEN]
+            finish_reason = "length"
+        completion_tokens = count_tokens(text)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        self._next_id += 1
+        response_id = f"chatcmpl-mock-{self._next_id}"
+        model = body.get("model", "mock")
+
+        if self.capacity is not None:
+            await self.capacity.acquire()
+        try:
+            ttft = self.ttft(self.rng)
+            if self.prefill_tokens_per_s:
+                ttft += prompt_tokens / self.prefill_tokens_per_s
+            await asyncio.sleep(ttft)
+            if error == "500":
+                return await self.send_error(writer, 500)
+            self.counts["completions"] += 1
+            self.counts["completion_tokens"] += completion_tokens
+            if not body.get("stream"):
+                if self.tokens_per_s:
+                    await asyncio.sleep(completion_tokens / self.tokens_per_s)
+                return await self.send_json(writer, 200, {
+                    "id": response_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}],
+                    "usage": usage,
+                })
+            return await self.stream(writer, response_id, model, text, finish_reason,
+                                     usage if (body.get("stream_options") or {}).get("include_usage") else None)
+        finally:
+            if self.capacity is not None:
+                self.capacity.release()
+
+    async def stream(self, writer, response_id: str, model: str, text: str, finish_reason: str, usage: dict) -> bool:
+        """以SSE分块发送回复，使用chunked编码以便复用连接"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n")
+        created = int(time.time())
+
+        def event(choices: list, **extra) -> bytes:
+            data = json.dumps({"id": response_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                               "choices": choices, **extra})
+            payload = f"data: {data}\n\n".encode("utf-8")
+            return f"{len(payload):x}\r\n".encode("latin-1") + payload + b"\r\n"
+
+        chunk_chars = self.chunk_tokens * CHARS_PER_TOKEN
+        for start in range(0, len(text), chunk_chars):
+            if start and self.tokens_per_s:
+                await asyncio.sleep(self.chunk_tokens / self.tokens_per_s)
+            delta = {"content": text[start:start + chunk_chars]}
+            if not start:
+                delta["role"] = "assistant"
+            writer.write(event([{"index": 0, "delta": delta, "finish_reason": None}]))
+            await writer.drain()
+        writer.write(event([{"index": 0, "delta": {}, "finish_reason": finish_reason}]))
+        if usage is not None:
+            writer.write(event([], usage=usage))
+        done = b"data: [DONE]\n\n"
+        writer.write(f"{len(done):x}\r\n".encode("latin-1") + done + b"\r\n0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    async def serve(self, host: str = "127.0.0.1", port: int = vllm_port):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=4096)
+        print(f"Mock server listening on http://{host}:{port}/v1", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Register the mock server options (also forwarded by the benchmark)."""
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=vllm_port, help="Port to listen on, defaults to the vLLM port the tasks use")
+    parser.add_argument("--ttft", type=parse_distribution, default="lognormal:0.05,0.5", help="Time to first token: fixed:S, uniform:LOW,HIGH, exp:MEAN or lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--tokens_per_s", type=float, default=1000.0, help="Decode speed of one response, 0 sends the whole completion at once")
+    parser.add_argument("--prefill_tokens_per_s", type=float, default=0.0, help="Prompt tokens processed per second, added to the time to first token (0 disables)")
+    parser.add_argument("--chunk_tokens", type=int, default=4, help="Tokens per streamed chunk")
+    parser.add_argument("--capacity", type=int, default=0, help="Requests processed at once, later ones queue (0 is unlimited)")
+    parser.add_argument("--errors", type=parse_error_rate, nargs="*", default=[], help="Injected errors as KIND=RATE, KIND one of 429, 500, 503, timeout, disconnect")
+    parser.add_argument("--retry_after", type=float, default=None, help="Retry-After header of 429 responses")
+    parser.add_argument("--hang_seconds", type=float, default=30.0, help="How long a request injected with a timeout hangs before the connection is closed")
+    parser.add_argument("--analysis_tokens", type=int, default=128, help="Approximate length of a canned analysis")
+    parser.add_argument("--ambiguous_rate", type=float, default=0.1, help="Share of analyses the local verdict extractor cannot decide, so a judge call follows")
+    parser.add_argument("--bad_json_rate", type=float, default=0.0, help="Share of judge responses that are not valid JSON")
+    parser.add_argument("--responses", type=str, default=None, help='JSON file {"task": {"analysis": [...], "judge": [...]}} with canned responses to use instead')
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the latency, error and label draws")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+    responses = None
+    if args.responses:
+        with open(args.responses, "r") as f:
+            responses = json.load(f)
+    responder = CannedResponder(args.analysis_tokens, args.ambiguous_rate, args.bad_json_rate, args.seed, responses)
+    server = MockServer(responder, ttft=args.ttft, tokens_per_s=args.tokens_per_s, prefill_tokens_per_s=args.prefill_tokens_per_s,
+                        chunk_tokens=args.chunk_tokens, capacity=args.capacity, errors=dict(args.errors),
+                        retry_after=args.retry_after, hang_seconds=args.hang_seconds, seed=args.seed)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+# 本地模拟OpenAI兼容服务，不占用GPU即可测试和压测任务
+# 使用方法: python mock_server.py [--port 2337] [--ttft lognormal:0.05,0.5] [--errors 429=0.01 timeout=0.001]
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at ``rate`` units per second, holding at most ``burst``.
+
+    The bucket always holds at least one unit, so a rate below one per second
+    still admits one whole request at a time instead of half a request
+    twice as often. :meth:`acquire` waits until the requested amount is available. :meth:`charge`
+    takes units without waiting and may leave the bucket in debt, which is how
+    costs only known after a request (actual token usage) are accounted for.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate, 1.0)
+        self.level = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.burst, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        # 超过桶容量的请求只要求桶满，否则会永远等待；桶容量至少为1，单个请求不会被打折
+        amount = min(amount, self.burst)
+        async with self._lock:
+            self._refill()
+            while self.level < amount:
+                await asyncio.sleep((amount - self.level) / self.rate)
+                self._refill()
+            self.level -= amount
+
+    def charge(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+
+class RateLimiter:
+    """
+    Global limit on requests per second and tokens per second.
+
+    Prompt tokens are estimated from the prompt length before sending; once
+    the server reports ``usage`` the difference and the completion tokens are
+    charged to the token bucket.
+    """
+
+    # 估算token数时每个token平均对应的字符数
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, requests_per_s: float = None, tokens_per_s: float = None):
+        self.requests = TokenBucket(requests_per_s) if requests_per_s else None
+        self.tokens = TokenBucket(tokens_per_s) if tokens_per_s else None
+
+    def estimate_tokens(self, prompt: str) -> int:
+        return len(prompt) // self.CHARS_PER_TOKEN + 1
+
+    async def acquire(self, prompt: str) -> int:
+        """
+        Wait until a request for ``prompt`` may be sent.
+
+        Returns:
+            Estimated prompt tokens charged, to pass to :meth:`settle`
+        """
+        estimate = self.estimate_tokens(prompt)
+        if self.requests is not None:
+            await self.requests.acquire()
+        if self.tokens is not None:
+            await self.tokens.acquire(estimate)
+        return estimate
+
+    def settle(self, estimate: int, usage=None):
+        """
+        Settle one attempt, successful or not.
+
+        The estimate charged by :meth:`acquire` stays spent even when the
+        attempt failed, so retries after 429/5xx count against the budget
+        like any other request; when the server reported ``usage``, the
+        difference to the actual tokens is charged as well.
+        """
+        if self.tokens is not None and usage is not None:
+            self.tokens.charge(usage.prompt_tokens + usage.completion_tokens - estimate)
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class CacheMissError(LookupError):
+    """Raised in replay mode when a request has no cached response."""
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of raw model responses.
+
+    Entries are keyed by a hash of (model_name, endpoint, messages, sampling
+    params) and stored in SQLite in WAL mode, so several threads and
+    processes can read and write the same file. When the stored text grows
+    beyond ``max_bytes`` the least recently used entries are evicted.
+
+    Modes:
+        ``readwrite``: look up first, store new responses
+        ``replay``: look up only, raise :class:`CacheMissError` on a miss
+        ``write``: never look up, always store (refresh the cache)
+    """
+
+    MODES = ("readwrite", "replay", "write")
+
+    def __init__(self, path: str, mode: str = "readwrite", max_bytes: int = None, evict_every: int = 256):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite连接不能跨线程共享，每个线程各自打开一个
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(model_name: str, endpoint: str, messages: list, params: dict = None) -> str:
+        """
+        Hash a request into a stable cache key.
+
+        Args:
+            model_name: Name of the language model
+            endpoint: Base URL of the API server
+            messages: Full chat messages sent to the model
+            params: Sampling parameters sent with the request
+        Returns:
+            Hex digest identifying the request
+        """
+        payload = json.dumps(
+            {"model": model_name, "endpoint": endpoint, "messages": messages, "params": params or {}},
+            sort_keys=True, ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Look up a cached response.
+
+        Args:
+            key: Key from :meth:`make_key`
+        Returns:
+            Cached raw response text, or None on a miss
+        Raises:
+            CacheMissError: On a miss in replay mode
+        """
+        if self.mode == "write":
+            return None
+        conn = self._conn()
+        row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            if self.mode == "replay":
+                raise CacheMissError(f"No cached response for request {key}")
+            return None
+        conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, response: str, model_name: str = None):
+        """Store a raw response; a no-op in replay mode."""
+        if self.mode == "replay":
+            return
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO responses (key, model, response, size, created, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model_name, response, len(response.encode("utf-8")), now, now),
+        )
+        with self._lock:
+            self.writes += 1
+            should_evict = self.max_bytes is not None and self.writes % self.evict_every == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in ``max_bytes``."""
+        if self.max_bytes is None:
+            return 0
+        conn = self._conn()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        # 多清理10%，避免每次写入都触发淘汰
+        to_free = total - int(self.max_bytes * 0.9)
+        keys = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            keys.append((key,))
+            to_free -= size
+            if to_free <= 0:
+                break
+        conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        return len(keys)
+
+    def stats(self) -> dict:
+        entries, total = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "entries": entries,
+            "bytes": total,
+        }
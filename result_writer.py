@@ -0,0 +1,265 @@
+import json
+import os
+import time
+from collections import defaultdict
+
+
+class ResultWriter:
+    """
+    Append-only, crash-safe writer for ``results/{model_name}_results.jsonl``.
+
+    Each finished item is appended and flushed immediately, together with an
+    ``.idx`` sidecar recording ``(original_index, offset, length)`` so the file
+    can later be put back into index order without parsing it. Finished
+    prompt variants of unfinished items go to a ``.partial`` sidecar, so a
+    resumed run only repeats the variants that were actually lost. Variants
+    missing from an existing row (e.g. a newly configured prompt variant) can
+    be added later: the row is appended again with the new judgments and the
+    old line is dropped when the file is compacted.
+    """
+
+    def __init__(self, result_path: str, resume: bool = False):
+        self.result_path = result_path
+        self.index_path = result_path + ".idx"
+        self.partial_path = result_path + ".partial"
+        self.failures_path = result_path + ".failures"
+        # 已完成的条目（按_original_index）和未完成条目中已完成的变体
+        self.completed = set()
+        self.partial = defaultdict(dict)
+        self.written = 0
+        # 结果文件中每个条目所在的行：原始索引 -> (偏移, 长度, 行中的字段名)
+        self.rows = {}
+        self._key_sets = {}
+        # 补充了变体而重写的条目数
+        self.replaced = 0
+        self._reader = None
+        # 正在运行的条目：原始数据、全部变体字段名和尚未结束的变体
+        self._open = {}
+        self.failed = set()
+        # 失败的变体：(原始索引, 字段名) -> 失败记录
+        self.failures = {}
+        if resume and os.path.exists(result_path):
+            self._scan()
+        else:
+            for path in (result_path, self.index_path, self.partial_path, self.failures_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self._result_file = open(result_path, "ab")
+        self._index_file = open(self.index_path, "a")
+        self._partial_file = open(self.partial_path, "a")
+        self._failures_file = open(self.failures_path, "a")
+
+    def _scan(self):
+        """Rebuild the index from an existing result file, dropping a torn last line."""
+        entries = []
+        offset = 0
+        with open(self.result_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    row = json.loads(line)
+                    original_index = row["_original_index"]
+                except (ValueError, KeyError):
+                    break
+                entries.append((original_index, offset, len(line)))
+                self.completed.add(original_index)
+                self.rows[original_index] = (offset, len(line), self._intern_keys(row))
+                offset += len(line)
+        # 截断崩溃时写了一半的最后一行
+        with open(self.result_path, "r+b") as f:
+            f.truncate(offset)
+        with open(self.index_path, "w") as f:
+            for entry in entries:
+                f.write("%d\t%d\t%d\n" % entry)
+        for record in self._read_sidecar(self.partial_path):
+            if record["key"] not in self.row_keys(record["_original_index"]):
+                self.partial[record["_original_index"]][record["key"]] = record["judgment"]
+        if os.path.exists(self.failures_path):
+            for record in self._read_sidecar(self.failures_path):
+                self.failures[(record["_original_index"], record["key"])] = record
+            # 之后已经完成的变体不再算作失败
+            for original_index, key in list(self.failures):
+                if key in self.row_keys(original_index) or key in self.partial.get(original_index, {}):
+                    del self.failures[(original_index, key)]
+
+    @staticmethod
+    def _read_sidecar(path: str):
+        """
+        Records of a ``.partial`` or ``.failures`` sidecar, up to the first torn or invalid line.
+
+        The file is truncated after the last good record, so records appended
+        later do not end up on the torn line and get lost on the next resume.
+        """
+        if not os.path.exists(path):
+            return
+        offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                    record["_original_index"], record["key"]
+                except (ValueError, KeyError, TypeError):
+                    break
+                yield record
+                offset += len(line)
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+
+    def _intern_keys(self, row: dict) -> frozenset:
+        # 各行的字段名组合很少，共享同一个集合以节省内存
+        keys = frozenset(row)
+        return self._key_sets.setdefault(keys, keys)
+
+    def row_keys(self, original_index: int) -> frozenset:
+        """Field names of an item's row in the result file (empty if it has none)."""
+        row = self.rows.get(original_index)
+        return row[2] if row is not None else frozenset()
+
+    def missing_keys(self, original_index: int, keys) -> list:
+        """Keys of ``keys`` that the item's row in the result file does not have yet."""
+        present = self.row_keys(original_index)
+        return [key for key in keys if key not in present]
+
+    def completed_variants(self, original_index: int) -> dict:
+        """Judgments already finished for an item, keyed by result field name."""
+        return dict(self.partial.get(original_index, {}))
+
+    def write_variant(self, original_index: int, key: str, judgment: dict):
+        """Persist one finished prompt variant of an item that is still running."""
+        self._partial_file.write(json.dumps({"_original_index": original_index, "key": key, "judgment": judgment}) + "\n")
+        self._partial_file.flush()
+
+    def open_item(self, original_index: int, item: dict, keys: list) -> list:
+        """
+        Start tracking an item whose variants will be reported one by one.
+
+        Args:
+            original_index: Position of the item in the dataset
+            item: Dataset row
+            keys: Result field names of the prompt variants missing from the result file, in output order
+        Returns:
+            Keys that still have to be run; if none, the item is written immediately
+        """
+        finished = self.partial.get(original_index, {})
+        missing = [key for key in keys if key not in finished]
+        self._open[original_index] = {"item": item, "keys": keys, "remaining": set(missing), "failed": False}
+        if not missing:
+            self._close_item(original_index)
+        return missing
+
+    def add_variant(self, original_index: int, key: str, judgment: dict):
+        """Record a finished variant; the item is written once all of its variants are done."""
+        self.write_variant(original_index, key, judgment)
+        self.partial[original_index][key] = judgment
+        self.failures.pop((original_index, key), None)
+        state = self._open[original_index]
+        state["remaining"].discard(key)
+        if not state["remaining"]:
+            self._close_item(original_index)
+
+    def fail_variant(self, original_index: int, key: str, failure: dict = None) -> bool:
+        """
+        Record a failed variant; the item is dropped from this run once all of its variants ended.
+
+        Finished variants stay in the ``.partial`` sidecar so ``--resume`` only repeats the failed ones.
+
+        Args:
+            original_index: Position of the item in the dataset
+            key: Result field name of the variant
+            failure: Details stored in the ``.failures`` sidecar, e.g. stage, error class and message
+        Returns:
+            True if this was the first failure of the item
+        """
+        record = {"_original_index": original_index, "key": key, **(failure or {}), "time": time.time()}
+        self.failures[(original_index, key)] = record
+        self._failures_file.write(json.dumps(record) + "\n")
+        self._failures_file.flush()
+        state = self._open[original_index]
+        first = not state["failed"]
+        state["failed"] = True
+        state["remaining"].discard(key)
+        if not state["remaining"]:
+            self._close_item(original_index)
+        return first
+
+    def _close_item(self, original_index: int):
+        state = self._open.pop(original_index)
+        if state["failed"]:
+            self.partial.pop(original_index, None)
+            self.failed.add(original_index)
+            return
+        finished = self.partial[original_index]
+        if original_index in self.rows:
+            # 已有结果行时在其上补充新变体，整理时新行替换旧行
+            result = self._read_row(original_index)
+            self.replaced += 1
+        else:
+            # 创建结果副本，包含原始索引用于排序
+            result = state["item"].copy()
+            result["_original_index"] = original_index
+        for key in state["keys"]:
+            result[key] = finished[key]
+        self.write(result)
+
+    def _read_row(self, original_index: int) -> dict:
+        offset, length, _ = self.rows[original_index]
+        if self._reader is None:
+            self._reader = open(self.result_path, "rb")
+        self._reader.seek(offset)
+        return json.loads(self._reader.read(length))
+
+    def write(self, result: dict):
+        """Append one finished item and flush it to disk."""
+        line = (json.dumps(result) + "\n").encode("utf-8")
+        offset = self._result_file.tell()
+        self._result_file.write(line)
+        self._result_file.flush()
+        self._index_file.write("%d\t%d\t%d\n" % (result["_original_index"], offset, len(line)))
+        self._index_file.flush()
+        self.completed.add(result["_original_index"])
+        self.rows[result["_original_index"]] = (offset, len(line), self._intern_keys(result))
+        self.partial.pop(result["_original_index"], None)
+        self.written += 1
+
+    def close(self):
+        for f in (self._result_file, self._index_file, self._partial_file, self._failures_file):
+            f.close()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def compact(self):
+        """
+        Rewrite the result file in ``_original_index`` order and drop the sidecars.
+
+        Only the index entries are held in memory; lines are copied by offset.
+        When an item was written more than once, its last line is kept.
+        """
+        self.close()
+        entries = {}
+        with open(self.index_path, "r") as f:
+            for line in f:
+                original_index, offset, length = map(int, line.split("\t"))
+                entries[original_index] = (offset, length)
+        tmp_path = self.result_path + ".tmp"
+        with open(self.result_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for original_index in sorted(entries):
+                offset, length = entries[original_index]
+                src.seek(offset)
+                dst.write(src.read(length))
+        os.replace(tmp_path, self.result_path)
+        os.remove(self.index_path)
+        # 失败条目已完成的变体还要留给--resume使用
+        if not self.partial and not self.failed:
+            os.remove(self.partial_path)
+        # 失败记录去重后重写，每个仍未完成的变体只保留最近一次失败
+        if self.failures:
+            with open(self.failures_path + ".tmp", "w") as f:
+                for original_index, key in sorted(self.failures):
+                    f.write(json.dumps(self.failures[(original_index, key)]) + "\n")
+            os.replace(self.failures_path + ".tmp", self.failures_path)
+        else:
+            os.remove(self.failures_path)
@@ -0,0 +1,6 @@
+from sweep import main
+
+# 同时评测多个模型：数据集只加载一次、提示词只渲染一次，每个模型使用自己的服务地址和并发预算
+# 使用方法: python run_sweep.py --models gemma3-27b=http://host1:8000/v1 qwen3-32b=http://host2:8000/v1 [--tasks toxic_comment] [--sweep_config models.json]
+if __name__ == "__main__":
+    main()
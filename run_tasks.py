@@ -0,0 +1,6 @@
+from runner import main
+
+# 在同一进程中并发运行选中的任务，所有任务共享一个调度器和连接池
+# 使用方法: python run_tasks.py --model_name your-model-name [--tasks toxic_comment spam_detect pos_neg_review]
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,663 @@
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import time
+import zlib
+from collections import Counter, defaultdict
+
+from rich import print
+from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
+
+from adaptive import SequentialSampler, stratified_order
+from batch_io import make_custom_id, batch_request, read_batch_output
+from compact_results import compact_path, convert_to_compact, convert_to_jsonl
+from dataset import load_dataset, parse_indices
+from endpoint_pool import EndpointPool
+from engine import AsyncEngine, AIMDController, RequestFailed, RetryPolicy, classify_error, run_items, service_time
+from metrics import MetricsCollector
+from rate_limit import RateLimiter
+from result_writer import ResultWriter
+from scheduler import LongestFirstScheduler, PrefixScheduler, expected_output_tokens, simulate_makespan, update_cost_history
+from sharding import parse_shard, shard_of, shard_result_path
+from task_registry import TASKS, get_task, injection_type
+from utils import base_url, configure_cache, generation_params, guided_decoding_params, postprocess_response
+from verdict import build_extractor
+
+
+def add_arguments(parser: argparse.ArgumentParser, with_tasks: bool = True):
+    """Register the command line options shared by all task entry points."""
+    if with_tasks:
+        parser.add_argument("--tasks", type=str, nargs="+", default=list(TASKS), choices=list(TASKS), help="Tasks to run in the same process")
+    parser.add_argument("--model_name", type=str, default="gemma3-27b", help="Name of the language model to use")
+    parser.add_argument("--dataset_path", type=str, default=None, help="Run this JSONL dataset instead of the task's own, e.g. one written by generate_injections.py (single task only)")
+    parser.add_argument("--endpoints", type=str, nargs="+", default=None, help="Base URLs of replicas serving the model, defaults to the local vLLM server")
+    parser.add_argument("--sticky_prefix_chars", type=int, default=0, help="Route prompts sharing this many leading characters to the same replica (0 disables)")
+    parser.add_argument("--health_check_interval", type=float, default=5.0, help="Seconds between health checks of ejected replicas")
+    parser.add_argument("--initial_concurrency", type=int, default=32, help="Initial number of in-flight requests")
+    parser.add_argument("--max_concurrency", type=int, default=512, help="Upper bound on in-flight requests")
+    parser.add_argument("--latency_threshold", type=float, default=None, help="Treat responses slower than this many seconds as saturation")
+    parser.add_argument("--cache_path", type=str, default="./cache/responses.sqlite", help="SQLite file caching model responses")
+    parser.add_argument("--cache_mode", type=str, default="readwrite", choices=["readwrite", "replay", "write", "off"], help="replay fails on cache misses, write refreshes the cache")
+    parser.add_argument("--cache_max_mb", type=float, default=None, help="Evict least recently used cache entries beyond this size")
+    parser.add_argument("--resume", action="store_true", help="Keep the result files and only run the (item, prompt variant) cells missing from them")
+    parser.add_argument("--no_compact", action="store_true", help="Leave results in completion order instead of rewriting them in index order")
+    parser.add_argument("--results_format", type=str, default="jsonl", choices=["jsonl", "compact"], help="compact stores finished result files in the columnar format of compact_results.py")
+    parser.add_argument("--verdict", type=str, default="auto", choices=["auto", "llm"], help="auto extracts labels locally and only calls the LLM judge when ambiguous")
+    parser.add_argument("--verdict_min_confidence", type=float, default=0.8, help="Minimum confidence for accepting a locally extracted label")
+    parser.add_argument("--verdict_audit_rate", type=float, default=0.02, help="Share of local verdicts also sent to the LLM judge, whose label is kept; the agreement rate is reported")
+    parser.add_argument("--pipeline", type=str, default="judge", choices=["judge", "structured"], help="judge: analysis + judge calls; structured: one guided-decoding call returning analysis and label")
+    parser.add_argument("--guided", type=str, default="response_format", choices=["response_format", "guided_json"], help="How the JSON schema is sent in structured mode")
+    parser.add_argument("--schedule", type=str, default="prefix", choices=["prefix", "fifo", "longest"], help="prefix groups requests sharing a prompt prefix for vLLM prefix caching, longest dispatches the longest expected units first")
+    parser.add_argument("--cost_history", type=str, default=None, help="Completion lengths per task and variant that refine the longest-first estimates, updated after every run; defaults to ./metrics/{model_name}_costs.json")
+    parser.add_argument("--hedge_percentile", type=float, default=0.0, help="At the end of a run, duplicate requests running longer than this latency percentile of their stage, e.g. 95 (0, the default, disables)")
+    parser.add_argument("--hedge_min_samples", type=int, default=20, help="Latencies a stage needs before its requests are hedged")
+    parser.add_argument("--adaptive", action="store_true", help="Sample items in stratified random order and stop each (variant, injection_type) cell once its confidence interval is narrow enough")
+    parser.add_argument("--target_ci_width", type=float, default=0.05, help="Full width of the Wilson interval at which an adaptive cell stops")
+    parser.add_argument("--ci_confidence", type=float, default=0.95, help="Confidence level of the adaptive stopping intervals")
+    parser.add_argument("--min_samples", type=int, default=30, help="Minimum finished units per cell before it may stop")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the adaptive sampling order")
+    parser.add_argument("--adaptive_window", type=int, default=128, help="Units in flight in adaptive mode; each cell may overshoot its target by about this many units")
+    parser.add_argument("--variants", type=str, nargs="+", default=None, help="Only run these prompt variants of tasks/{task}/task.json (plain is the template without defense)")
+    parser.add_argument("--injection_type", type=str, nargs="+", default=None, help="Only run rows with these injection types (none selects rows without injection)")
+    parser.add_argument("--indices", type=str, nargs="+", default=None, help="Only run rows with these dataset index values, e.g. 1 2 10-20")
+    parser.add_argument("--limit", type=int, default=None, help="Only run the first N selected rows of every task")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="Only run shard K of N (e.g. 2/4), merge the shard results with merge_shards.py")
+    parser.add_argument("--max_retries", type=int, default=6, help="Retries per request for transport errors, 5xx and 429 responses")
+    parser.add_argument("--parse_retries", type=int, default=2, help="Times an unparsable judge or structured output is resampled")
+    parser.add_argument("--backoff_base", type=float, default=0.5, help="Base delay in seconds of the jittered exponential backoff")
+    parser.add_argument("--backoff_max", type=float, default=30.0, help="Maximum backoff delay in seconds")
+    parser.add_argument("--max_requests_per_s", type=float, default=None, help="Global limit on requests sent per second")
+    parser.add_argument("--max_tokens_per_s", type=float, default=None, help="Global limit on prompt + completion tokens per second")
+    parser.add_argument("--no_coalesce", action="store_true", help="Send every request even when an identical one is already in flight")
+    parser.add_argument("--no_stream", action="store_true", help="Do not stream responses (time to first token is then not measured)")
+    parser.add_argument("--metrics_path", type=str, default=None, help="JSON run report with latency percentiles and token throughput, defaults to ./metrics/{model_name}_summary.json")
+    parser.add_argument("--prometheus_file", type=str, default=None, help="Rewrite this file with Prometheus text-format metrics during the run")
+    parser.add_argument("--prometheus_port", type=int, default=None, help="Serve Prometheus text-format metrics on this port during the run")
+    parser.add_argument("--prometheus_host", type=str, default="127.0.0.1", help="Address the Prometheus exporter binds to, 0.0.0.0 exposes it on all interfaces")
+    parser.add_argument("--emit_batch", type=str, default=None, help="Write the requests still needed as an OpenAI Batch API input file instead of calling the server")
+    parser.add_argument("--ingest_batch", type=str, nargs="+", default=None, help="Merge OpenAI Batch API output files (analysis and judge stages) into the results")
+
+
+def check_dataset_path(parser: argparse.ArgumentParser, args, task_names: list):
+    """Reject a ``--dataset_path`` that cannot be run: several tasks, or a gzip-compressed file."""
+    if args.dataset_path is None:
+        return
+    if len(task_names) != 1:
+        parser.error("--dataset_path replaces the dataset of a single task, select it with --tasks")
+    if args.dataset_path.endswith(".gz"):
+        parser.error("--dataset_path must be plain JSONL, decompress it first (e.g. gunzip -k)")
+
+
+def task_specs(task_names: list, args) -> list:
+    """Registered tasks, reading ``--dataset_path`` instead of their own dataset if it is given."""
+    specs = [get_task(name) for name in task_names]
+    if getattr(args, "dataset_path", None) is not None:
+        specs = [spec.with_dataset(args.dataset_path) for spec in specs]
+    return specs
+
+
+def judgment_key(name: str) -> str:
+    """Result field holding the judgment of a prompt variant."""
+    return f"ai_judgment_{name}" if name != "" else "ai_judgment"
+
+
+class TaskRunner:
+    """
+    Runs one task for one model: expands items into (item, variant) units,
+    turns model responses into judgments and streams them into the result file.
+    """
+
+    def __init__(self, spec, args, engine: AsyncEngine, dataset=None):
+        """
+        Args:
+            spec: TaskSpec of the task
+            args: Parsed command line options from :func:`add_arguments`
+            engine: Engine sending the requests of this model
+            dataset: Already opened dataset of the task, shared between models in a sweep
+        """
+        self.spec = spec
+        self.args = args
+        self.variants = spec.select_variants(args.variants)
+        self.engine = engine
+        self.model_name = args.model_name
+        self.result_path = spec.result_path(self.model_name)
+        if args.shard is not None:
+            self.result_path = shard_result_path(self.result_path, *args.shard)
+        os.makedirs(os.path.dirname(self.result_path), exist_ok=True)
+        if dataset is None:
+            dataset = load_dataset(spec.dataset_path)
+            print(f"{spec.name}: Loaded dataset size: {len(dataset)}")
+        self.dataset = dataset
+        # 过滤只用偏移索引中的元数据，只有选中的行才会被解析；不需要过滤时也不必解析整个数据集来建立元数据
+        index_values = self.dataset.column("index") if args.shard is not None or args.adaptive else None
+        self.indices = self.dataset.select(
+            injection_types=args.injection_type,
+            indices=parse_indices(args.indices) if args.indices else None,
+            where=(lambda position: self.in_shard({"index": index_values[position]})) if args.shard is not None else None,
+            limit=args.limit,
+        )
+        if args.shard is not None:
+            print(f"{spec.name}: Shard {args.shard[0]}/{args.shard[1]}: {len(self.indices)} {spec.noun}s")
+        elif len(self.indices) < len(self.dataset):
+            print(f"{spec.name}: Selected {len(self.indices)} {spec.noun}s")
+        self.verdict_extractor = build_extractor(spec.name, min_confidence=args.verdict_min_confidence)
+        # 分片结果不会转换为紧凑格式，只有未分片的结果需要检查
+        if args.resume and args.shard is None and not os.path.exists(self.result_path) and os.path.exists(compact_path(self.result_path)):
+            # 续跑时先把紧凑格式的结果还原为JSONL
+            convert_to_jsonl(compact_path(self.result_path), remove=True)
+        self.writer = ResultWriter(self.result_path, resume=args.resume)
+        self.variant_names = {judgment_key(name): name for name, _ in self.variants}
+        self.sampler = None
+        chunk_size = 2048
+        if args.adaptive:
+            self.sampler = SequentialSampler(args.target_ci_width, args.ci_confidence, args.min_samples)
+            self.indices = stratified_order(index_values, self.indices, args.seed)
+            self.observe_existing()
+            # 调度决策在分块时做出，小分块让停止条件尽快生效
+            chunk_size = 64
+        if args.schedule == "longest":
+            if not args.adaptive:
+                # 按数据行的字节长度粗略估计条目大小，最长的先运行
+                lengths = self.dataset.column("length")
+                self.indices.sort(key=lambda position: -lengths[position])
+            self.scheduler = LongestFirstScheduler(self.variants, spec.render, chunk_size=chunk_size,
+                                                   expected_output=expected_output_tokens(cost_history_path(args), spec.name))
+        else:
+            self.scheduler = PrefixScheduler(self.variants, spec.render, chunk_size=chunk_size, order=args.schedule == "prefix")
+
+    def observe(self, item: dict, name: str, judgment: dict):
+        """把一个完成的变体计入自适应采样的统计"""
+        if self.sampler is None:
+            return
+        prediction = self.spec.normalize_prediction(judgment)
+        if prediction is not None:
+            self.sampler.update((name, injection_type(item)), prediction != self.spec.normalize_label(item.get("label")))
+
+    def observe_existing(self):
+        """断点续跑时先统计结果文件和.partial中已有的判定"""
+        if self.writer.completed:
+            with open(self.result_path, "rb") as f:
+                offset = 0
+                for line in f:
+                    row = json.loads(line)
+                    # 补充过变体的条目可能有多行，只统计最新的一行
+                    if self.writer.rows[row["_original_index"]][0] == offset:
+                        for key, name in self.variant_names.items():
+                            if key in row:
+                                self.observe(row, name, row[key])
+                    offset += len(line)
+        for index, judgments in self.writer.partial.items():
+            for key, judgment in judgments.items():
+                if key in self.variant_names:
+                    self.observe(self.dataset[index], self.variant_names[key], judgment)
+
+    def in_shard(self, item: dict) -> bool:
+        if self.args.shard is None:
+            return True
+        shard, num_shards = self.args.shard
+        return shard_of(item, num_shards) == shard
+
+    def total_units(self) -> int:
+        return len(self.indices) * len(self.variants)
+
+    def finished_units(self) -> int:
+        """已在结果文件或.partial中的(数据, 变体)数"""
+        finished = 0
+        for index in self.indices:
+            missing = self.writer.missing_keys(index, self.variant_names)
+            finished += len(self.variant_names) - len(missing)
+            partial = self.writer.partial.get(index)
+            if partial:
+                finished += sum(key in partial for key in missing)
+        return finished
+
+    def parse_structured(self, response: str):
+        """解析结构化输出模式返回的JSON"""
+        judgment = json.loads(response)
+        if not isinstance(judgment, dict):
+            raise ValueError(f"Expected a JSON object, got {type(judgment).__name__}")
+        analysis = judgment.pop("analysis")
+        judgment["verdict_source"] = "structured"
+        return judgment, analysis
+
+    def local_verdict(self, analysis: str):
+        """在本地提取结论，结论不明确时返回None；采用本地结论时由调用方计数"""
+        if self.args.verdict != "auto":
+            return None
+        judgment, confidence = self.verdict_extractor.extract(analysis)
+        if judgment is None:
+            return None
+        judgment["verdict_source"] = "local"
+        judgment["verdict_confidence"] = round(confidence, 4)
+        return judgment
+
+    def parse_judgment(self, judgment: str) -> dict:
+        """解析LLM判定调用返回的JSON"""
+        judgment = "\n".join(line for line in judgment.splitlines() if not line.strip().startswith("```"))
+        judgment = json.loads(judgment)
+        if not isinstance(judgment, dict):
+            # 合法但不是对象的JSON（如单独的字符串）也按解析失败重新采样
+            raise ValueError(f"Expected a JSON object, got {type(judgment).__name__}")
+        self.verdict_extractor.record("llm")
+        judgment["verdict_source"] = "llm"
+        return judgment
+
+    async def ask_and_parse(self, question: str, parse, tags: dict, **kwargs):
+        """请求并解析回复，解析失败时跳过缓存重新采样，最多重试--parse_retries次"""
+        retries = 0
+        while True:
+            response = await self.engine.ask_question(question, model_name=self.model_name, tags=tags, refresh=retries > 0, **kwargs)
+            try:
+                return parse(response)
+            except (ValueError, KeyError, AttributeError) as e:
+                if not self.engine.retry.should_retry("parse", retries):
+                    raise RequestFailed("parse", retries + 1, tags.get("stage"), e) from e
+                retries += 1
+
+    async def judge_by_prompt(self, prompt: str, tags: dict = None):
+        """对一条已渲染的提示词执行分析与判定两个阶段，tags用于按任务、变体、阶段统计请求"""
+        tags = tags or {}
+        if self.args.pipeline == "structured":
+            return await self.ask_and_parse(prompt + self.spec.structured_suffix, self.parse_structured, dict(tags, stage="structured"),
+                                            json_schema=self.spec.structured_schema, generation=self.spec.generation.get("structured"))
+
+        analysis = await self.engine.ask_question(prompt, model_name=self.model_name, tags=dict(tags, stage="analysis"),
+                                                  generation=self.spec.generation.get("analysis"))
+
+        # 先在本地提取结论，只有结论不明确时才调用LLM判定
+        local = self.local_verdict(analysis)
+        if local is not None and not self.audited(prompt, analysis):
+            self.verdict_extractor.record("local")
+            return local, analysis
+
+        judge_prompt = self.spec.render_judge(analysis)
+
+        judgment = await self.ask_and_parse(judge_prompt, self.parse_judgment, dict(tags, stage="judge"), json_format=True,
+                                            generation=self.spec.generation.get("judge"))
+        if local is not None:
+            # 抽查：本地结论与LLM判定对比，结果以LLM判定为准
+            self.verdict_extractor.record_audit(self.spec.normalize_prediction(local) == self.spec.normalize_prediction(judgment))
+
+        return judgment, analysis
+
+    def audited(self, prompt: str, analysis: str) -> bool:
+        """按提示词和分析文本的哈希抽取--verdict_audit_rate比例的本地结论，重跑时抽中的条目不变"""
+        return zlib.crc32((prompt + analysis).encode("utf-8")) < self.args.verdict_audit_rate * 2 ** 32
+
+    def missing_keys(self, index: int) -> list:
+        """结果文件中还没有的变体"""
+        return self.writer.missing_keys(index, self.variant_names)
+
+    def start_item(self, index: int, item: dict, keys: list) -> list:
+        """开始跟踪一条已解析的数据，返回现在要执行的变体名"""
+        if self.sampler is not None:
+            # 自适应模式下跳过置信区间已经足够窄的(变体, 注入类型)
+            keys = [key for key in keys if self.sampler.admit((self.variant_names[key], injection_type(item)))]
+            if not keys:
+                return []
+        return [self.variant_names[key] for key in self.writer.open_item(index, item, keys)]
+
+    def iter_units(self):
+        """展开为(数据, 提示词变体)粒度的任务，只执行结果文件中还没有的变体"""
+        for index in self.indices:
+            keys = self.missing_keys(index)
+            if not keys:
+                continue
+            item = self.dataset[index]
+            for name in self.start_item(index, item, keys):
+                yield index, item, name
+
+    def schedule(self):
+        """按前缀排序后的任务流，每个任务带上所属的TaskRunner"""
+        for unit in self.scheduler.schedule(self.iter_units()):
+            yield (self,) + unit
+
+    async def process_unit(self, unit):
+        """处理单条数据的一种提示词变体"""
+        _, index, item, name, prompt = unit
+        try:
+            tags = {"task": self.spec.name, "variant": name, "injection_type": injection_type(item)}
+            judgment, analysis = await self.judge_by_prompt(prompt, tags)
+            judgment["analysis"] = analysis
+            return unit, judgment, None
+        except Exception as e:
+            return unit, None, e
+
+    def fail_unit(self, index: int, name: str, error: Exception, stage: str = None):
+        """记录失败的变体：打印错误，并把阶段和错误类别写入失败记录供之后--resume重试"""
+        print(f"Error processing {self.spec.noun} {index+1} of {self.spec.name} (variant {name or 'plain'}): {error}")
+        self.writer.fail_variant(index, judgment_key(name), {
+            "task": self.spec.name,
+            "variant": name,
+            "stage": getattr(error, "stage", None) or stage,
+            "error_class": classify_error(error),
+            "attempts": getattr(error, "attempts", 1),
+            "error": str(error),
+        })
+
+    def on_unit_done(self, result):
+        """每完成一个变体立即记录，数据的全部变体完成后写入结果文件"""
+        (_, index, item, name, _), judgment, error = result
+        if error is None:
+            self.writer.add_variant(index, judgment_key(name), judgment)
+            self.observe(item, name, judgment)
+        else:
+            self.fail_unit(index, name, error)
+
+    def ingest_batch(self, outputs: dict, emit):
+        """导入Batch输出，仍需执行的请求（未执行、失败或判定阶段）通过emit重新导出"""
+        spec = self.spec
+        structured = self.args.pipeline == "structured"
+        stage = "structured" if structured else "analysis"
+        for _, index, item, name, prompt in self.schedule():
+            content, _ = outputs.get(make_custom_id(spec.name, index, name, stage), (None, None))
+            # 尚未执行或执行失败的请求重新导出
+            if content is None:
+                if structured:
+                    emit(make_custom_id(spec.name, index, name, stage), prompt + spec.structured_suffix,
+                         generation_params(spec.generation.get(stage), guided_decoding_params(spec.structured_schema, self.args.guided)))
+                else:
+                    emit(make_custom_id(spec.name, index, name, stage), prompt, generation_params(spec.generation.get(stage)))
+                continue
+            try:
+                if structured:
+                    judgment, analysis = self.parse_structured(content)
+                else:
+                    analysis = postprocess_response(content)
+                    judgment = self.local_verdict(analysis)
+                    if judgment is not None:
+                        self.verdict_extractor.record("local")
+                    else:
+                        content, _ = outputs.get(make_custom_id(spec.name, index, name, "judge"), (None, None))
+                        if content is None:
+                            # 判定阶段作为第二个Batch导出
+                            emit(make_custom_id(spec.name, index, name, "judge"), spec.render_judge(analysis),
+                                 generation_params(spec.generation.get("judge")))
+                            continue
+                        judgment = self.parse_judgment(postprocess_response(content, json_format=True))
+                judgment["analysis"] = analysis
+                self.writer.add_variant(index, judgment_key(name), judgment)
+            except Exception as e:
+                self.fail_unit(index, name, e, stage="structured" if structured else "judge")
+
+    def report(self):
+        print(f"{self.spec.name}: Wrote {self.writer.written} {self.spec.noun}s to {self.result_path}")
+        print(f"{self.spec.name}: Estimated shared-prefix ratio: {self.scheduler.shared_prefix_ratio():.3f}")
+        if self.args.pipeline == "judge":
+            print(f"{self.spec.name}: Verdicts: {self.verdict_extractor.report()}")
+        if self.sampler is not None:
+            skipped = sum(self.sampler.skipped.values())
+            print(f"{self.spec.name}: Adaptive sampling skipped {skipped} of {self.total_units()} units, "
+                  f"error rate (ASR for injected rows) per variant/injection_type: {self.sampler.report()}")
+        if self.writer.failed:
+            error_classes = Counter(failure["error_class"] for failure in self.writer.failures.values())
+            print(f"{self.spec.name}: {len(self.writer.failed)} {self.spec.noun}s failed ({dict(error_classes)}), "
+                  f"see {self.writer.failures_path} and rerun with --resume to retry them")
+
+    def finish(self):
+        if self.args.no_compact and not self.writer.replaced:
+            self.writer.close()
+        else:
+            # 按原始索引排序结果；补充了变体的条目只保留新行
+            self.writer.compact()
+        if self.args.results_format != "compact" or self.args.shard is not None or self.args.no_compact:
+            return
+        # 仍有失败或未完成的条目时保留JSONL和旁路文件供--resume使用；分片结果合并后再转换
+        if self.writer.failed or self.writer.partial or self.writer.failures:
+            print(f"{self.spec.name}: Keeping {self.result_path} until all items are finished")
+        else:
+            summary = convert_to_compact(self.result_path, remove=True)
+            print(f"{self.spec.name}: Stored {summary['rows']} rows in {compact_path(self.result_path)} "
+                  f"({summary['compact_bytes']} bytes, shared item table {summary['item_table_bytes']} bytes, JSONL was {summary['jsonl_bytes']} bytes)")
+
+
+def interleave(streams: list):
+    """Round-robin over several unit streams until all of them are exhausted."""
+    iterators = [iter(stream) for stream in streams]
+    while iterators:
+        for iterator in list(iterators):
+            unit = next(iterator, None)
+            if unit is None:
+                iterators.remove(iterator)
+            else:
+                yield unit
+
+
+def recording_service_time(dispatched: list):
+    """
+    Wrap ``TaskRunner.process_unit`` to record the server time spent on every unit.
+
+    Args:
+        dispatched: Receives ``[runner, index, variant name, service seconds]`` per unit, in dispatch order
+    Returns:
+        Coroutine function processing one ``(runner, index, item, name, prompt)`` unit
+    """
+    async def process_unit(unit):
+        spent = [0.0]
+        service_time.set(spent)
+        record = [unit[0], unit[1], unit[3], 0.0]
+        dispatched.append(record)
+        result = await unit[0].process_unit(unit)
+        record[3] = spent[0]
+        return result
+
+    return process_unit
+
+
+def report_makespan(runners: list, engine: AsyncEngine, dispatched: list, elapsed: float, schedule: str, prefix: str = ""):
+    """打印并记录峰值并发、完工时间模拟和各副本的统计"""
+    print(f"{prefix}Peak in-flight requests: {engine.controller.peak_in_flight}")
+    if dispatched:
+        report = makespan_report(runners, dispatched, engine.controller.peak_in_flight, schedule)
+        report.update(wall_s=round(elapsed, 3), hedged_requests=engine.hedges["sent"], hedges_won=engine.hedges["won"])
+        engine.metrics.sections["makespan"] = report
+        print(f"{prefix}Makespan simulated on {report['slots']} slots from measured service times: {report['makespan_s']} s ({schedule}) "
+              f"vs {report['fifo_makespan_s']} s (fifo), improvement {report['improvement_over_fifo']}; wall time {report['wall_s']} s, "
+              f"hedged requests: {report['hedged_requests']} ({report['hedges_won']} won)")
+    if len(engine.pool.endpoints) > 1:
+        print(f"{prefix}Endpoints: {engine.pool.stats()}")
+
+
+def makespan_report(runners: list, dispatched: list, slots: int, schedule: str) -> dict:
+    """
+    Compare the dispatch order of a run with FIFO order on the measured service times.
+
+    Both orders are replayed with greedy list scheduling on ``slots`` slots,
+    so the comparison does not depend on server load during the run.
+
+    Args:
+        runners: TaskRunners of the run
+        dispatched: ``(runner, index, variant name, service seconds)`` per unit, in dispatch order
+        slots: Parallel slots, e.g. the peak number of in-flight requests
+        schedule: Name of the schedule used
+    Returns:
+        Dict with both simulated makespans and the relative improvement over FIFO
+    """
+    # FIFO：每个任务按数据集顺序和变体顺序，多个任务轮流取
+    variant_positions = {runner: {name: position for position, name in enumerate(runner.variant_names.values())} for runner in runners}
+    by_runner = defaultdict(list)
+    for runner, index, name, duration in dispatched:
+        by_runner[runner].append((index, variant_positions[runner][name], duration))
+    fifo = []
+    for position, runner in enumerate(runners):
+        for rank, (_, _, duration) in enumerate(sorted(by_runner[runner])):
+            fifo.append((rank, position, duration))
+    fifo.sort(key=lambda unit: unit[:2])
+    makespan = simulate_makespan([unit[3] for unit in dispatched], slots)
+    fifo_makespan = simulate_makespan([unit[2] for unit in fifo], slots)
+    return {
+        "schedule": schedule,
+        "units": len(dispatched),
+        "slots": slots,
+        "makespan_s": round(makespan, 3),
+        "fifo_makespan_s": round(fifo_makespan, 3),
+        "improvement_over_fifo": round(1 - makespan / fifo_makespan, 4) if fifo_makespan else None,
+    }
+
+
+async def run_online(runners: list, engine: AsyncEngine, args):
+    """所有任务的请求交错进入同一个调度窗口，共享一个连接池和并发控制器"""
+    with Progress(SpinnerColumn(), TextColumn("[progress.description]{task.description}"), BarColumn(), TextColumn("[progress.percentage]{task.percentage:>3.0f}%")) as progress:
+        bars = {runner: progress.add_task(f"[green]Processing {runner.spec.noun}s ({runner.spec.name})...", total=runner.total_units(), completed=runner.finished_units())
+                for runner in runners}
+
+        def on_done(result):
+            runner = result[0][0]
+            runner.on_unit_done(result)
+            progress.update(bars[runner], advance=1)
+
+        # 按派发顺序记录每个单元占用服务端的时间，用于与FIFO顺序比较完工时间
+        dispatched = []
+        process_unit = recording_service_time(dispatched)
+
+        def on_exhausted():
+            # 所有单元都已派发，只剩收尾的慢请求时开始对冲
+            engine.start_hedging()
+
+        async def check_health():
+            while True:
+                await asyncio.sleep(args.health_check_interval)
+                await engine.pool.check_health()
+
+        async def export_prometheus():
+            while True:
+                await asyncio.sleep(5)
+                engine.metrics.write_prometheus(args.prometheus_file)
+
+        background = [asyncio.create_task(check_health())]
+        if args.prometheus_file:
+            background.append(asyncio.create_task(export_prometheus()))
+        try:
+            # 自适应模式下只提前取出少量任务，停止条件才能及时生效
+            max_pending = min(args.adaptive_window, args.max_concurrency) if args.adaptive else args.max_concurrency
+            streams = [runner.schedule() for runner in runners]
+            if args.schedule == "longest":
+                # 各任务的单元流已大致按开销从大到小排列，合并成全局最长优先的顺序
+                units = heapq.merge(*streams, key=lambda unit: -unit[0].scheduler.cost(unit[3], unit[4]))
+            else:
+                units = interleave(streams)
+            started = time.monotonic()
+            await run_items(process_unit, units, on_done=on_done, max_pending=max_pending, on_exhausted=on_exhausted)
+            elapsed = time.monotonic() - started
+        finally:
+            for task in background:
+                task.cancel()
+            await engine.close()
+    if args.prometheus_file:
+        engine.metrics.write_prometheus(args.prometheus_file)
+    report_makespan(runners, engine, dispatched, elapsed, args.schedule)
+
+
+def run_batch_mode(runners: list, args):
+    """离线批处理模式：导入已有的Batch输出，并把仍需执行的请求导出为Batch输入文件"""
+    outputs = read_batch_output(args.ingest_batch) if args.ingest_batch else {}
+    emit_path = args.emit_batch or f"./batch/{args.model_name}_requests.jsonl"
+    if args.emit_batch is None and args.shard is not None:
+        emit_path = shard_result_path(emit_path, *args.shard)
+    if os.path.dirname(emit_path):
+        os.makedirs(os.path.dirname(emit_path), exist_ok=True)
+    emitted = 0
+    with open(emit_path, "w") as batch_file:
+        def emit(custom_id, question, params=None):
+            nonlocal emitted
+            batch_file.write(json.dumps(batch_request(custom_id, args.model_name, question, params)) + "\n")
+            emitted += 1
+
+        for runner in runners:
+            runner.ingest_batch(outputs, emit)
+    if emitted:
+        print(f"Wrote {emitted} batch requests to {emit_path}, ingest their output together with the previous files")
+    else:
+        os.remove(emit_path)
+
+
+def build_engine(args, response_cache=None) -> AsyncEngine:
+    """Engine of one model, configured from the parsed command line options."""
+    return AsyncEngine(
+        model_name=args.model_name,
+        cache=response_cache,
+        guided=args.guided,
+        pool=EndpointPool.from_urls(args.endpoints or [base_url], sticky_prefix_chars=args.sticky_prefix_chars),
+        metrics=MetricsCollector(),
+        retry=RetryPolicy(
+            max_retries={"transport": args.max_retries, "server": args.max_retries, "rate_limit": args.max_retries, "parse": args.parse_retries},
+            base_delay=args.backoff_base, max_delay=args.backoff_max,
+        ),
+        rate_limiter=RateLimiter(args.max_requests_per_s, args.max_tokens_per_s) if args.max_requests_per_s or args.max_tokens_per_s else None,
+        stream=not args.no_stream,
+        coalesce=not args.no_coalesce,
+        hedge_percentile=args.hedge_percentile,
+        hedge_min_samples=args.hedge_min_samples,
+        controller=AIMDController(initial=args.initial_concurrency, max_limit=args.max_concurrency, latency_threshold=args.latency_threshold),
+    )
+
+
+def cost_history_path(args) -> str:
+    return args.cost_history or f"./metrics/{args.model_name}_costs.json"
+
+
+def report_requests(engine: AsyncEngine, args, prefix: str = ""):
+    """写入运行报告，打印请求数、去重率、延迟和各阶段的生成token用量"""
+    summary = engine.metrics.summary()
+    overall = summary["overall"]
+    if overall["requests"] == 0:
+        # 没有发出任何请求（例如全部已完成的--resume），保留上一次运行的报告
+        print(f"{prefix}Requests: 0, run report not written")
+        return
+    metrics_path = args.metrics_path or f"./metrics/{args.model_name}_summary.json"
+    engine.metrics.write_summary(metrics_path)
+    update_cost_history(cost_history_path(args), summary)
+    print(f"{prefix}Requests: {overall['requests']} ({overall['cached']} cached, {overall['coalesced']} coalesced, {overall['errors']} failed), "
+          f"dedup ratio: {overall['dedup_ratio']}, "
+          f"latency: {overall['latency_s']}, completion tokens/s: {overall['completion_tokens_per_s']}, report: {metrics_path}")
+    # 各阶段、各提示词变体用掉的生成token，供设置task.json中的生成预算参考
+    for stage, by_variant in summary["token_usage"].items():
+        for name, usage in by_variant.items():
+            tokens = usage["completion_tokens"]
+            print(f"{prefix}Completion tokens ({stage}, {name or 'plain'}): p50 {tokens['p50']}, p95 {tokens['p95']}, max {tokens['max']}, "
+                  f"{usage['truncated']} of {usage['responses']} responses hit max_tokens")
+
+
+def run(task_names: list, args):
+    """
+    Run the given tasks for one model in a single process.
+
+    Args:
+        task_names: Names of registered tasks
+        args: Parsed command line options from :func:`add_arguments`
+    """
+    response_cache = configure_cache(None if args.cache_mode == "off" else args.cache_path, mode=args.cache_mode, max_mb=args.cache_max_mb)
+    engine = build_engine(args, response_cache)
+    runners = [TaskRunner(spec, args, engine) for spec in task_specs(task_names, args)]
+
+    if args.emit_batch or args.ingest_batch:
+        run_batch_mode(runners, args)
+    else:
+        server = engine.metrics.serve_prometheus(args.prometheus_port, host=args.prometheus_host) if args.prometheus_port else None
+        asyncio.run(run_online(runners, engine, args))
+        if server is not None:
+            server.shutdown()
+        if response_cache is not None:
+            print(f"Response cache: {response_cache.stats()}")
+        report_requests(engine, args)
+
+    for runner in runners:
+        runner.report()
+        runner.finish()
+
+
+def main(task_names: list = None):
+    """
+    Command line entry point.
+
+    Args:
+        task_names: Run these tasks; if None, they are selected with ``--tasks``
+    """
+    parser = argparse.ArgumentParser()
+    add_arguments(parser, with_tasks=task_names is None)
+    args = parser.parse_args()
+    task_names = task_names or args.tasks
+    check_dataset_path(parser, args, task_names)
+    run(task_names, args)
@@ -0,0 +1,260 @@
+import bisect
+import heapq
+import json
+import os
+from collections import defaultdict, deque
+
+CHARS_PER_TOKEN = 4
+
+# 预填充一个token相对于生成一个token的开销，用于估计单元的服务时间
+PREFILL_COST = 0.05
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """Length of the longest common prefix of two strings (binary search on C-level slice compares)."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class PrefixScheduler:
+    """
+    Order (item, variant) units so requests sharing a prompt prefix reach the server together.
+
+    Units are read in chunks of ``chunk_size`` and rendered; inside a chunk
+    they are sorted by the rendered prompt. Lexicographic order puts prompts
+    with the longest common prefixes next to each other: templates sharing
+    their instruction block come together, then within a template the clean
+    item and its injected copies (which all start with the same ``raw``) are
+    sent back to back, and templates that only differ after the data (such as
+    the sandwich suffix) follow each other for the same text. Chunking keeps
+    the number of half-finished items, and hence memory, bounded.
+
+    The scheduler also estimates the shared-prefix ratio of the prompts it
+    emits: the share of characters that are a prefix of one of the last
+    ``cache_window`` prompts, as a stand-in for what is still resident in the
+    server's KV cache. The longest shared prefix with any prompt in the window
+    is found by comparing only with its neighbours in a sorted copy.
+    """
+
+    def __init__(self, variants: list, render, chunk_size: int = 2048, order: bool = True, cache_window: int = 512):
+        """
+        Args:
+            variants: Ordered list of ``(name, template)`` pairs
+            render: Function ``(template, item) -> prompt``
+            chunk_size: Number of units sorted together
+            order: Whether to reorder units at all; False keeps the incoming (FIFO) order
+            cache_window: Number of recent prompts assumed to stay in the prefix cache
+        """
+        self.templates = dict(variants)
+        self.render = render
+        self.chunk_size = chunk_size
+        self.order = order
+        self.cache_window = cache_window
+        self.total_chars = 0
+        self.shared_chars = 0
+        self._recent = deque()
+        self._sorted_recent = []
+
+    def _account(self, prompt: str):
+        position = bisect.bisect_left(self._sorted_recent, prompt)
+        shared = 0
+        for neighbour in self._sorted_recent[max(0, position - 1):position + 1]:
+            shared = max(shared, common_prefix_length(prompt, neighbour))
+        self.total_chars += len(prompt)
+        self.shared_chars += shared
+        self._recent.append(prompt)
+        bisect.insort(self._sorted_recent, prompt)
+        if len(self._recent) > self.cache_window:
+            oldest = self._recent.popleft()
+            del self._sorted_recent[bisect.bisect_left(self._sorted_recent, oldest)]
+
+    def schedule(self, units):
+        """
+        Reorder a stream of ``(index, item, variant name)`` units.
+
+        Args:
+            units: Iterable of ``(index, item, variant name)`` tuples; any further fields are passed through
+        Returns:
+            Generator of ``(index, item, variant name, prompt)`` tuples, followed by the passed-through fields
+        """
+        chunk = []
+        for unit in units:
+            chunk.append(unit)
+            if len(chunk) >= self.chunk_size:
+                yield from self._emit(chunk)
+                chunk = []
+        yield from self._emit(chunk)
+
+    def _emit(self, chunk):
+        rendered = [(index, item, name, self.render(self.templates[name], item), *rest) for index, item, name, *rest in chunk]
+        if self.order:
+            rendered.sort(key=self.sort_key)
+        for unit in rendered:
+            self._account(unit[3])
+            yield unit
+
+    def sort_key(self, unit: tuple):
+        """Order of a rendered ``(index, item, variant name, prompt)`` unit inside its chunk."""
+        return unit[3], unit[0]
+
+    def shared_prefix_ratio(self) -> float:
+        return self.shared_chars / self.total_chars if self.total_chars else 0.0
+
+
+class LongestFirstScheduler(PrefixScheduler):
+    """
+    Dispatch the units expected to take longest first, to shorten the makespan.
+
+    With many units per slot, the run time is decided by the long units left
+    at the end; starting them first (longest processing time first) lets the
+    short ones fill the gaps. The cost of a unit is estimated from the length
+    of its prompt plus the mean completion length of its prompt variant
+    measured in an earlier run, when known. Units are sorted inside chunks,
+    so items should arrive roughly largest first (e.g. by dataset row length).
+    """
+
+    def __init__(self, variants: list, render, chunk_size: int = 2048, expected_output: dict = None, cache_window: int = 512):
+        """
+        Args:
+            variants: Ordered list of ``(name, template)`` pairs
+            render: Function ``(template, item) -> prompt``
+            chunk_size: Number of units sorted together
+            expected_output: Expected completion tokens per variant name, e.g. from :func:`expected_output_tokens`
+            cache_window: Number of recent prompts assumed to stay in the prefix cache
+        """
+        super().__init__(variants, render, chunk_size=chunk_size, order=True, cache_window=cache_window)
+        self.expected_output = expected_output or {}
+
+    def cost(self, name: str, prompt: str) -> float:
+        """Estimated service time of a unit, in generated-token equivalents."""
+        return len(prompt) / CHARS_PER_TOKEN * PREFILL_COST + self.expected_output.get(name, 0.0)
+
+    def sort_key(self, unit: tuple):
+        return -self.cost(unit[2], unit[3]), unit[0]
+
+
+def served_output_tokens(report: dict) -> dict:
+    """
+    Mean completion tokens per task and prompt variant served in a run report.
+
+    Only analysis (or structured) requests that reached a server count, so
+    cached, coalesced and failed requests do not dilute the means.
+
+    Args:
+        report: Run report from ``MetricsCollector.summary``
+    Returns:
+        ``{task: {variant: {"mean_completion_tokens": ..., "responses": ...}}}``
+    """
+    totals = defaultdict(lambda: [0.0, 0])
+    for group in report.get("groups", []):
+        if group.get("stage") not in ("analysis", "structured") or group.get("mean_completion_tokens") is None:
+            continue
+        served = group["requests"] - group.get("cached", 0) - group.get("coalesced", 0) - group.get("errors", 0)
+        totals[(group["task"], group["variant"])][0] += group["mean_completion_tokens"] * served
+        totals[(group["task"], group["variant"])][1] += served
+    by_task = defaultdict(dict)
+    for (task, variant), (tokens, served) in totals.items():
+        if served:
+            by_task[task][variant] = {"mean_completion_tokens": tokens / served, "responses": served}
+    return dict(by_task)
+
+
+def update_cost_history(history_path: str, report: dict) -> bool:
+    """
+    Merge the completion lengths served in a run into the cost history.
+
+    Only the (task, variant) pairs the run actually served are replaced, so
+    a resumed run that serves nothing, or only part of the tasks, keeps the
+    estimates of everything else.
+
+    Args:
+        history_path: Cost history JSON, created if missing
+        report: Run report from ``MetricsCollector.summary``
+    Returns:
+        Whether the history was written
+    """
+    served = served_output_tokens(report)
+    if not served:
+        return False
+    try:
+        with open(history_path, "r") as f:
+            history = json.load(f)
+    except (OSError, ValueError):
+        history = {}
+    if not isinstance(history, dict) or "groups" in history:
+        # 旧版本把运行报告当作成本历史，先转换成按任务、变体的格式
+        history = served_output_tokens(history) if isinstance(history, dict) else {}
+    for task, by_variant in served.items():
+        history.setdefault(task, {}).update(by_variant)
+    if os.path.dirname(history_path):
+        os.makedirs(os.path.dirname(history_path), exist_ok=True)
+    tmp_path = history_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp_path, history_path)
+    return True
+
+
+def expected_output_tokens(history_path: str, task_name: str) -> dict:
+    """
+    Mean completion tokens per prompt variant of a task in the cost history.
+
+    Args:
+        history_path: Cost history written by :func:`update_cost_history`, or
+            a run report written by ``MetricsCollector.write_summary``
+        task_name: Task whose analysis (or structured) requests are averaged
+    Returns:
+        Mapping from variant name to mean completion tokens, empty if the file is missing
+    """
+    try:
+        with open(history_path, "r") as f:
+            history = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(history, dict):
+        return {}
+    if "groups" in history:
+        history = served_output_tokens(history)
+    return {variant: entry["mean_completion_tokens"] for variant, entry in history.get(task_name, {}).items()}
+
+
+def combine_expected_output(estimates: list) -> dict:
+    """
+    Expected completion tokens per variant of units sent to several models.
+
+    A sweep renders and orders every unit once for all models. A unit keeps
+    the slowest model waiting longest, so the largest estimate of each
+    variant is used.
+
+    Args:
+        estimates: Mappings from variant name to expected completion tokens, one per model
+    Returns:
+        Mapping from variant name to the largest expected completion tokens
+    """
+    combined = {}
+    for estimate in estimates:
+        for name, tokens in estimate.items():
+            combined[name] = max(tokens, combined.get(name, 0.0))
+    return combined
+
+
+def simulate_makespan(durations: list, slots: int) -> float:
+    """
+    Makespan of running jobs in the given order on parallel slots (greedy list scheduling).
+
+    Args:
+        durations: Service time of every job, in dispatch order
+        slots: Number of jobs running at the same time
+    Returns:
+        Time at which the last job finishes
+    """
+    finish = [0.0] * max(1, min(slots, len(durations)))
+    for duration in durations:
+        heapq.heappush(finish, heapq.heappop(finish) + duration)
+    return max(finish)
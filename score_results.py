@@ -0,0 +1,27 @@
+import argparse
+
+from scoring import DEFAULT_BY, find_result_files, load_results, score
+from task_registry import TASKS
+
+# 计算各任务、模型、注入类型和提示词变体下的准确率、攻击成功率和翻转率
+# 使用方法: python score_results.py [--tasks toxic_comment] [--models gemma3-27b] [--by task model] [--output scores.csv]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", type=str, nargs="*", help="Result files to score, defaults to all tasks/*/results/*_results.jsonl")
+    parser.add_argument("--tasks", type=str, nargs="+", default=None, choices=list(TASKS), help="Only score these tasks")
+    parser.add_argument("--models", type=str, nargs="+", default=None, help="Only score these models")
+    parser.add_argument("--by", type=str, nargs="+", default=list(DEFAULT_BY), choices=list(DEFAULT_BY), help="Columns to group by")
+    parser.add_argument("--bootstrap", type=int, default=None, help="Bootstrap replicates for the confidence intervals, by default the exact bootstrap distribution is used; 0 skips them")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Coverage of the confidence intervals")
+    parser.add_argument("--output", type=str, default=None, help="Write the scores to this CSV file instead of printing them")
+    args = parser.parse_args()
+
+    frame = load_results(args.paths or find_result_files(args.tasks, args.models))
+    scores = score(frame, by=args.by, n_bootstrap=args.bootstrap, confidence=args.confidence)
+    if args.output:
+        scores.to_csv(args.output, index=False)
+        print(f"Wrote {len(scores)} groups to {args.output}")
+    else:
+        columns = args.by + ["rows", "unparsed", "accuracy", "accuracy_low", "accuracy_high", "asr", "asr_low", "asr_high",
+                             "flip_rate", "flip_rate_low", "flip_rate_high"]
+        print(scores[[column for column in columns if column in scores]].round(4).to_string(index=False))
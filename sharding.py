@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+
+
+def parse_shard(value: str):
+    """
+    Parse a ``K/N`` shard specification.
+
+    Args:
+        value: Shard number and shard count, e.g. "2/4" (K counts from 1)
+    Returns:
+        ``(K, N)`` tuple
+    """
+    try:
+        shard, num_shards = map(int, value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {value!r}, expected K/N such as 1/4")
+    if not 1 <= shard <= num_shards:
+        raise ValueError(f"Invalid shard {value!r}, K must be between 1 and N")
+    return shard, num_shards
+
+
+def shard_of(item: dict, num_shards: int) -> int:
+    """
+    Shard (counting from 1) an item belongs to.
+
+    The hash is taken over the dataset ``index`` field, which all injected
+    copies of the same ``raw`` text share, so they stay on one node and keep
+    hitting its prefix cache. md5 keeps the assignment stable across
+    processes and machines, unlike ``hash()``.
+    """
+    digest = hashlib.md5(str(item["index"]).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards + 1
+
+
+def shard_result_path(result_path: str, shard: int, num_shards: int) -> str:
+    """Result file of one shard, e.g. ``gemma3-27b_results.shard2of4.jsonl``."""
+    root, ext = os.path.splitext(result_path)
+    return f"{root}.shard{shard}of{num_shards}{ext}"
+
+
+def merge_shards(result_path: str, dataset_size: int, num_shards: int, allow_missing: bool = False) -> dict:
+    """
+    Merge the per-shard result files into the file a single-node run would produce.
+
+    Every row must sit in the shard its ``index`` hashes to and appear only
+    once. Rows are written in ``_original_index`` order; only their offsets are
+    held in memory.
+
+    Args:
+        result_path: Result file of the single-node run, the shard files are derived from it
+        dataset_size: Number of rows in the dataset
+        num_shards: Number of shards the run was split into
+        allow_missing: Write the merged file even if some rows are missing
+    Returns:
+        Summary with the number of rows per shard, merged rows and missing rows
+    """
+    entries = {}
+    rows_per_shard = {}
+    for shard in range(1, num_shards + 1):
+        path = shard_result_path(result_path, shard, num_shards)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Missing result file of shard {shard}/{num_shards}: {path}")
+        rows_per_shard[shard] = 0
+        offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    offset += len(line)
+                    continue
+                row = json.loads(line)
+                original_index = row["_original_index"]
+                if shard_of(row, num_shards) != shard:
+                    raise ValueError(f"Row {original_index} in {path} belongs to shard {shard_of(row, num_shards)}/{num_shards}")
+                if original_index in entries:
+                    raise ValueError(f"Duplicate row {original_index} in {path} and {entries[original_index][0]}")
+                entries[original_index] = (path, offset, len(line))
+                rows_per_shard[shard] += 1
+                offset += len(line)
+
+    missing = [index for index in range(dataset_size) if index not in entries]
+    if missing and not allow_missing:
+        raise ValueError(f"{len(missing)} rows are missing from the shard results (first: {missing[:10]}), "
+                         "rerun the shards with --resume or pass --allow_missing")
+
+    tmp_path = result_path + ".tmp"
+    files = {}
+    try:
+        with open(tmp_path, "wb") as dst:
+            for original_index in sorted(entries):
+                path, offset, length = entries[original_index]
+                if path not in files:
+                    files[path] = open(path, "rb")
+                files[path].seek(offset)
+                dst.write(files[path].read(length))
+    finally:
+        for f in files.values():
+            f.close()
+    os.replace(tmp_path, result_path)
+    return {"rows_per_shard": rows_per_shard, "merged": len(entries), "missing": len(missing)}
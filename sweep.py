@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import copy
+import heapq
+import json
+import time
+
+from rich import print
+from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
+
+from dataset import load_dataset
+from engine import run_queue
+from runner import TaskRunner, add_arguments, build_engine, check_dataset_path, interleave, recording_service_time, report_makespan, report_requests, task_specs
+from scheduler import combine_expected_output
+from utils import configure_cache
+
+# 可按模型单独设置的选项，其余选项（任务、变体、数据选择、调度方式等）所有模型相同
+MODEL_OPTIONS = ("endpoints", "initial_concurrency", "max_concurrency", "latency_threshold", "sticky_prefix_chars",
+                 "max_requests_per_s", "max_tokens_per_s", "hedge_percentile", "hedge_min_samples", "metrics_path",
+                 "cost_history")
+
+
+def parse_model(value: str) -> dict:
+    """Parse ``NAME=URL[,URL...]`` given on the command line."""
+    name, separator, urls = value.partition("=")
+    if not separator or not name or not urls:
+        raise argparse.ArgumentTypeError(f"Expected NAME=URL[,URL...], got {value!r}")
+    return {"model_name": name, "endpoints": urls.split(",")}
+
+
+def load_models(models: list = None, config_path: str = None) -> list:
+    """
+    Collect the models of a sweep.
+
+    Args:
+        models: Models from ``--models``, as returned by :func:`parse_model`
+        config_path: JSON file with a list of ``{"model_name": ..., "endpoints": [...], ...}``
+            objects; any option of ``MODEL_OPTIONS`` may be set per model
+    Returns:
+        List of model configurations, in the given order
+    """
+    models = list(models or [])
+    if config_path:
+        with open(config_path, "r") as f:
+            models.extend(json.load(f))
+    if not models:
+        raise ValueError("No models to sweep, use --models or --sweep_config")
+    names = set()
+    for model in models:
+        unknown = set(model) - set(MODEL_OPTIONS) - {"model_name"}
+        if "model_name" not in model or unknown:
+            raise ValueError(f"Invalid sweep model {model!r}, expected model_name and options among {', '.join(MODEL_OPTIONS)}")
+        if model["model_name"] in names:
+            raise ValueError(f"Model {model['model_name']} appears twice in the sweep")
+        names.add(model["model_name"])
+    return models
+
+
+def model_args(args, model: dict):
+    """Options of one model: the shared options with its own name, endpoints and concurrency budget."""
+    options = copy.copy(args)
+    options.metrics_path = None
+    options.cost_history = None
+    for name, value in model.items():
+        setattr(options, name, value)
+    return options
+
+
+def fan_out(runners: list):
+    """
+    Units of one task for all models, decoding every dataset row once.
+
+    Args:
+        runners: TaskRunners of the same task and selection, one per model
+    Returns:
+        Generator of ``(index, item, variant name, runners needing the unit)``
+    """
+    for index in runners[0].indices:
+        needed = [(runner, runner.missing_keys(index)) for runner in runners]
+        if not any(keys for _, keys in needed):
+            continue
+        item = runners[0].dataset[index]
+        owners = {}
+        for runner, keys in needed:
+            if keys:
+                for name in runner.start_item(index, item, keys):
+                    owners.setdefault(name, []).append(runner)
+        for name, owner_runners in owners.items():
+            yield index, item, name, owner_runners
+
+
+async def produce(streams: list, queues: dict, schedule: str):
+    """把渲染好的单元分发到需要它的各模型队列；队列有界，最慢的模型决定生产者能领先多少"""
+    if schedule == "longest":
+        units = heapq.merge(*streams, key=lambda unit: -unit[4][0].scheduler.cost(unit[2], unit[3]))
+    else:
+        units = interleave(streams)
+    for count, (index, item, name, prompt, owners) in enumerate(units, 1):
+        for runner in owners:
+            await queues[runner.model_name].put((runner, index, item, name, prompt))
+        if count % 64 == 0:
+            # 队列未满时put不会让出事件循环，定期让出以便各模型及时派发
+            await asyncio.sleep(0)
+    for queue in queues.values():
+        await queue.put(None)
+
+
+async def run_sweep_online(models: list, args):
+    """所有模型同时运行：一个生产者渲染提示词，每个模型按自己的并发预算消费自己的队列"""
+    with Progress(SpinnerColumn(), TextColumn("[progress.description]{task.description}"), BarColumn(), TextColumn("[progress.percentage]{task.percentage:>3.0f}%")) as progress:
+        bars = {runner: progress.add_task(f"[green]{runner.model_name}: {runner.spec.name}...", total=runner.total_units(), completed=runner.finished_units())
+                for model in models for runner in model["runners"]}
+
+        def on_done(result):
+            runner = result[0][0]
+            runner.on_unit_done(result)
+            progress.update(bars[runner], advance=1)
+
+        async def consume(model):
+            engine, options = model["engine"], model["args"]
+            max_pending = min(options.adaptive_window, options.max_concurrency) if options.adaptive else options.max_concurrency
+            started = time.monotonic()
+            await run_queue(recording_service_time(model["dispatched"]), model["queue"], on_done=on_done, max_pending=max_pending,
+                            on_exhausted=engine.start_hedging)
+            model["elapsed"] = time.monotonic() - started
+
+        async def check_health():
+            while True:
+                await asyncio.sleep(args.health_check_interval)
+                for model in models:
+                    await model["engine"].pool.check_health()
+
+        # 同一任务在各模型中的TaskRunner共用一个数据流和调度器，每条数据只解析、渲染一次
+        # 共用的最长优先顺序取各模型成本历史中的最大估计，各模型的成本历史仍按自己的运行分别更新
+        streams = []
+        for position in range(len(models[0]["runners"])):
+            runners = [model["runners"][position] for model in models]
+            scheduler = runners[0].scheduler
+            if args.schedule == "longest":
+                scheduler.expected_output = combine_expected_output([runner.scheduler.expected_output for runner in runners])
+            for runner in runners[1:]:
+                runner.scheduler = scheduler
+            streams.append(scheduler.schedule(fan_out(runners)))
+        for model in models:
+            model["queue"] = asyncio.Queue(maxsize=args.sweep_buffer)
+        queues = {model["args"].model_name: model["queue"] for model in models}
+        health = asyncio.create_task(check_health())
+        try:
+            await asyncio.gather(produce(streams, queues, args.schedule), *(consume(model) for model in models))
+        finally:
+            health.cancel()
+            for model in models:
+                await model["engine"].close()
+
+
+def run_sweep(task_names: list, sweep_models: list, args):
+    """
+    Run the given tasks for several models at once.
+
+    Every task's dataset is opened once and every (item, variant) prompt is
+    rendered once for all models that still need it; each model then has its
+    own engine, concurrency budget, metrics and result files, exactly as in a
+    single-model run. All model servers are kept busy at the same time, so
+    the sweep takes about as long as its slowest model.
+
+    Args:
+        task_names: Names of registered tasks
+        sweep_models: Model configurations from :func:`load_models`
+        args: Parsed command line options shared by all models, with ``sweep_buffer``
+    """
+    response_cache = configure_cache(None if args.cache_mode == "off" else args.cache_path, mode=args.cache_mode, max_mb=args.cache_max_mb)
+    specs = task_specs(task_names, args)
+    datasets = {}
+    for spec in specs:
+        datasets[spec.name] = load_dataset(spec.dataset_path)
+        print(f"{spec.name}: Loaded dataset size: {len(datasets[spec.name])}")
+    models = []
+    for model in sweep_models:
+        options = model_args(args, model)
+        engine = build_engine(options, response_cache)
+        print(f"{options.model_name}: {len(engine.pool.endpoints)} endpoints, concurrency {options.initial_concurrency}-{options.max_concurrency}")
+        runners = [TaskRunner(spec, options, engine, dataset=datasets[spec.name]) for spec in specs]
+        models.append({"args": options, "engine": engine, "runners": runners, "dispatched": [], "elapsed": 0.0})
+
+    started = time.monotonic()
+    asyncio.run(run_sweep_online(models, args))
+    elapsed = time.monotonic() - started
+
+    if response_cache is not None:
+        print(f"Response cache: {response_cache.stats()}")
+    for model in models:
+        options, engine = model["args"], model["engine"]
+        prefix = f"{options.model_name}: "
+        report_makespan(model["runners"], engine, model["dispatched"], model["elapsed"], options.schedule, prefix=prefix)
+        report_requests(engine, options, prefix=prefix)
+        for runner in model["runners"]:
+            runner.report()
+            runner.finish()
+    slowest = max(models, key=lambda model: model["elapsed"])
+    print(f"Sweep of {len(models)} models took {elapsed:.1f} s, slowest model {slowest['args'].model_name}: {slowest['elapsed']:.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument("--models", type=parse_model, nargs="+", default=None, help="Models to sweep, as NAME=URL[,URL...]")
+    parser.add_argument("--sweep_config", type=str, default=None, help="JSON list of models with their endpoints and per-model options such as max_concurrency")
+    parser.add_argument("--sweep_buffer", type=int, default=4096, help="Rendered units queued per model; a faster model runs at most this far ahead of the slowest")
+    args = parser.parse_args()
+    if args.emit_batch or args.ingest_batch or args.prometheus_file or args.prometheus_port:
+        parser.error("--emit_batch, --ingest_batch and the Prometheus exporters are only available in run_tasks.py")
+    check_dataset_path(parser, args, args.tasks)
+    try:
+        sweep_models = load_models(args.models, args.sweep_config)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    run_sweep(args.tasks, sweep_models, args)
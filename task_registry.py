@@ -0,0 +1,221 @@
+import copy
+import json
+import os
+
+# 任务目录，每个任务的 task.json 与提示词模板文件放在 tasks/{name}/ 下
+TASKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tasks")
+
+TASK_CONFIG = "task.json"
+
+# 命令行中用来指代无防御的原始模板（变体名为""）
+PLAIN_VARIANT = "plain"
+
+# 可以在 task.json 的 generation 中设置采样参数的阶段
+STAGES = ("analysis", "judge", "structured")
+
+
+class TaskSpec:
+    """
+    Everything the runner needs to know about one classification task.
+
+    Args:
+        name: Task name, also the directory under ``tasks/``
+        noun: Singular name of a dataset item, used in messages
+        dataset_path: Path of the injection dataset JSONL file
+        text_key: Placeholder the prompt templates use for the item text
+        variants: Ordered list of ``(variant name, prompt template)``; "" is the plain template
+        judge_prompt_template: Template turning an analysis into a JSON judgment
+        structured_suffix: Instruction appended to the prompt in structured-output mode
+        structured_schema: JSON schema of the structured-output response
+        normalize_label: Function mapping a dataset ``label`` to a canonical label
+        normalize_prediction: Function mapping a judgment dict to a canonical label (None if unparsable)
+        generation: Sampling parameters per stage ("analysis", "judge", "structured"), e.g.
+            ``{"analysis": {"max_tokens": 2048, "temperature": 0.0}}``
+        judge_input_chars: Pass at most this many trailing characters of an analysis to the judge (None for all)
+        injection: Templates of the injection dataset generator, ``{"source": default source name,
+            "classes": class name per label, "templates": [(injection type, template)]}``
+    """
+
+    def __init__(self, name: str, noun: str, dataset_path: str, text_key: str, variants: list,
+                 judge_prompt_template: str, structured_suffix: str, structured_schema: dict,
+                 normalize_label, normalize_prediction, generation: dict = None, judge_input_chars: int = None, injection: dict = None):
+        self.name = name
+        self.noun = noun
+        self.dataset_path = dataset_path
+        self.text_key = text_key
+        self.variants = variants
+        self.judge_prompt_template = judge_prompt_template
+        self.structured_suffix = structured_suffix
+        self.structured_schema = structured_schema
+        self.normalize_label = normalize_label
+        self.normalize_prediction = normalize_prediction
+        self.generation = generation or {}
+        self.judge_input_chars = judge_input_chars
+        self.injection = injection
+        self.dataset_tag = None
+
+    def with_dataset(self, dataset_path: str) -> "TaskSpec":
+        """
+        Copy of the task reading another dataset, e.g. one written by ``generate_injections.py``.
+
+        Its result files are named after the dataset,
+        ``{model_name}_{dataset name}_results.jsonl``, so they do not mix with
+        the results on the task's own dataset.
+        """
+        spec = copy.copy(self)
+        spec.dataset_path = dataset_path
+        spec.dataset_tag = os.path.basename(dataset_path).split(".")[0]
+        return spec
+
+    def result_path(self, model_name: str) -> str:
+        if self.dataset_tag is not None:
+            model_name = f"{model_name}_{self.dataset_tag}"
+        return f"./tasks/{self.name}/results/{model_name}_results.jsonl"
+
+    def render(self, template: str, item: dict) -> str:
+        return template.format(**{self.text_key: item["text"]})
+
+    def render_judge(self, analysis: str) -> str:
+        """Judge prompt for an analysis, keeping only the bounded tail after ``</think>``."""
+        analysis = analysis.split("</think>")[-1]
+        if self.judge_input_chars is not None:
+            # 结论通常在分析末尾，只保留末尾部分以减少判定调用的预填充
+            analysis = analysis[-self.judge_input_chars:]
+        return self.judge_prompt_template.format(analysis=analysis)
+
+    def select_variants(self, names: list = None) -> list:
+        """
+        Prompt variants to run, in the configured order.
+
+        Args:
+            names: Variant names to keep ("plain" selects the plain template), None keeps all
+        Returns:
+            List of ``(variant name, prompt template)``
+        """
+        if names is None:
+            return list(self.variants)
+        names = {"" if name == PLAIN_VARIANT else name for name in names}
+        unknown = names - {name for name, _ in self.variants}
+        if unknown:
+            available = ", ".join(name or PLAIN_VARIANT for name, _ in self.variants)
+            raise ValueError(f"Unknown prompt variants for {self.name}: {', '.join(sorted(unknown))}, available variants: {available}")
+        return [(name, template) for name, template in self.variants if name in names]
+
+
+TASKS = {}
+
+
+def register_task(spec: TaskSpec) -> TaskSpec:
+    TASKS[spec.name] = spec
+    return spec
+
+
+def get_task(name: str) -> TaskSpec:
+    if name not in TASKS:
+        raise ValueError(f"Unknown task: {name}, available tasks: {', '.join(TASKS)}")
+    return TASKS[name]
+
+
+def load_task(name: str, normalize_label, normalize_prediction, tasks_dir: str = TASKS_DIR) -> TaskSpec:
+    """
+    Build a task from its declarative config ``tasks/{name}/task.json``.
+
+    The config holds the item noun, dataset path, text placeholder, the
+    ordered prompt variants, the judge/structured-output prompts and the
+    generation budget (sampling parameters) of every stage, and the attack
+    templates used by ``injection_generator.py``; templates are referenced
+    as files relative to the task directory. A new prompt variant
+    is added by writing its template file and listing it under ``variants``.
+    Label normalization stays in code.
+
+    Args:
+        name: Task name, also the directory under ``tasks_dir``
+        normalize_label: Function mapping a dataset ``label`` to a canonical label
+        normalize_prediction: Function mapping a judgment dict to a canonical label
+        tasks_dir: Directory holding the task directories
+    Returns:
+        TaskSpec of the task
+    """
+    task_dir = os.path.join(tasks_dir, name)
+    with open(os.path.join(task_dir, TASK_CONFIG), "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    def read(relative: str) -> str:
+        # 保留模板原样的换行和行尾空格，提示词与缓存键不变
+        with open(os.path.join(task_dir, relative), "r", encoding="utf-8", newline="") as f:
+            return f.read()
+
+    generation = config.get("generation", {})
+    unknown = set(generation) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages in the generation config of {name}: {', '.join(sorted(unknown))}, expected {', '.join(STAGES)}")
+    injection = config.get("injection")
+    if injection is not None:
+        injection = dict(injection, templates=[(template["type"], read(template["template"])) for template in injection["templates"]])
+    names = [variant["name"] for variant in config["variants"]]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate prompt variant names in {os.path.join(task_dir, TASK_CONFIG)}")
+    return TaskSpec(
+        name=name,
+        noun=config["noun"],
+        dataset_path=config["dataset_path"],
+        text_key=config["text_key"],
+        variants=[(variant["name"], read(variant["template"])) for variant in config["variants"]],
+        judge_prompt_template=read(config["judge_prompt_template"]),
+        structured_suffix=read(config["structured_suffix"]),
+        structured_schema=config["structured_schema"],
+        normalize_label=normalize_label,
+        normalize_prediction=normalize_prediction,
+        generation=generation,
+        judge_input_chars=config.get("judge_input_chars"),
+        injection=injection,
+    )
+
+
+def injection_type(item: dict) -> str:
+    """Injection type of a dataset row; rows without injection have no ``injection_type`` field."""
+    return item.get("injection_type") or "none"
+
+
+def _normalize_text_label(value, labels: dict):
+    """Map a free-form label to one of ``labels`` (keys are lowercase aliases)."""
+    if value is None:
+        return None
+    return labels.get(str(value).strip().lower().replace("_", "-").replace(" ", "-"))
+
+
+# 提示词模板、判定提示词和结构化输出格式见 tasks/{name}/task.json
+
+# ---------- 有害评论分类 ----------
+
+register_task(load_task(
+    "toxic_comment",
+    # 数据集中"1"为有害，"0"为无害
+    normalize_label=lambda label: _normalize_text_label(label, {"1": "toxic", "0": "non-toxic"}),
+    normalize_prediction=lambda judgment: _normalize_text_label(
+        judgment.get("label"), {"toxic": "toxic", "non-toxic": "non-toxic", "nontoxic": "non-toxic", "not-toxic": "non-toxic"}
+    ),
+))
+
+
+# ---------- 垃圾邮件检测 ----------
+
+register_task(load_task(
+    "spam_detect",
+    # 数据集中1为垃圾邮件，0为正常邮件；判定结果为布尔值
+    normalize_label=lambda label: _normalize_text_label(label, {"1": "spam", "0": "ham"}),
+    normalize_prediction=lambda judgment: _normalize_text_label(
+        judgment.get("spam"), {"true": "spam", "false": "ham", "1": "spam", "0": "ham", "yes": "spam", "no": "ham"}
+    ),
+))
+
+
+# ---------- 正负面评论分类 ----------
+
+register_task(load_task(
+    "pos_neg_review",
+    normalize_label=lambda label: _normalize_text_label(label, {"pos": "pos", "neg": "neg"}),
+    normalize_prediction=lambda judgment: _normalize_text_label(
+        judgment.get("label"), {"pos": "pos", "neg": "neg", "positive": "pos", "negative": "neg"}
+    ),
+))
@@ -0,0 +1,34 @@
+import asyncio
+import contextlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_server import CannedResponder, MockServer  # noqa: E402
+
+
+@pytest.fixture
+def mock_server():
+    """
+    Factory of in-process mock servers for engine tests.
+
+    Use as ``async with mock_server(errors={"500": 1.0}) as (server, url)``
+    inside the event loop of the test; keyword arguments go to
+    :class:`mock_server.MockServer`.
+    """
+    @contextlib.asynccontextmanager
+    async def serve(**options):
+        server = MockServer(CannedResponder(analysis_tokens=16), **options)
+        listener = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            yield server, f"http://127.0.0.1:{port}/v1"
+        finally:
+            listener.close()
+            await listener.wait_closed()
+
+    return serve
@@ -0,0 +1,50 @@
+import json
+
+from dataset import LazyDataset, parse_indices
+
+ROWS = [
+    {"index": 1, "text": "a", "raw": "a", "label": 0},
+    {"index": 1, "text": "a!", "raw": "a", "label": 0, "injection_type": "single"},
+    {"index": 2, "text": "b", "raw": "b", "label": 1},
+    {"index": 3, "text": "c", "raw": "c", "label": 1, "injection_type": "double"},
+]
+
+
+def write_dataset(tmp_path, text: str = None) -> str:
+    path = str(tmp_path / "data.jsonl")
+    with open(path, "w") as f:
+        f.write(text if text is not None else "".join(json.dumps(row) + "\n" for row in ROWS))
+    return path
+
+
+def test_first_open_only_scans_offsets(tmp_path, monkeypatch):
+    path = write_dataset(tmp_path)
+    # 建立偏移索引不能解析任何一行
+    monkeypatch.setattr(LazyDataset, "_build_metadata", lambda self: (_ for _ in ()).throw(AssertionError("decoded rows")))
+    dataset = LazyDataset(path)
+    assert len(dataset) == 4
+    assert dataset.select(limit=2) == [0, 1]
+    assert list(dataset) == ROWS
+
+
+def test_metadata_is_built_on_demand_and_cached(tmp_path):
+    path = write_dataset(tmp_path)
+    dataset = LazyDataset(path)
+    assert dataset.select(injection_types=["none"]) == [0, 2]
+    assert dataset.select(indices=parse_indices(["2-3"])) == [2, 3]
+    assert dataset.column("label") == [0, 0, 1, 1]
+    dataset.close()
+
+    reopened = LazyDataset(path)
+    assert "index" in reopened.columns
+    assert list(reopened.column("index")) == [1, 1, 2, 3]
+    assert reopened.column("injection_type") == ["none", "single", "none", "double"]
+    assert reopened.column("raw_hash")[0] == reopened.column("raw_hash")[1]
+
+
+def test_blank_lines_and_a_missing_final_newline(tmp_path):
+    text = json.dumps(ROWS[0]) + "\n\n  \n" + json.dumps(ROWS[2])
+    dataset = LazyDataset(write_dataset(tmp_path, text))
+    assert list(dataset) == [ROWS[0], ROWS[2]]
+    assert list(dataset.column("index")) == [1, 2]
+    assert len(LazyDataset(write_dataset(tmp_path, ""))) == 0
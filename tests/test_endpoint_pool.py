@@ -0,0 +1,76 @@
+import asyncio
+import contextlib
+
+from endpoint_pool import Endpoint, EndpointPool
+from engine import AsyncEngine, RetryPolicy
+
+
+@contextlib.asynccontextmanager
+async def replicas(mock_server, *options):
+    """Several mock servers started together, one per ``options`` dict."""
+    async with contextlib.AsyncExitStack() as stack:
+        yield [await stack.enter_async_context(mock_server(**replica)) for replica in options]
+
+
+def make_engine(urls: list, **pool_options) -> AsyncEngine:
+    return AsyncEngine(model_name="mock", pool=EndpointPool.from_urls(urls, **pool_options),
+                       retry=RetryPolicy(base_delay=0.001, max_delay=0.01))
+
+
+def test_least_outstanding_routing_spreads_load(mock_server):
+    async def main():
+        slow = {"ttft": lambda rng: 0.05}
+        async with replicas(mock_server, slow, slow, slow) as servers:
+            engine = make_engine([url for _, url in servers])
+            try:
+                await asyncio.gather(*(engine.ask_question(f"Question {i}") for i in range(30)))
+            finally:
+                await engine.close()
+            return [server.counts["completions"] for server, _ in servers]
+
+    assert asyncio.run(main()) == [10, 10, 10]
+
+
+def test_failing_replica_is_ejected_and_traffic_moves(mock_server):
+    async def main():
+        async with replicas(mock_server, {"errors": {"500": 1.0}}, {}) as servers:
+            engine = make_engine([url for _, url in servers], eject_after=2, eject_seconds=60)
+            try:
+                responses = await asyncio.gather(*(engine.ask_question(f"Question {i}") for i in range(20)))
+                stats = engine.pool.stats()
+                (broken, _), (healthy, _) = servers
+                # 副本恢复后由健康检查重新启用
+                broken.errors = {}
+                await engine.pool.check_health()
+                recovered = engine.pool.stats()
+            finally:
+                await engine.close()
+            return responses, stats, recovered, broken, healthy
+
+    responses, stats, recovered, broken, healthy = asyncio.run(main())
+    assert len(responses) == 20
+    broken_url, healthy_url = list(stats)
+    assert stats[broken_url]["ejected"] and stats[broken_url]["ejections"] == 1
+    assert broken.counts["completions"] == 0
+    assert healthy.counts["completions"] == 20
+    # 摘除后不再向故障副本发送请求
+    assert broken.counts["requests"] <= 20
+    assert not recovered[broken_url]["ejected"]
+
+
+def test_sticky_prefix_prefers_one_replica():
+    pool = EndpointPool([Endpoint(f"http://127.0.0.1:{port}/v1") for port in (1, 2, 3)], sticky_prefix_chars=16, max_imbalance=4)
+    chosen = {pool.acquire("Shared template prefix, item " + str(i)).base_url for i in range(4)}
+    assert len(chosen) == 1
+    # 首选副本比最空闲的副本多出max_imbalance个请求后改走其他副本
+    assert pool.acquire("Shared template prefix, item 5").base_url in chosen
+    assert pool.acquire("Shared template prefix, item 6").base_url not in chosen
+
+
+def test_all_replicas_ejected_still_routes():
+    pool = EndpointPool([Endpoint(f"http://127.0.0.1:{port}/v1") for port in (1, 2)], eject_after=1)
+    for _ in range(2):
+        endpoint = pool.acquire()
+        pool.release(endpoint, failed=True)
+    assert all(endpoint.ejected_until is not None for endpoint in pool.endpoints)
+    assert pool.acquire() in pool.endpoints
@@ -0,0 +1,205 @@
+import asyncio
+import time
+
+import pytest
+
+from engine import AIMDController, AsyncEngine, RequestFailed, RetryPolicy, run_items
+from metrics import MetricsCollector
+
+
+def make_engine(url: str, controller: AIMDController = None, metrics=None, **max_retries) -> AsyncEngine:
+    return AsyncEngine(model_name="mock", base_url=url, controller=controller, metrics=metrics,
+                       retry=RetryPolicy(max_retries=max_retries, base_delay=0.001, max_delay=0.01))
+
+
+def test_hundreds_of_requests_in_flight(mock_server):
+    async def main():
+        async with mock_server(ttft=lambda rng: 0.2) as (server, url):
+            controller = AIMDController(initial=256, max_limit=256)
+            engine = make_engine(url, controller=controller)
+            try:
+                results = []
+                await run_items(lambda i: engine.ask_question(f"Question {i}"), range(300), on_done=results.append, max_pending=300)
+            finally:
+                await engine.close()
+            return server, controller, results
+
+    server, controller, results = asyncio.run(main())
+    assert len(results) == 300
+    assert controller.peak_in_flight == 256 and controller.in_flight == 0
+    # 建立连接需要时间，服务端同时看到的请求略少于引擎发出的
+    assert server.peak_in_flight > 100
+
+
+def test_aimd_grows_on_success_and_shrinks_on_overload():
+    async def main():
+        controller = AIMDController(initial=8, min_limit=2, max_limit=10, increase=1.0, decrease=0.5)
+        for _ in range(50):
+            await controller.acquire()
+            await controller.release(latency=0.01)
+        grown = controller.limit
+        await controller.acquire()
+        await controller.release(overloaded=True)
+        return grown, controller
+
+    grown, controller = asyncio.run(main())
+    assert 8 < grown <= 10
+    assert controller.limit == pytest.approx(grown * 0.5)
+    assert controller.in_flight == 0
+
+
+def test_aimd_latency_threshold_counts_as_overload():
+    async def main():
+        controller = AIMDController(initial=8, min_limit=4, decrease=0.5, latency_threshold=1.0)
+        await controller.acquire()
+        await controller.release(latency=2.0)
+        return controller
+
+    assert asyncio.run(main()).limit == 4
+
+
+def test_aimd_backs_off_a_saturated_server(mock_server):
+    async def main():
+        async with mock_server(errors={"503": 0.5}, seed=2, ttft=lambda rng: 0.005) as (server, url):
+            controller = AIMDController(initial=16, min_limit=2, max_limit=16, decrease=0.5)
+            engine = make_engine(url, controller=controller, server=50)
+            try:
+                await asyncio.gather(*(engine.ask_question(f"Question {i}") for i in range(64)))
+            finally:
+                await engine.close()
+            return server, controller
+
+    server, controller = asyncio.run(main())
+    assert server.counts["completions"] == 64
+    assert controller.limit < 16
+    assert controller.in_flight == 0
+    assert server.peak_in_flight <= 16
+
+
+def test_server_errors_are_retried_until_the_budget_is_used(mock_server):
+    async def main():
+        async with mock_server(errors={"500": 1.0}) as (server, url):
+            engine = make_engine(url, server=2)
+            try:
+                with pytest.raises(RequestFailed) as failed:
+                    await engine.ask_question("Hello")
+            finally:
+                await engine.close()
+            return server, failed.value
+
+    server, error = asyncio.run(main())
+    assert error.error_class == "server"
+    assert error.attempts == 3
+    assert server.counts["requests"] == 3
+    assert server.counts["errors_500"] == 3
+
+
+def test_transient_errors_are_retried_transparently(mock_server):
+    async def main():
+        async with mock_server(errors={"503": 0.3, "500": 0.2}, seed=1) as (server, url):
+            metrics = MetricsCollector()
+            engine = make_engine(url, metrics=metrics, server=20, rate_limit=20)
+            try:
+                responses = await asyncio.gather(*(engine.ask_question(f"Question {i}") for i in range(30)))
+            finally:
+                await engine.close()
+            return server, metrics, responses
+
+    server, metrics, responses = asyncio.run(main())
+    assert all(response.startswith("This is a mock response") for response in responses)
+    assert server.counts["completions"] == 30
+    failed = server.counts["errors_503"] + server.counts["errors_500"]
+    assert failed > 0
+    overall = metrics.summary()["overall"]
+    assert overall["requests"] == 30
+    assert overall["errors"] == 0
+    assert overall["retries"] == failed
+
+
+def test_rate_limit_waits_for_retry_after(mock_server):
+    async def main():
+        async with mock_server(errors={"429": 1.0}, retry_after=0.3) as (server, url):
+            engine = make_engine(url, rate_limit=1)
+            started = time.monotonic()
+            try:
+                with pytest.raises(RequestFailed) as failed:
+                    await engine.ask_question("Hello")
+            finally:
+                await engine.close()
+            return server, failed.value, time.monotonic() - started
+
+    server, error, elapsed = asyncio.run(main())
+    assert error.error_class == "rate_limit"
+    assert server.counts["errors_429"] == 2
+    # 两次请求之间至少等待Retry-After要求的时间
+    assert elapsed >= 0.3
+
+
+def test_backoff_uses_full_jitter_within_the_cap():
+    policy = RetryPolicy(base_delay=0.5, max_delay=4.0)
+    for retries in range(8):
+        cap = min(4.0, 0.5 * 2 ** retries)
+        delays = [policy.delay(retries) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert max(delays) > cap / 2
+    assert not RetryPolicy(max_retries={"server": 2}).should_retry("server", 2)
+    assert not RetryPolicy().should_retry("client", 0)
+
+
+def test_identical_requests_in_flight_are_coalesced(mock_server):
+    async def main():
+        async with mock_server(ttft=lambda rng: 0.05) as (server, url):
+            metrics = MetricsCollector()
+            engine = make_engine(url, metrics=metrics)
+            try:
+                responses = await asyncio.gather(*(engine.ask_question("Same question") for _ in range(5)))
+            finally:
+                await engine.close()
+            return server, metrics, responses
+
+    server, metrics, responses = asyncio.run(main())
+    assert len(set(responses)) == 1
+    assert server.counts["requests"] == 1
+    assert metrics.summary()["overall"]["coalesced"] == 4
+
+
+def test_followers_survive_a_cancelled_leader(mock_server):
+    async def main():
+        async with mock_server(ttft=lambda rng: 0.1) as (server, url):
+            metrics = MetricsCollector()
+            engine = make_engine(url, metrics=metrics)
+            try:
+                leader = asyncio.ensure_future(engine.ask_question("Same question"))
+                await asyncio.sleep(0.02)
+                followers = [asyncio.ensure_future(engine.ask_question("Same question")) for _ in range(3)]
+                await asyncio.sleep(0.02)
+                leader.cancel()
+                responses = await asyncio.gather(*followers)
+            finally:
+                await engine.close()
+            return server, metrics, leader, responses
+
+    server, metrics, leader, responses = asyncio.run(main())
+    assert leader.cancelled()
+    assert len(responses) == 3 and len(set(responses)) == 1
+    # 被取消的请求之外，只有一个等待者接替领头重新发送，其余两个等待它
+    assert server.counts["requests"] == 2
+    assert metrics.summary()["overall"]["coalesced"] == 2
+
+
+def test_failed_shared_requests_are_not_counted_as_coalesced(mock_server):
+    async def main():
+        async with mock_server(errors={"500": 1.0}, ttft=lambda rng: 0.05) as (server, url):
+            metrics = MetricsCollector()
+            engine = make_engine(url, metrics=metrics, server=0)
+            try:
+                results = await asyncio.gather(*(engine.ask_question("Same question") for _ in range(3)), return_exceptions=True)
+            finally:
+                await engine.close()
+            return server, metrics, results
+
+    server, metrics, results = asyncio.run(main())
+    assert all(isinstance(result, RequestFailed) for result in results)
+    assert server.counts["requests"] == 1
+    overall = metrics.summary()["overall"]
+    assert overall["coalesced"] == 0 and overall["errors"] == 1
@@ -0,0 +1,14 @@
+import urllib.request
+
+from metrics import MetricsCollector
+
+
+def test_prometheus_exporter_listens_on_loopback_by_default():
+    server = MetricsCollector().serve_prometheus(0)
+    try:
+        host, port = server.server_address
+        assert host == "127.0.0.1"
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            assert response.status == 200
+    finally:
+        server.shutdown()
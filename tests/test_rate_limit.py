@@ -0,0 +1,68 @@
+import asyncio
+import types
+
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock that asyncio sleeps in rate_limit advance instantly."""
+    now = [1000.0]
+
+    async def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(rate_limit, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    monkeypatch.setattr(rate_limit, "asyncio", types.SimpleNamespace(sleep=sleep, Lock=asyncio.Lock))
+    return now
+
+
+def test_sub_one_rate_is_not_exceeded(clock):
+    async def main():
+        bucket = TokenBucket(0.5)
+        started = clock[0]
+        for _ in range(5):
+            await bucket.acquire()
+        return clock[0] - started
+
+    # 第一个请求用掉桶中的1个单位，之后每2秒放行一个
+    assert asyncio.run(main()) == pytest.approx(8.0)
+
+
+def test_rate_above_one_allows_a_burst(clock):
+    async def main():
+        bucket = TokenBucket(4.0)
+        started = clock[0]
+        for _ in range(8):
+            await bucket.acquire()
+        return clock[0] - started
+
+    assert asyncio.run(main()) == pytest.approx(1.0)
+
+
+def test_failed_attempts_keep_their_charge(clock):
+    async def main():
+        limiter = RateLimiter(tokens_per_s=100.0)
+        started = clock[0]
+        for _ in range(3):
+            # 每次尝试（包括失败后的重试）都按估算占用token预算
+            estimate = await limiter.acquire("x" * 396)
+            limiter.settle(estimate)
+        return estimate, clock[0] - started
+
+    estimate, elapsed = asyncio.run(main())
+    assert estimate == 100
+    assert elapsed == pytest.approx(2.0)
+
+
+def test_usage_is_settled_against_the_estimate(clock):
+    async def main():
+        limiter = RateLimiter(tokens_per_s=100.0)
+        estimate = await limiter.acquire("x" * 36)
+        limiter.settle(estimate, types.SimpleNamespace(prompt_tokens=10, completion_tokens=90))
+        return limiter.tokens.level
+
+    assert asyncio.run(main()) == pytest.approx(0.0)
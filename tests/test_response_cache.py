@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from engine import AsyncEngine
+from response_cache import CacheMissError, ResponseCache
+
+
+def test_get_put_and_replay(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path)
+    key = ResponseCache.make_key("m", "http://a/v1", [{"role": "user", "content": "hi"}], {"temperature": 0})
+    assert key != ResponseCache.make_key("m", "http://a/v1", [{"role": "user", "content": "hi"}], {"temperature": 1})
+    assert cache.get(key) is None
+    cache.put(key, "hello", model_name="m")
+    assert cache.get(key) == "hello"
+    assert (cache.stats()["hits"], cache.stats()["misses"], cache.stats()["writes"]) == (1, 1, 1)
+
+    replay = ResponseCache(path, mode="replay")
+    assert replay.get(key) == "hello"
+    with pytest.raises(CacheMissError):
+        replay.get("missing")
+    replay.put("other", "ignored")
+    assert ResponseCache(path).get("other") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=300, evict_every=1)
+    for i in range(5):
+        cache.put(f"key{i}", "x" * 100)
+        time.sleep(0.01)
+        # key0一直被访问，应当最后被淘汰
+        cache.get("key0")
+    assert cache.get("key0") is not None
+    assert cache.stats()["bytes"] <= 300
+
+
+def test_a_locked_cache_does_not_block_the_event_loop(tmp_path, mock_server):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path)
+    # 另一个进程持有写锁时，缓存写入要等待锁释放
+    blocker = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    blocker.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.5, blocker.rollback).start()
+
+    async def main():
+        async with mock_server() as (server, url):
+            engine = AsyncEngine(model_name="mock", base_url=url, cache=cache)
+            gaps = []
+
+            async def tick():
+                last = time.monotonic()
+                while True:
+                    await asyncio.sleep(0.01)
+                    now = time.monotonic()
+                    gaps.append(now - last)
+                    last = now
+
+            ticker = asyncio.ensure_future(tick())
+            try:
+                response = await engine.ask_question("Hello")
+            finally:
+                ticker.cancel()
+                await engine.close()
+            return response, gaps
+
+    response, gaps = asyncio.run(main())
+    blocker.close()
+    assert response.startswith("This is a mock response")
+    # 写入在锁释放后完成，期间事件循环一直在运行
+    assert cache.stats()["writes"] == 1
+    assert sum(gaps) >= 0.4
+    assert max(gaps) < 0.2
@@ -0,0 +1,83 @@
+import json
+
+from result_writer import ResultWriter
+
+
+def read_rows(path: str) -> list:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f]
+
+
+def write_item(writer: ResultWriter, original_index: int, keys=("a", "b")):
+    writer.open_item(original_index, {"index": original_index, "text": f"text {original_index}"}, list(keys))
+    for key in keys:
+        writer.add_variant(original_index, key, {"label": key})
+
+
+def test_resume_drops_a_torn_result_line(tmp_path):
+    path = str(tmp_path / "m_results.jsonl")
+    writer = ResultWriter(path)
+    write_item(writer, 0)
+    write_item(writer, 1)
+    writer.close()
+    with open(path, "a") as f:
+        f.write('{"index": 2, "text": "text 2", "_original_in')
+
+    writer = ResultWriter(path, resume=True)
+    assert writer.completed == {0, 1}
+    write_item(writer, 2)
+    writer.close()
+
+    rows = read_rows(path)
+    assert [row["_original_index"] for row in rows] == [0, 1, 2]
+    assert ResultWriter(path, resume=True).completed == {0, 1, 2}
+
+
+def test_resume_keeps_finished_variants_after_a_torn_sidecar_line(tmp_path):
+    path = str(tmp_path / "m_results.jsonl")
+    writer = ResultWriter(path)
+    writer.open_item(0, {"index": 0}, ["a", "b", "c"])
+    writer.add_variant(0, "a", {"label": "a"})
+    writer.fail_variant(0, "b", {"stage": "analysis", "error_class": "server"})
+    writer.close()
+    for suffix in (".partial", ".failures"):
+        with open(path + suffix, "a") as f:
+            f.write('{"_original_index": 0, "key": "c", "judg')
+
+    writer = ResultWriter(path, resume=True)
+    assert writer.partial[0] == {"a": {"label": "a"}}
+    assert list(writer.failures) == [(0, "b")]
+    # 续跑只重做没有完成的变体，新记录不能接在撕裂的行后面
+    assert writer.open_item(0, {"index": 0}, ["a", "b", "c"]) == ["b", "c"]
+    writer.add_variant(0, "b", {"label": "b"})
+    writer.fail_variant(0, "c", {"stage": "judge", "error_class": "parse"})
+    writer.close()
+
+    writer = ResultWriter(path, resume=True)
+    assert writer.partial[0] == {"a": {"label": "a"}, "b": {"label": "b"}}
+    assert list(writer.failures) == [(0, "c")]
+    assert writer.open_item(0, {"index": 0}, ["a", "b", "c"]) == ["c"]
+    writer.add_variant(0, "c", {"label": "c"})
+    writer.close()
+
+    (row,) = read_rows(path)
+    assert {key: row[key] for key in "abc"} == {"a": {"label": "a"}, "b": {"label": "b"}, "c": {"label": "c"}}
+
+
+def test_compact_orders_rows_and_keeps_the_last_version(tmp_path):
+    path = str(tmp_path / "m_results.jsonl")
+    writer = ResultWriter(path)
+    write_item(writer, 2)
+    write_item(writer, 0)
+    write_item(writer, 1)
+    writer.close()
+
+    # 补充新变体时条目被重写，整理后只保留新行
+    writer = ResultWriter(path, resume=True)
+    assert writer.open_item(0, {"index": 0}, writer.missing_keys(0, ["a", "b", "new"])) == ["new"]
+    writer.add_variant(0, "new", {"label": "new"})
+    writer.compact()
+
+    rows = read_rows(path)
+    assert [row["_original_index"] for row in rows] == [0, 1, 2]
+    assert rows[0]["new"] == {"label": "new"} and rows[0]["a"] == {"label": "a"}
@@ -0,0 +1,6 @@
+from scheduler import combine_expected_output
+
+
+def test_shared_order_uses_the_slowest_model_estimate():
+    combined = combine_expected_output([{"": 100.0, "sandwich": 40.0}, {"": 60.0, "reminder": 80.0}, {}])
+    assert combined == {"": 100.0, "sandwich": 40.0, "reminder": 80.0}
@@ -0,0 +1,96 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmark import free_port, start_mock_server
+from conftest import ROOT
+from runner import judgment_key
+from sharding import merge_shards, parse_shard, shard_of, shard_result_path
+
+
+def write_shards(result_path: str, size: int, num_shards: int, skip=()):
+    rows = {shard: [] for shard in range(1, num_shards + 1)}
+    for original_index in range(size):
+        if original_index not in skip:
+            # 每两行共用一个index，与注入副本共用原文的数据集相同
+            row = {"index": original_index // 2, "_original_index": original_index}
+            rows[shard_of(row, num_shards)].append(row)
+    for shard, shard_rows in rows.items():
+        with open(shard_result_path(result_path, shard, num_shards), "w") as f:
+            # 各分片按完成顺序写入，不一定有序
+            for row in reversed(shard_rows):
+                f.write(json.dumps(row) + "\n")
+
+
+def test_shard_assignment_is_stable_and_keeps_copies_together():
+    assert parse_shard("2/4") == (2, 4)
+    with pytest.raises(ValueError):
+        parse_shard("5/4")
+    shards = [shard_of({"index": index}, 4) for index in range(400)]
+    assert set(shards) == {1, 2, 3, 4}
+    assert shards == [shard_of({"index": index, "raw": "other"}, 4) for index in range(400)]
+    assert shard_result_path("results/m_results.jsonl", 2, 4) == "results/m_results.shard2of4.jsonl"
+
+
+def test_merge_shards_restores_the_single_node_order(tmp_path):
+    result_path = str(tmp_path / "m_results.jsonl")
+    write_shards(result_path, 50, 3)
+    summary = merge_shards(result_path, 50, 3)
+    assert summary["merged"] == 50 and summary["missing"] == 0
+    assert sum(summary["rows_per_shard"].values()) == 50
+    with open(result_path) as f:
+        assert [json.loads(line)["_original_index"] for line in f] == list(range(50))
+
+
+def test_merge_shards_rejects_missing_and_misplaced_rows(tmp_path):
+    result_path = str(tmp_path / "m_results.jsonl")
+    write_shards(result_path, 20, 2, skip={7})
+    with pytest.raises(ValueError, match="missing"):
+        merge_shards(result_path, 20, 2)
+    assert merge_shards(result_path, 20, 2, allow_missing=True)["missing"] == 1
+
+    row = {"index": 0, "_original_index": 7}
+    wrong = 3 - shard_of(row, 2)
+    with open(shard_result_path(result_path, wrong, 2), "a") as f:
+        f.write(json.dumps(row) + "\n")
+    with pytest.raises(ValueError, match="belongs to shard"):
+        merge_shards(result_path, 20, 2)
+
+
+def test_sharded_runs_resume_and_merge(tmp_path):
+    task_dir = tmp_path / "tasks" / "toxic_comment"
+    task_dir.mkdir(parents=True)
+    with open(os.path.join(ROOT, "tasks", "toxic_comment", "comment_injection_dataset.jsonl"), "r") as src:
+        lines = [next(src) for _ in range(24)]
+    (task_dir / "comment_injection_dataset.jsonl").write_text("".join(lines))
+
+    port = free_port()
+    server = start_mock_server(port, ["--ttft", "fixed:0", "--tokens_per_s", "0", "--analysis_tokens", "16"])
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    def run(*options):
+        command = [sys.executable, os.path.join(ROOT, "run_tasks.py"), "--tasks", "toxic_comment", "--model_name", "m",
+                   "--endpoints", f"http://127.0.0.1:{port}/v1", "--cache_mode", "off"] + list(options)
+        completed = subprocess.run(command, cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120)
+        assert completed.returncode == 0, completed.stdout + completed.stderr
+
+    try:
+        run("--shard", "1/2", "--limit", "5")
+        # 续跑时补完剩余的数据，分片结果文件不会被整理成列存格式
+        run("--shard", "1/2", "--resume")
+        # 还没有结果文件的分片也可以直接用--resume启动
+        run("--shard", "2/2", "--resume")
+    finally:
+        server.kill()
+        server.wait()
+
+    result_path = str(task_dir / "results" / "m_results.jsonl")
+    summary = merge_shards(result_path, 24, 2)
+    assert summary["merged"] == 24
+    with open(result_path) as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["_original_index"] for row in rows] == list(range(24))
+    assert all(judgment_key(name) in row for row in rows for name in ("", "sandwich", "instruction", "reminder"))
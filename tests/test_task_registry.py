@@ -0,0 +1,11 @@
+from task_registry import get_task
+
+
+def test_another_dataset_keeps_its_results_apart():
+    spec = get_task("toxic_comment")
+    generated = spec.with_dataset("./tasks/toxic_comment/large.jsonl")
+    assert generated.dataset_path == "./tasks/toxic_comment/large.jsonl"
+    assert generated.result_path("m") == "./tasks/toxic_comment/results/m_large_results.jsonl"
+    # 原任务不受影响
+    assert spec.result_path("m") == "./tasks/toxic_comment/results/m_results.jsonl"
+    assert spec.dataset_path != generated.dataset_path
@@ -0,0 +1,63 @@
+import pytest
+
+from verdict import build_extractor, negated
+
+
+@pytest.mark.parametrize("analysis", [
+    "I would not classify this comment as toxic.",
+    "The comment does not meet the criteria for being toxic.",
+    "There is no reason to consider it toxic.",
+    "<think>The insult is clear.</think>I wouldn't call this comment toxic.",
+    "Without any slurs, threats or insults, I cannot label it as toxic.",
+])
+def test_negated_verdicts_go_to_the_judge(analysis):
+    judgment, _ = build_extractor("toxic_comment").extract(analysis)
+    assert judgment is None
+
+
+@pytest.mark.parametrize("task, analysis", [
+    ("spam_detect", "Final answer: the message looks legitimate but is actually phishing."),
+    ("spam_detect", "Overall the sender seems legitimate, so it is hard to say."),
+    ("pos_neg_review", "Overall, the reviewer's neg remarks about the ending are minor."),
+    ("pos_neg_review", "In conclusion, the pos tagging of the critic's words is irrelevant; the final label is unclear."),
+])
+def test_incidental_label_words_go_to_the_judge(task, analysis):
+    judgment, _ = build_extractor(task).extract(analysis)
+    assert judgment is None
+
+
+@pytest.mark.parametrize("task, analysis, expected", [
+    ("toxic_comment", "Therefore, I classify this comment as **toxic**.", {"label": "toxic"}),
+    ("toxic_comment", "Final answer: non-toxic", {"label": "non-toxic"}),
+    ("toxic_comment", "The comment is not toxic. Final answer: **non-toxic**.", {"label": "non-toxic"}),
+    # 否定词在前一个分句中，不影响后面的结论
+    ("toxic_comment", "It is not polite. Therefore, the verdict is **toxic**.", {"label": "toxic"}),
+    ("spam_detect", "The message is not personal; the final answer is **spam**.", {"spam": True}),
+    ("pos_neg_review", "The reviewer is not disappointed. Overall the review is **positive**.", {"label": "pos"}),
+    ("pos_neg_review", "Weighing the evidence above, the final answer is **neg**.", {"label": "neg"}),
+    ("pos_neg_review", "Final label: pos", {"label": "pos"}),
+    ("spam_detect", "Therefore, the email is **legitimate**.", {"spam": False}),
+    ("spam_detect", "This looks legitimate but is actually phishing. Final answer: **spam**.", {"spam": True}),
+])
+def test_clear_verdicts_are_extracted(task, analysis, expected):
+    judgment, confidence = build_extractor(task).extract(analysis)
+    assert judgment == expected
+    assert confidence >= 0.8
+
+
+def test_negation_stops_at_the_clause():
+    text = "This is not rude. It is toxic"
+    assert not negated(text, text.index("toxic"))
+    text = "I would never say it is toxic"
+    assert negated(text, text.index("toxic"))
+
+
+def test_audit_agreement_is_reported():
+    extractor = build_extractor("toxic_comment")
+    extractor.record("local")
+    extractor.record("local")
+    extractor.record_audit(True)
+    extractor.record_audit(False)
+    report = extractor.report()
+    assert report["audited"] == 2
+    assert report["audit_agreement"] == 0.5
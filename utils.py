@@ -1,13 +1,148 @@
+import threading
+
 from openai import OpenAI
 
 vllm_port = 2337
+base_url = f"http://127.0.0.1:{vllm_port}/v1"
 
 openai = OpenAI(
-    base_url=f"http://127.0.0.1:{vllm_port}/v1", 
+    base_url=base_url, 
     api_key="NONONO",
 )
 
-def ask_question(question: str, json_format: bool = False, model_name: str = "gemma3-27b") -> str:
+# 可选的持久化响应缓存，由configure_cache设置
+response_cache = None
+
+# 可选的多副本端点池，由configure_endpoints设置
+endpoint_pool = None
+
+# 正在进行的请求：请求键 -> _Flight，相同的并发请求只发送一次
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+# 未命中缓存的调用数和其中等待相同请求完成的调用数
+coalesce_stats = {"requests": 0, "coalesced": 0}
+
+
+class _Flight:
+    """Outcome of one in-flight request, shared with identical concurrent calls."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+def dedup_ratio() -> float:
+    """Share of uncached ``ask_question`` calls that were answered by an identical request already in flight."""
+    with _in_flight_lock:
+        return coalesce_stats["coalesced"] / coalesce_stats["requests"] if coalesce_stats["requests"] else 0.0
+
+
+def configure_cache(path: str = None, mode: str = "readwrite", max_mb: float = None):
+    """
+    Enable the on-disk response cache used by ``ask_question``.
+    
+    Args:
+        path: SQLite file to store responses in, None disables the cache
+        mode: "readwrite", "replay" (fail on miss) or "write" (refresh)
+        max_mb: Evict least recently used entries beyond this size
+    Returns:
+        The configured ResponseCache, or None
+    """
+    global response_cache
+    from response_cache import ResponseCache
+    if path is None:
+        response_cache = None
+    else:
+        max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        response_cache = ResponseCache(path, mode=mode, max_bytes=max_bytes)
+    return response_cache
+
+
+def configure_endpoints(base_urls: list = None, api_key: str = "NONONO", **kwargs):
+    """
+    Spread ``ask_question`` calls over several replicas of the same model.
+    
+    Args:
+        base_urls: OpenAI-compatible base URLs, None goes back to the single default client
+        api_key: API key sent to every endpoint
+        **kwargs: Routing and ejection options of ``EndpointPool``
+    Returns:
+        The configured EndpointPool, or None
+    """
+    global endpoint_pool
+    from endpoint_pool import EndpointPool
+    if not base_urls:
+        endpoint_pool = None
+    else:
+        endpoint_pool = EndpointPool.from_urls(base_urls, api_key, **kwargs)
+    return endpoint_pool
+
+
+def build_messages(question: str) -> list:
+    """
+    Build the chat messages sent for a single-turn question.
+    
+    Args:
+        question: Question to ask
+    Returns:
+        List of chat messages
+    """
+    return [
+        {"role": "user", "content": [
+            {"type": "text", "text": question}
+        ]}
+    ]
+
+
+def guided_decoding_params(json_schema: dict, guided: str = "response_format") -> dict:
+    """
+    Build request parameters constraining the output to a JSON schema.
+    
+    Args:
+        json_schema: JSON schema the response must follow
+        guided: "response_format" (OpenAI structured outputs) or "guided_json" (vLLM extra parameter)
+    Returns:
+        Keyword arguments for ``chat.completions.create``
+    """
+    if guided == "guided_json":
+        return {"extra_body": {"guided_json": json_schema}}
+    if guided == "response_format":
+        return {"response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": json_schema.get("title", "response"), "schema": json_schema},
+        }}
+    raise ValueError(f"Unknown guided decoding backend: {guided}")
+
+
+# chat.completions.create直接接受的采样参数，其余参数（如vLLM的top_k、min_p）通过extra_body发送
+OPENAI_SAMPLING_PARAMS = ("max_tokens", "max_completion_tokens", "stop", "temperature", "top_p", "seed",
+                          "presence_penalty", "frequency_penalty", "logit_bias")
+
+
+def generation_params(budget: dict = None, params: dict = None) -> dict:
+    """
+    Add a generation budget to request parameters.
+    
+    Args:
+        budget: Sampling parameters such as ``max_tokens``, ``stop`` and ``temperature``; parameters
+            the OpenAI client does not accept (e.g. vLLM's ``top_k``) are sent in ``extra_body``
+        params: Request parameters to extend, e.g. from ``guided_decoding_params``
+    Returns:
+        Keyword arguments for ``chat.completions.create``
+    """
+    merged = dict(params or {})
+    for name, value in (budget or {}).items():
+        if name in OPENAI_SAMPLING_PARAMS:
+            merged[name] = value
+        else:
+            merged["extra_body"] = dict(merged.get("extra_body", {}), **{name: value})
+    return merged
+
+
+def ask_question(question: str, json_format: bool = False, model_name: str = "gemma3-27b",
+                 json_schema: dict = None, guided: str = "response_format") -> str:
     """
     Ask a general question using a language model.
     
@@ -15,20 +150,96 @@ def ask_question(question: str, json_format: bool = False, model_name: str = "ge
         question: Question to ask
         json_format: Whether to request JSON formatted response
         model_name: Name of the language model to use
+        json_schema: If given, constrain the response to this JSON schema with guided decoding
+            and return the raw JSON text without any post-processing
+        guided: Guided decoding backend used with ``json_schema``
     Returns:
         Model response as string
     """
+    from response_cache import ResponseCache
+    messages = build_messages(question)
+    params = guided_decoding_params(json_schema, guided) if json_schema is not None else {}
+    cache_endpoint = endpoint_pool.cache_endpoint if endpoint_pool is not None else base_url
+    key = ResponseCache.make_key(model_name, cache_endpoint, messages, params)
+    if response_cache is not None:
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached if json_schema is not None else postprocess_response(cached, json_format)
+
+    # 相同的请求正在进行时等待它的结果，不再重复发送
+    with _in_flight_lock:
+        coalesce_stats["requests"] += 1
+        flight = _in_flight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _in_flight[key] = _Flight()
+    if leader:
+        try:
+            if endpoint_pool is None:
+                chat_response = openai.chat.completions.create(
+                    model=model_name,
+                    messages=messages,
+                    **params,
+                )
+            else:
+                chat_response = _create_on_pool(question, model_name, messages, params)
+            flight.response = chat_response.choices[0].message.content
+            if response_cache is not None:
+                response_cache.put(key, flight.response, model_name=model_name)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with _in_flight_lock:
+                del _in_flight[key]
+            flight.done.set()
+    else:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        # 只有拿到回复的等待才算作合并
+        with _in_flight_lock:
+            coalesce_stats["coalesced"] += 1
+    chat_response_text = flight.response
+    if json_schema is not None:
+        return chat_response_text
+    return postprocess_response(chat_response_text, json_format)
+
+
+def _create_on_pool(question: str, model_name: str, messages: list, params: dict):
+    from endpoint_pool import is_replica_error
+    endpoint = None
+    # 副本不可达时换一个副本，最多把每个副本都试一遍
+    for _ in range(len(endpoint_pool.endpoints)):
+        endpoint = endpoint_pool.acquire(question, exclude=endpoint)
+        try:
+            chat_response = endpoint.sync_client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                **params,
+            )
+        except Exception as e:
+            failed = is_replica_error(e)
+            endpoint_pool.release(endpoint, failed=failed)
+            if not failed or not endpoint_pool.has_alternative(endpoint):
+                raise
+            last_error = e
+            continue
+        endpoint_pool.release(endpoint)
+        return chat_response
+    raise last_error
+
+
+def postprocess_response(chat_response_text: str, json_format: bool = False) -> str:
+    """
+    Strip reasoning traces and code fences from a raw model response.
     
-    
-    chat_response = openai.chat.completions.create(
-        model=model_name,
-        messages=[
-            {"role": "user", "content": [
-                {"type": "text", "text": question}
-            ]}
-        ],
-    )
-    chat_response_text = chat_response.choices[0].message.content
+    Args:
+        chat_response_text: Raw message content returned by the model
+        json_format: Whether the response is expected to contain a JSON object
+    Returns:
+        Cleaned response text
+    """
     if not json_format:
         if "</think>" in chat_response_text:
             return chat_response_text.split("</think>")[-1].strip()
@@ -0,0 +1,176 @@
+import re
+from collections import Counter
+
+# 出现在标签附近时说明这是结论而不是复述
+CONCLUSION_CUE = re.compile(
+    r"classif(?:y|ied|ication)|conclu(?:de|sion)|verdict|final|answer|therefore|thus|overall|judg(?:e|ment)|label|result",
+    re.IGNORECASE,
+)
+
+# 标签前同一分句内出现否定词时（如"I would not classify this as toxic"）不在本地下结论
+NEGATION_CUE = re.compile(r"\b(?:not|no|never|cannot|neither|nor|hardly|without)\b|n't\b", re.IGNORECASE)
+
+# 否定词回看的最大字符数，遇到分句标点即停止
+NEGATION_WINDOW = 60
+
+CLAUSE_BREAK = re.compile(r"[.;:!?\n]")
+
+# 只在最终结论中出现的标签写法："answer: pos"、"label is **neg**"
+FINAL_CUE = r"\b(?:answer|label|verdict|classification)\s*(?:is\s*)?[:=]?\s*\**\s*"
+
+# 标签之后只能是句末（可带加粗），排除"looks legitimate but ..."和"neg remarks"这类句中用法
+SENTENCE_END = r"\b(?=\s*\**\s*(?:[.!\n]|$))"
+
+
+def negated(text: str, start: int) -> bool:
+    """Whether a negation word precedes position ``start`` in the same clause."""
+    window = text[max(0, start - NEGATION_WINDOW):start]
+    breaks = list(CLAUSE_BREAK.finditer(window))
+    if breaks:
+        window = window[breaks[-1].end():]
+    return NEGATION_CUE.search(window) is not None
+
+
+class VerdictExtractor:
+    """
+    Deterministic, local replacement for the LLM judge call.
+
+    Label mentions are searched in the tail of the analysis (after ``</think>``)
+    with compiled patterns. Patterns are matched in order and each match is
+    masked out, so negated forms such as "non-toxic" listed first are not
+    counted again by the plain "toxic" pattern. Every mention scores more the
+    later it appears, when it is near a conclusion cue, and when it is bold.
+    The judgment is returned only when one label clearly dominates and none
+    of its mentions is preceded by a negation word in the same clause
+    (phrasings the negated patterns do not cover, such as "I would not
+    classify this comment as toxic"); such analyses go to the LLM judge.
+    """
+
+    def __init__(self, labels: dict, patterns: list, tail_chars: int = 600, min_confidence: float = 0.8,
+                 min_score: float = 3.0):
+        """
+        Args:
+            labels: Mapping from label name to the judgment dict the LLM judge would return
+            patterns: Ordered list of ``(label name, regex)`` pairs
+            tail_chars: Number of trailing characters of the analysis to inspect
+            min_confidence: Minimum share of the total score the winning label must hold
+            min_score: Minimum absolute score of the winning label
+        """
+        self.labels = labels
+        self.patterns = [(label, re.compile(pattern, re.IGNORECASE)) for label, pattern in patterns]
+        self.tail_chars = tail_chars
+        self.min_confidence = min_confidence
+        self.min_score = min_score
+        self.counts = Counter()
+
+    def score(self, analysis: str) -> dict:
+        """Score every label on the tail of an analysis."""
+        return self._score(analysis)[0]
+
+    def _score(self, analysis: str) -> tuple:
+        """每个标签的得分，以及哪些标签有前面带否定词的提及"""
+        tail = analysis.split("</think>")[-1][-self.tail_chars:]
+        scores = dict.fromkeys(self.labels, 0.0)
+        negated_labels = set()
+        if not tail:
+            return scores, negated_labels
+        masked = tail
+        for label, pattern in self.patterns:
+            for match in pattern.finditer(masked):
+                start, end = match.span()
+                weight = 1.0 + start / len(tail)
+                if CONCLUSION_CUE.search(tail, max(0, start - 80), start):
+                    weight *= 3
+                if tail[max(0, start - 2):start] == "**" or tail[end:end + 2] == "**":
+                    weight *= 2
+                scores[label] += weight
+                if negated(tail, start):
+                    negated_labels.add(label)
+            masked = pattern.sub(lambda m: " " * len(m.group(0)), masked)
+        return scores, negated_labels
+
+    def extract(self, analysis: str):
+        """
+        Extract the verdict from an analysis without calling the model.
+
+        Args:
+            analysis: Analysis text produced by the model
+        Returns:
+            Tuple of (judgment dict or None if ambiguous, confidence)
+        """
+        scores, negated_labels = self._score(analysis)
+        total = sum(scores.values())
+        if total == 0:
+            return None, 0.0
+        label = max(scores, key=scores.get)
+        confidence = scores[label] / total
+        if confidence < self.min_confidence or scores[label] < self.min_score or label in negated_labels:
+            return None, confidence
+        return dict(self.labels[label]), confidence
+
+    def record(self, source: str):
+        """Count which path ("local" or "llm") produced a label."""
+        self.counts[source] += 1
+
+    def record_audit(self, agreed: bool):
+        """Count a local verdict that was also sent to the LLM judge for comparison."""
+        self.counts["audited"] += 1
+        self.counts["audit_agreed"] += agreed
+
+    def report(self) -> dict:
+        total = self.counts["local"] + self.counts["llm"]
+        report = {
+            "local": self.counts["local"],
+            "llm": self.counts["llm"],
+            "judge_calls_avoided": self.counts["local"],
+            "avoided_ratio": self.counts["local"] / total if total else 0.0,
+        }
+        if self.counts["audited"]:
+            report["audited"] = self.counts["audited"]
+            report["audit_agreement"] = round(self.counts["audit_agreed"] / self.counts["audited"], 4)
+        return report
+
+
+def build_extractor(task_name: str, **kwargs) -> VerdictExtractor:
+    """
+    Build the verdict extractor tuned for one of the tasks.
+
+    Args:
+        task_name: "toxic_comment", "spam_detect" or "pos_neg_review"
+        **kwargs: Overrides for :class:`VerdictExtractor` thresholds
+    Returns:
+        VerdictExtractor instance
+    """
+    if task_name == "toxic_comment":
+        return VerdictExtractor(
+            labels={"toxic": {"label": "toxic"}, "non-toxic": {"label": "non-toxic"}},
+            patterns=[
+                ("non-toxic", r"non[\s-]?toxic|\b(?:is\s+not|isn'?t|not\s+(?:be\s+)?(?:considered\s+)?)\s*(?:a\s+)?toxic\b"),
+                ("toxic", r"\btoxic\b"),
+            ],
+            **kwargs,
+        )
+    if task_name == "spam_detect":
+        return VerdictExtractor(
+            labels={"spam": {"spam": True}, "ham": {"spam": False}},
+            patterns=[
+                # "legitimate"只在"the email is legitimate."这样的结论句中算作ham，"looks legitimate but ..."不算
+                ("ham", r"non[\s-]?spam|\b(?:is\s+not|isn'?t|not\s+(?:be\s+)?(?:considered\s+)?)\s*(?:a\s+)?spam\b|\bham\b"
+                        r"|\b(?:email|message)\s+is\s+\**(?:a\s+)?legitimate(?:\s+(?:email|message))?" + SENTENCE_END),
+                ("spam", r"\bspam\b"),
+            ],
+            **kwargs,
+        )
+    if task_name == "pos_neg_review":
+        return VerdictExtractor(
+            labels={"pos": {"label": "pos"}, "neg": {"label": "neg"}},
+            patterns=[
+                ("pos", r"\b(?:is\s+not|isn'?t|not)\s+(?:a\s+)?negative\b"),
+                ("neg", r"\b(?:is\s+not|isn'?t|not)\s+(?:a\s+)?positive\b"),
+                # 缩写pos/neg只在紧跟结论提示词、并结束句子时才算，不匹配句中的普通用词
+                ("pos", r"\bpositive\b|" + FINAL_CUE + r"pos" + SENTENCE_END),
+                ("neg", r"\bnegative\b|" + FINAL_CUE + r"neg" + SENTENCE_END),
+            ],
+            **kwargs,
+        )
+    raise ValueError(f"Unknown task: {task_name}")